@@ -0,0 +1,91 @@
+"""
+Recall-vs-latency benchmark for the IVF index in LocalVectorStore against exact search.
+
+Synthetic embeddings are drawn around random topic centers, which gives them the
+cluster structure real email embeddings have (uniform random vectors would make any
+ANN index look bad). Queries are perturbed copies of stored vectors.
+
+Usage:
+    python benchmarks/bench_ann.py --emails 200000 --nlist 1024
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('OPENAI_API_KEY2', 'benchmark')
+
+from local_store import LocalVectorStore
+
+
+def synthetic_vectors(rng, count, dimension, topics=1000, noise=1.5):
+    centers = rng.standard_normal((topics, dimension), dtype=np.float32)
+    labels = rng.integers(0, topics, count)
+    vectors = centers[labels] + noise * rng.standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill(store, vectors):
+    started = time.perf_counter()
+    for start in range(0, len(vectors), 5000):
+        store._upsert_vectors([(f"{i:016x}", vectors[i], {"text": ""})
+                               for i in range(start, min(start + 5000, len(vectors)))])
+    store.flush()
+    return time.perf_counter() - started
+
+
+def measure(store, queries, top_k, truth=None, nprobe=None):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        matches = store._query_vectors(query, top_k, nprobe=nprobe)
+        latencies.append(time.perf_counter() - started)
+        results.append([m['id'] for m in matches])
+    recall = None
+    if truth is not None:
+        recall = np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)])
+    return results, np.percentile(latencies, [50, 99]) * 1000, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN recall/latency benchmark")
+    parser.add_argument('--emails', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--quantization', nargs='+', default=['none', 'int8', 'pq'])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(rng, args.emails, args.dimension)
+    picks = rng.choice(args.emails, args.queries, replace=False)
+    queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dimension), dtype=np.float32) / np.sqrt(args.dimension)
+
+    with tempfile.TemporaryDirectory() as path:
+        exact = LocalVectorStore(path=os.path.join(path, "flat"), dimension=args.dimension)
+        fill(exact, vectors)
+        truth, (p50, p99), _ = measure(exact, queries, args.top_k)
+    print(f"emails={args.emails} dimension={args.dimension} top_k={args.top_k} nlist={args.nlist}")
+    print(f"{'index':<10} {'nprobe':>6} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'code MB':>8} {'build s':>8}")
+    print(f"{'exact':<10} {'-':>6} {1.0:>7.3f} {p50:>8.2f} {p99:>8.2f} {vectors.nbytes / 1e6:>8.1f} {'-':>8}")
+
+    for quantization in args.quantization:
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStore(path=path, dimension=args.dimension, index_type="ivf",
+                                     nlist=args.nlist, quantization=None if quantization == 'none' else quantization,
+                                     ivf_min_size=args.emails)
+            build = fill(store, vectors)
+            for nprobe in args.nprobe:
+                _, (p50, p99), recall = measure(store, queries, args.top_k, truth, nprobe)
+                print(f"ivf-{quantization:<6} {nprobe:>6} {recall:>7.3f} {p50:>8.2f} {p99:>8.2f} "
+                      f"{store._ivf.codes.nbytes / 1e6:>8.1f} {build:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark question throughput of Generator.generate_answer vs agenerate_answer.
+
+OpenAI, Cohere and the vector store are replaced by fakes that sleep for a fixed
+latency per call, so the numbers show how well each path overlaps network waits.
+The sync path answers questions one after another; the async path runs them all
+on one event loop.
+
+Usage:
+    python benchmarks/bench_async.py --questions 1 10 100 --query-latency 0.05
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('OPENAI_API_KEY2', 'benchmark')
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+os.makedirs('logs', exist_ok=True)
+
+from clients import set_client
+from utils import set_encoding
+from fakes import FakeOpenAI, FakeAsyncOpenAI, FakeCohere, FakeAsyncCohere, FakeEncoding, make_message
+from generator import Generator
+from reranker import CohereReranker
+from context import get_context_builder
+from vector_db import VectorStore
+
+
+class FakeVectorStore(VectorStore):
+    """Vector store that returns canned chunk matches after a fixed latency."""
+
+    def __init__(self, latency, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+
+    def _matches(self, top_k):
+        matches = []
+        for n in range(top_k):
+            payload = make_message(n)['payload']
+            headers = {header['name']: header['value'] for header in payload['headers']}
+            matches.append({'id': f"{n:016x}#0", 'score': 1.0 - n / top_k, 'metadata': {
+                'text': f"Chunk {n}", 'message_id': f"{n:016x}", 'chunk': 0, 'section': 'body',
+                'sender': headers.get('From', ''), 'subject': headers.get('Subject', '')}})
+        return matches
+
+    def _upsert_vectors(self, vectors):
+        pass
+
+    def _query_vectors(self, vector, top_k, filter=None):
+        time.sleep(self.latency)
+        return self._matches(top_k)
+
+    async def _aquery_vectors(self, vector, top_k, filter=None):
+        await asyncio.sleep(self.latency)
+        return self._matches(top_k)
+
+    def _chunk_ids(self, email_id):
+        return []
+
+    def _delete_vectors(self, ids):
+        pass
+
+    def get_email_count(self):
+        return 0
+
+    def delete_email(self, email_id):
+        pass
+
+    def delete_all_emails(self):
+        pass
+
+
+def make_generator(args):
+    set_encoding(FakeEncoding())
+    set_client("openai", FakeOpenAI(latency=args.embed_latency))
+    set_client("async_openai", FakeAsyncOpenAI(latency=args.embed_latency))
+    generator = Generator.__new__(Generator)
+    generator.client = FakeOpenAI(completion_latency=args.completion_latency,
+                                  first_token_latency=args.first_token_latency)
+    generator.async_client = FakeAsyncOpenAI(completion_latency=args.completion_latency,
+                                             first_token_latency=args.first_token_latency)
+    generator.reranker = CohereReranker(client=FakeCohere(latency=args.rerank_latency),
+                                        async_client=FakeAsyncCohere(latency=args.rerank_latency),
+                                        top_n=args.top_n)
+    generator.top_k = args.top_k
+    generator.context_builder = get_context_builder()
+    generator.pc = FakeVectorStore(latency=args.query_latency)
+    # Every question is distinct work; the answer cache would hide the path being measured
+    generator.answer_cache = None
+    return generator
+
+
+def run_sync(generator, questions):
+    started = time.perf_counter()
+    # generate_answer prints the retrieved emails
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for question in questions:
+            generator.generate_answer(question)
+    return time.perf_counter() - started
+
+
+async def run_async(generator, questions):
+    started = time.perf_counter()
+    await asyncio.gather(*(generator.agenerate_answer(question) for question in questions))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async query path benchmark")
+    parser.add_argument('--questions', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--query-latency', type=float, default=0.05)
+    parser.add_argument('--rerank-latency', type=float, default=0.1)
+    parser.add_argument('--top-k', type=int, default=10, help="Emails retrieved per question")
+    parser.add_argument('--top-n', type=int, default=5, help="Emails kept by the reranker")
+    parser.add_argument('--completion-latency', type=float, default=0.5)
+    parser.add_argument('--first-token-latency', type=float, default=0.1)
+    parser.add_argument('--skip-sync', action='store_true', help="Only run the async path")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    generator = make_generator(args)
+    print(f"{'questions':>9} {'mode':>6} {'seconds':>8} {'questions/s':>12}")
+    for count in args.questions:
+        questions = [f"What was in order {n}?" for n in range(count)]
+        modes = [('async', lambda: asyncio.run(run_async(generator, questions)))]
+        if not args.skip_sync:
+            modes.insert(0, ('sync', lambda: run_sync(generator, questions)))
+        for mode, run in modes:
+            elapsed = run()
+            print(f"{count:>9} {mode:>6} {elapsed:>8.2f} {count / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
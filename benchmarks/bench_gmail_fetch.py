@@ -0,0 +1,51 @@
+"""
+Benchmark MailClient.get_emails against the fake Gmail service.
+
+Compares the old one-request-per-message fetch (parallelism=1, batch_size=1) with
+batched and concurrent fetch modes.
+
+Usage:
+    python benchmarks/bench_gmail_fetch.py --messages 2000 --latency 0.05
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.makedirs('logs', exist_ok=True)
+
+from fakes import FakeGmailService
+from mail import MailClient
+
+
+def run(messages, latency, error_rate, parallelism, batch_size):
+    service = FakeGmailService(num_messages=messages, latency=latency, error_rate=error_rate)
+    client = MailClient(service=service, parallelism=parallelism, batch_size=batch_size)
+    client.BACKOFF_BASE = latency
+    started = time.perf_counter()
+    emails = client.get_emails()
+    elapsed = time.perf_counter() - started
+    return len(emails), elapsed, service.round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gmail fetch benchmark")
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per HTTP round trip')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='Fraction of 429 responses')
+    args = parser.parse_args()
+
+    modes = [(1, 1), (1, 50), (8, 1), (8, 50)]
+    print(f"{'parallelism':>11} {'batch':>6} {'emails':>7} {'seconds':>8} {'emails/s':>9} {'round trips':>12}")
+    for parallelism, batch_size in modes:
+        count, elapsed, round_trips = run(args.messages, args.latency, args.error_rate,
+                                          parallelism, batch_size)
+        print(f"{parallelism:>11} {batch_size:>6} {count:>7} {elapsed:>8.2f} "
+              f"{count / elapsed:>9.1f} {round_trips:>12}")
+
+
+if __name__ == "__main__":
+    main()
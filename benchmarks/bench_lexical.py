@@ -0,0 +1,68 @@
+"""
+Benchmark the BM25 LexicalIndex on synthetic emails.
+
+Reports indexing throughput, on-disk size and query latency percentiles for
+keyword and exact-identifier queries.
+
+Usage:
+    python benchmarks/bench_lexical.py --emails 100000 --queries 200
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import SENDERS, WORDS
+from lexical_index import LexicalIndex
+
+
+def synthetic_chunk(n, rng):
+    subject = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))).capitalize()
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 300)))
+    text = f"From: {rng.choice(SENDERS)}\nSubject: {subject}\n{body}\nReference number: INV-{n:08d}"
+    return (f"{n:016x}#0", text, {'text': body, 'message_id': f"{n:016x}", 'chunk': 0})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lexical index benchmark")
+    parser.add_argument('--emails', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as path:
+        index = LexicalIndex(path=os.path.join(path, "lexical.sqlite"))
+        started = time.perf_counter()
+        for start in range(0, args.emails, 1000):
+            index.add([synthetic_chunk(n, rng) for n in range(start, min(start + 1000, args.emails))])
+        index.flush()
+        insert_seconds = time.perf_counter() - started
+        size = os.path.getsize(index.path)
+
+        for name, make_query in [
+            ("keywords", lambda: " ".join(rng.choice(WORDS) for _ in range(3))),
+            ("identifier", lambda: f"invoice INV-{rng.randrange(args.emails):08d}"),
+        ]:
+            latencies = []
+            for _ in range(args.queries):
+                query = make_query()
+                started = time.perf_counter()
+                index.search(query, args.top_k)
+                latencies.append(time.perf_counter() - started)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(f"query ({name}): p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms")
+
+    print(f"emails={args.emails} top_k={args.top_k}")
+    print(f"insert: {args.emails / insert_seconds:.0f} chunks/s, index size {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark exact top-k search in LocalVectorStore.
+
+Fills a fresh local index with random unit vectors (no embedding calls) and
+reports insert throughput, query latency percentiles and the size of the files a
+search scans. With --quantization int8 it also reports recall against exact float32
+search.
+
+Usage:
+    python benchmarks/bench_local_store.py --emails 100000 --queries 200
+    python benchmarks/bench_local_store.py --emails 100000 --quantization int8
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('OPENAI_API_KEY2', 'benchmark')
+
+from local_store import LocalVectorStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vector store benchmark")
+    parser.add_argument('--emails', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--quantization', choices=['int8'], help='Scan int8 codes and re-score exactly')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(path=path, dimension=args.dimension, quantization=args.quantization)
+
+        started = time.perf_counter()
+        for start in range(0, args.emails, 1000):
+            count = min(1000, args.emails - start)
+            vectors = rng.standard_normal((count, args.dimension), dtype=np.float32)
+            store._upsert_vectors([(f"{start + i:016x}", vectors[i], {"text": ""}) for i in range(count)])
+        insert_seconds = time.perf_counter() - started
+
+        latencies, hits = [], 0
+        for _ in range(args.queries):
+            # Near an existing vector, so the true neighbors stand out from the rest
+            query = store._vectors[rng.integers(args.emails)] + 0.05 * rng.standard_normal(args.dimension, dtype=np.float32)
+            started = time.perf_counter()
+            found = store._query_vectors(query, args.top_k)
+            latencies.append(time.perf_counter() - started)
+            if args.quantization:
+                scores = np.asarray(store._vectors[:args.emails]) @ query
+                expected = {f"{row:016x}" for row in np.argsort(-scores)[:args.top_k]}
+                hits += len(expected & {match['id'] for match in found})
+        scanned = store._codes if args.quantization else store._vectors
+        scanned_mb = scanned[:args.emails].nbytes / (1 << 20)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"emails={args.emails} dimension={args.dimension} top_k={args.top_k} quantization={args.quantization}")
+    print(f"insert: {args.emails / insert_seconds:.0f} vectors/s")
+    print(f"query:  p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms, scanning {scanned_mb:.0f}MB")
+    if args.quantization:
+        print(f"recall@{args.top_k}: {hits / (args.queries * args.top_k):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark MIME parsing throughput of MailClient.iter_fetch_emails.
+
+Fetches a synthetic mailbox from the fake Gmail service (no latency by default, so
+parsing is the bottleneck) with the parsing done in the fetch threads and in process
+pools of increasing size.
+
+Usage:
+    python benchmarks/bench_parse.py --messages 20000 --processes 0 1 2 4 8
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.makedirs('logs', exist_ok=True)
+
+from fakes import FakeGmailService
+from mail import MailClient
+
+
+def run(messages, latency, parallelism, processes):
+    service = FakeGmailService(num_messages=messages, latency=latency)
+    client = MailClient(service=service, parallelism=parallelism, parse_processes=processes)
+    ids = [f"{n:016x}" for n in range(messages)]
+    started = time.perf_counter()
+    count = sum(1 for _ in client.iter_fetch_emails(ids))
+    return count, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MIME parsing benchmark")
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per Gmail round trip')
+    parser.add_argument('--parallelism', type=int, default=8, help='Fetch threads')
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted({0, 1, os.cpu_count() or 1}), help='Parse pool sizes (0: in threads)')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'processes':>9} {'emails':>7} {'seconds':>8} {'emails/s':>9}")
+    for processes in args.processes:
+        count, elapsed = run(args.messages, args.latency, args.parallelism, processes)
+        print(f"{processes:>9} {count:>7} {elapsed:>8.2f} {count / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark process startup: module import, Generator construction and the first answer.
+
+Each run is a fresh interpreter, so nothing is warm. The child process times
+`import <module>` for the entry modules, which heavy SDKs that pulled in, then
+Generator() and its first generate_answer call against the local fakes (OpenAI and
+Pinecone, with no injected latency), which is where anything deferred gets paid for.
+The parent also times the whole interpreter from spawn to exit. Medians over the runs
+are printed, with the raw runs as JSON on stdout.
+
+The first answer counts tokens with tiktoken, whose data is downloaded on first use.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+
+# Modules whose import cost is reported per run
+ENTRY_MODULES = ('utils', 'vector_db', 'generator', 'mail', 'main')
+
+# Third-party SDKs worth knowing about when they load at import time
+HEAVY_MODULES = ('openai', 'pinecone', 'cohere', 'googleapiclient.discovery', 'google_auth_oauthlib', 'tiktoken')
+
+
+def child_main(module):
+    """Time one cold start in this (fresh) process and print the result as JSON."""
+    started = time.perf_counter()
+    __import__(module)
+    import_ms = (time.perf_counter() - started) * 1000
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from clients import set_client
+    from fakes import FakeOpenAI, FakePinecone
+    from generator import Generator
+
+    started = time.perf_counter()
+    generator = Generator()
+    init_ms = (time.perf_counter() - started) * 1000
+
+    set_client("openai", FakeOpenAI(latency=0, completion_latency=0, first_token_latency=0))
+    set_client(("pinecone", os.environ["PINECONE_APT_KEY"]), FakePinecone(latency=0))
+    started = time.perf_counter()
+    generator.generate_answer("What did the bank send me?")
+    first_answer_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({'module': module, 'import_ms': import_ms, 'loaded_at_import': loaded,
+                      'init_ms': init_ms, 'first_answer_ms': first_answer_ms}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module')
+    parser.add_argument('--modules', nargs='+', default=list(ENTRY_MODULES), help='Modules to import first')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, SRC)
+        sys.path.insert(0, BENCHMARKS)
+        child_main(args.child)
+        return
+
+    env = dict(os.environ, OPENAI_API_KEY2='benchmark', PINECONE_APT_KEY='benchmark', VECTOR_BACKEND='pinecone',
+               RERANKER='local', EMBEDDING_CACHE='0', ANSWER_CACHE='0', LEXICAL_INDEX='0', TRACE_LOG='0')
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'logs'))
+        for module in args.modules:
+            runs = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', module],
+                                        cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+                run = json.loads(output.strip().splitlines()[-1])
+                run['process_ms'] = (time.perf_counter() - started) * 1000
+                runs.append(run)
+            medians = {key: round(statistics.median(run[key] for run in runs), 1)
+                       for key in ('import_ms', 'init_ms', 'first_answer_ms', 'process_ms')}
+            print(f"import {module:<10} {medians['import_ms']:>7.1f}ms  Generator() {medians['init_ms']:>6.1f}ms  "
+                  f"first answer {medians['first_answer_ms']:>7.1f}ms  process {medians['process_ms']:>7.1f}ms  "
+                  f"loaded at import: {', '.join(runs[0]['loaded_at_import']) or '-'}", file=sys.stderr)
+            results.append({'module': module, 'median': medians, 'runs': runs})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+End-to-end benchmark of ingest and question answering against local fakes.
+
+For each mailbox size a synthetic Gmail mailbox is synced into a PineconeClient backed
+by an in-memory index (sync.sync_emails, the same path as `main.py --ingest`), then a
+fixed set of questions is answered through Generator.generate_answer. Gmail, OpenAI
+embeddings and chat, Cohere and Pinecone are all replaced by the fakes in fakes.py,
+each with its own injected latency.
+
+Every size runs in a fresh subprocess, so peak memory is measured per size. Results
+are written as JSON: emails/s for the full and the incremental ingest, p50/p95/p99
+question latency, the per-stage latency histograms from tracing.py, peak RSS, and the
+bytes upserted to and returned by the index plus the document store size.
+
+Usage:
+    python benchmarks/bench_suite.py --sizes 1000 10000 --queries 50 --output results.json
+    python benchmarks/bench_suite.py --sizes 1000000 --dimension 64 --gmail-latency 0.01
+    DOC_STORE=0 python benchmarks/bench_suite.py --sizes 10000   # chunk texts in index metadata
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_questions(count, seed=0):
+    """Deterministic questions; about a third name a sender and get filtered."""
+    from fakes import SENDERS, WORDS
+    rng = random.Random(seed)
+    questions = []
+    for n in range(count):
+        topic = " ".join(rng.sample(WORDS, 2))
+        if n % 3 == 0:
+            org = rng.choice(SENDERS).split()[0].lower()
+            questions.append(f"What was the {topic} from {org}?")
+        else:
+            questions.append(f"Show me the {topic} details")
+    return questions
+
+
+def run_size(args, size):
+    """Benchmark one mailbox size in the current process and return its results."""
+    import numpy as np
+    from clients import set_client
+    from utils import set_encoding
+    from fakes import FakeGmailService, FakeOpenAI, FakeCohere, FakeAsyncCohere, FakePinecone, FakeEncoding
+    from mail import MailClient
+    from sync import sync_emails
+    from vector_db import get_vector_store
+    from generator import Generator
+    from reranker import CohereReranker, get_reranker
+    from context import get_context_builder
+    from tracing import get_tracer
+
+    # tiktoken downloads its encodings on first use; the benchmark runs offline
+    set_encoding(FakeEncoding())
+    set_client("openai", FakeOpenAI(latency=args.embed_latency, dimension=args.dimension))
+    pinecone = FakePinecone(dimension=args.dimension, latency=args.pinecone_latency)
+    service = FakeGmailService(num_messages=size, latency=args.gmail_latency, seed=args.seed)
+    mail_client = MailClient(service=service, parallelism=args.fetch_parallelism,
+                             parse_processes=args.parse_processes)
+    store = get_vector_store('pinecone', api_key='benchmark', pc=pinecone, batch_size=args.batch_size,
+                             concurrency=args.concurrency)
+    tracer = get_tracer()
+
+    started = time.perf_counter()
+    counts = sync_emails(mail_client, store, state_path='sync_state.json')
+    ingest_seconds = time.perf_counter() - started
+    ingest = {
+        'emails': counts['upserted'],
+        'seconds': round(ingest_seconds, 3),
+        'emails_per_s': round(counts['upserted'] / ingest_seconds, 1),
+        'gmail_round_trips': service.round_trips,
+        'pinecone_round_trips': store.index.round_trips,
+        'pinecone_upsert_mb': round(store.index.upsert_bytes / (1 << 20), 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+    if store.document_store is not None:
+        ingest['doc_store'] = store.document_store.stats()
+
+    # Incremental sync of 1% new mail, read from the mailbox history
+    added = max(size // 100, 1)
+    service.add_messages(added)
+    started = time.perf_counter()
+    counts = sync_emails(mail_client, store, state_path='sync_state.json')
+    incremental_seconds = time.perf_counter() - started
+    incremental = {
+        'emails': counts['upserted'],
+        'seconds': round(incremental_seconds, 3),
+        'emails_per_s': round(counts['upserted'] / incremental_seconds, 1),
+    }
+    ingest_stages = tracer.stats()
+    tracer.reset()
+
+    generator = Generator.__new__(Generator)
+    generator.client = FakeOpenAI(completion_latency=args.completion_latency, dimension=args.dimension)
+    generator.pc = store
+    generator.answer_cache = None
+    if args.reranker == 'cohere':
+        generator.reranker = CohereReranker(client=FakeCohere(latency=args.rerank_latency),
+                                            async_client=FakeAsyncCohere(latency=args.rerank_latency))
+    else:
+        generator.reranker = get_reranker(args.reranker)
+    generator.top_k = args.top_k
+    generator.context_builder = get_context_builder()
+
+    response_bytes = store.index.response_bytes
+    latencies = []
+    for question in make_questions(args.queries, args.seed):
+        started = time.perf_counter()
+        generator.generate_answer(question)
+        latencies.append(time.perf_counter() - started)
+    p50, p95, p99 = (np.percentile(latencies, [50, 95, 99]) * 1000).round(3).tolist()
+
+    return {
+        'size': size,
+        'ingest': ingest,
+        'incremental_ingest': incremental,
+        'ingest_stages': ingest_stages,
+        'query': {
+            'questions': len(latencies),
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+            'mean_ms': round(float(np.mean(latencies)) * 1000, 3),
+            'pinecone_response_kb': round((store.index.response_bytes - response_bytes) / 1024 / len(latencies), 2),
+            'stages': tracer.stats(),
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def child_main(args):
+    """Entry point of the per-size subprocess: runs in a scratch directory."""
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('logs', exist_ok=True)
+        sys.path.insert(0, SRC)
+        sys.path.insert(0, BENCHMARKS)
+        logging.disable(logging.INFO)
+        result = run_size(args, args.size)
+    with open(args.result_file, 'w') as f:
+        json.dump(result, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest and query benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='Mailbox sizes to benchmark (up to 1000000)')
+    parser.add_argument('--queries', type=int, default=50, help='Questions answered per size')
+    parser.add_argument('--dimension', type=int, default=1536,
+                        help='Embedding dimension; lower it to fit large mailboxes in memory')
+    parser.add_argument('--gmail-latency', type=float, default=0.05, help='Seconds per Gmail round trip')
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='Seconds per embeddings request')
+    parser.add_argument('--pinecone-latency', type=float, default=0.02, help='Seconds per Pinecone request')
+    parser.add_argument('--rerank-latency', type=float, default=0.1, help='Seconds per Cohere rerank')
+    parser.add_argument('--completion-latency', type=float, default=0.5, help='Seconds per chat completion')
+    parser.add_argument('--reranker', choices=['cohere', 'local', 'none'], default='local')
+    parser.add_argument('--top-k', type=int, default=3, help='Emails retrieved per question')
+    parser.add_argument('--batch-size', type=int, default=100, help='Chunks per embedding/upsert batch')
+    parser.add_argument('--concurrency', type=int, default=4, help='Ingest batches in flight per stage')
+    parser.add_argument('--fetch-parallelism', type=int, default=8, help='Threads fetching from Gmail')
+    parser.add_argument('--parse-processes', type=int, help='Processes parsing MIME bodies (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        child_main(args)
+        return
+
+    env = dict(os.environ, OPENAI_API_KEY2=os.getenv('OPENAI_API_KEY2', 'benchmark'),
+               EMBEDDING_CACHE='0', ANSWER_CACHE='0', TRACE_LOG='0')
+    results = []
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            result_file = f.name
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                            '--size', str(size), '--result-file', result_file], env=env, check=True)
+            with open(result_file) as f:
+                result = json.load(f)
+        finally:
+            os.remove(result_file)
+        print(f"{size:>8} emails: ingest {result['ingest']['emails_per_s']:.0f} emails/s, "
+              f"query p50 {result['query']['p50_ms']:.0f}ms p99 {result['query']['p99_ms']:.0f}ms, "
+              f"peak {result['peak_rss_mb']:.0f}MB", file=sys.stderr)
+        results.append(result)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('size', 'result_file', 'output')}
+    report = json.dumps({'config': config, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
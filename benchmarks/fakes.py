@@ -0,0 +1,546 @@
+"""
+Deterministic local stand-ins for the remote services used by the chatbot.
+
+The fakes mimic just enough of each client library's surface for the code in `src/`
+to run unchanged, and inject a configurable latency per round trip so that
+batching and concurrency gains show up the same way they would against the
+real APIs. Scripts put `src/` on sys.path before importing this module.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import httplib2
+import numpy as np
+from googleapiclient.errors import HttpError
+
+SENDERS = [
+    "Amazon <auto-confirm@amazon.in>",
+    "Rapido <noreply@rapido.bike>",
+    "GitHub <noreply@github.com>",
+    "Swiggy <noreply@swiggy.in>",
+    "HDFC Bank <alerts@hdfcbank.net>",
+    "Medium Daily Digest <noreply@medium.com>",
+]
+
+WORDS = (
+    "invoice order shipped delivered payment refund meeting schedule update account "
+    "statement receipt ride amount total subscription newsletter report review project "
+    "deadline travel booking confirmed ticket reminder balance transaction summary"
+).split()
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def _html(body):
+    paragraphs = "".join(f"<p>{line.replace('&', '&amp;')}</p>" for line in body.split("\n"))
+    return ("<html><head><style>p { margin: 0 0 12px; } td { font-family: Arial; }</style></head>"
+            f"<body><table width=\"100%\"><tr><td>{paragraphs}</td></tr></table>"
+            "<div style=\"font-size:11px\">You received this email because you have an account.</div>"
+            "</body></html>")
+
+
+def make_message(n, seed=0):
+    """
+    Build the n-th synthetic Gmail message resource (format='full').
+
+    Messages rotate through the common MIME shapes: plain text and HTML alternatives,
+    HTML only, alternatives nested in multipart/mixed next to an attachment, and plain
+    text only.
+    """
+    rng = random.Random(seed * 1_000_003 + n)
+    sender = rng.choice(SENDERS)
+    subject = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))).capitalize()
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 400)))
+    body += f"\nReference number: {n:08d}"
+    headers = [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': subject}]
+    plain = {'mimeType': 'text/plain', 'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+             'body': {'data': _b64(body)}}
+    html_body = _html(body)
+    html = {'mimeType': 'text/html', 'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'}],
+            'body': {'data': _b64(html_body)}}
+    alternative = {'mimeType': 'multipart/alternative', 'parts': [plain, html]}
+    shape = n % 4
+    if shape == 0:
+        payload, size = {**alternative, 'headers': headers}, len(body) + len(html_body)
+    elif shape == 1:
+        payload, size = {**html, 'headers': headers + html['headers']}, len(html_body)
+    elif shape == 2:
+        attachment = {'mimeType': 'application/pdf', 'filename': f"invoice-{n}.pdf",
+                      'body': {'attachmentId': f"att-{n}", 'size': 48213}}
+        payload = {'mimeType': 'multipart/mixed', 'headers': headers, 'parts': [alternative, attachment]}
+        size = len(body) + len(html_body) + attachment['body']['size']
+    else:
+        payload, size = {**plain, 'headers': headers + plain['headers']}, len(body)
+    return {
+        'id': f"{n:016x}",
+        'threadId': f"{n // 3:016x}",
+        'labelIds': ['INBOX', 'CATEGORY_PERSONAL'],
+        'internalDate': str(1_700_000_000_000 + n * 60_000),
+        'sizeEstimate': size + len(subject) + len(sender) + 200,
+        'payload': payload,
+    }
+
+
+class _FakeRequest:
+    def __init__(self, service, fn):
+        self.service = service
+        self.fn = fn
+
+    def execute(self, http=None):
+        self.service._round_trip()
+        self.service._maybe_fail()
+        return self.fn()
+
+
+class _FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self, http=None):
+        # One round trip for the whole batch; each part can still be rate limited
+        self.service._round_trip()
+        for request_id, request, callback in self.requests:
+            callback = callback or self.callback
+            try:
+                self.service._maybe_fail()
+                response, exception = request.fn(), None
+            except HttpError as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', startHistoryId=None, historyTypes=None, labelId=None, pageToken=None, **kwargs):
+        def fn():
+            start = int(startHistoryId)
+            # Gmail only keeps about a week of history; model that as a fixed window
+            if start < self.service.last_history_id - 100_000:
+                raise HttpError(httplib2.Response({'status': 404}), b'Requested entity was not found.')
+            records = [{'id': str(history_id), kind: [{'message': {'id': msg_id}}]}
+                       for history_id, kind, msg_id in self.service.changes if history_id > start]
+            return {'history': records, 'historyId': str(self.service.last_history_id)}
+        return _FakeRequest(self.service, fn)
+
+
+class FakeGmailService:
+    """
+    In-memory Gmail API service exposing users().messages().list/get, getProfile,
+    users().history().list and batch requests.
+
+    Args:
+        num_messages: Size of the synthetic mailbox
+        latency: Seconds slept per HTTP round trip (single request or whole batch)
+        error_rate: Fraction of requests answered with a 429 rate-limit error
+        seed: Seed for the synthetic content and the error injection
+    """
+
+    def __init__(self, num_messages=1000, latency=0.05, error_rate=0.0, seed=0):
+        self.num_messages = num_messages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.round_trips = 0
+        self.deleted = set()
+        self.changes = []   # (history_id, kind, message_id)
+        self.last_history_id = num_messages
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _record(self, kind, msg_id):
+        self.last_history_id += 1
+        self.changes.append((self.last_history_id, kind, msg_id))
+
+    def add_messages(self, count):
+        """Deliver `count` new messages, recording them in the mailbox history."""
+        for n in range(self.num_messages, self.num_messages + count):
+            self._record('messagesAdded', f"{n:016x}")
+        self.num_messages += count
+
+    def delete_messages(self, msg_ids):
+        """Delete messages, recording them in the mailbox history."""
+        for msg_id in msg_ids:
+            self.deleted.add(msg_id)
+            self._record('messagesDeleted', msg_id)
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _maybe_fail(self):
+        with self._lock:
+            fail = self.error_rate and self._rng.random() < self.error_rate
+        if fail:
+            raise HttpError(httplib2.Response({'status': 429}), b'Rate Limit Exceeded')
+
+    # The Gmail client chains users().messages().<method>(...) and users().history().list(...)
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return _FakeHistory(self)
+
+    def getProfile(self, userId='me'):
+        return _FakeRequest(self, lambda: {'emailAddress': 'me@example.com',
+                                           'messagesTotal': self.num_messages - len(self.deleted),
+                                           'historyId': str(self.last_history_id)})
+
+    def list(self, userId='me', q=None, maxResults=100, pageToken=None, **kwargs):
+        def fn():
+            start = int(pageToken or 0)
+            end = min(start + maxResults, self.num_messages)
+            result = {'messages': [{'id': f"{n:016x}", 'threadId': f"{n // 3:016x}"}
+                                   for n in range(start, end) if f"{n:016x}" not in self.deleted],
+                      'resultSizeEstimate': self.num_messages}
+            if end < self.num_messages:
+                result['nextPageToken'] = str(end)
+            if start >= end:
+                result.pop('messages')
+            return result
+        return _FakeRequest(self, fn)
+
+    def get(self, userId='me', id=None, format='full', **kwargs):
+        return _FakeRequest(self, lambda: make_message(int(id, 16), self.seed))
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+
+class FakeEncoding:
+    """
+    Stand-in for a tiktoken encoding, which has to be downloaded on first use: every
+    four characters make a token, roughly the density of English text.
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return [text[start:start + 4] for start in range(0, len(text), 4)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def fake_embedding(text, dimension=1536):
+    """Deterministic pseudo-embedding of a text."""
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    return np.random.default_rng(seed).standard_normal(dimension, dtype=np.float32).tolist()
+
+
+class _FakeEmbeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def _response(self, input, model):
+        texts = [input] if isinstance(input, str) else input
+        data = [SimpleNamespace(embedding=fake_embedding(text, self._owner.dimension)) for text in texts]
+        # Roughly four characters per token
+        usage = SimpleNamespace(prompt_tokens=sum(len(text) for text in texts) // 4)
+        return SimpleNamespace(data=data, model=model, usage=usage)
+
+    def create(self, input, model):
+        time.sleep(self._owner.latency)
+        return self._response(input, model)
+
+
+class _FakeAsyncEmbeddings(_FakeEmbeddings):
+    async def create(self, input, model):
+        await asyncio.sleep(self._owner.latency)
+        return self._response(input, model)
+
+
+class _FakeCompletions:
+    """
+    chat.completions with `stream=True` support: the first token arrives after
+    first_token_latency and the rest are spread evenly over the remaining time.
+    """
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def _answer(self, messages):
+        return f"Answer based on {len(messages[-1]['content'])} characters of context."
+
+    def _response(self, model, messages):
+        message = SimpleNamespace(content=self._answer(messages))
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)])
+
+    def _stream_plan(self, messages):
+        """(delay, chunk) pairs for a streamed answer."""
+        tokens = [f"{word} " for word in self._answer(messages).split()]
+        first = self._owner.first_token_latency
+        rest = max(self._owner.completion_latency - first, 0) / max(len(tokens) - 1, 1)
+        return [(first if i == 0 else rest,
+                 SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))]))
+                for i, token in enumerate(tokens)]
+
+    def _stream(self, messages):
+        for delay, chunk in self._stream_plan(messages):
+            time.sleep(delay)
+            yield chunk
+
+    def create(self, model, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream(messages)
+        time.sleep(self._owner.completion_latency)
+        return self._response(model, messages)
+
+
+class _FakeAsyncCompletions(_FakeCompletions):
+    async def _stream(self, messages):
+        for delay, chunk in self._stream_plan(messages):
+            await asyncio.sleep(delay)
+            yield chunk
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream(messages)
+        await asyncio.sleep(self._owner.completion_latency)
+        return self._response(model, messages)
+
+
+class FakeOpenAI:
+    """Stand-in for openai.OpenAI: embeddings.create and chat.completions.create."""
+
+    _embeddings = _FakeEmbeddings
+    _completions = _FakeCompletions
+
+    def __init__(self, latency=0.05, completion_latency=0.5, first_token_latency=0.1, dimension=1536):
+        self.latency = latency
+        self.completion_latency = completion_latency
+        self.first_token_latency = first_token_latency
+        self.dimension = dimension
+        self.embeddings = self._embeddings(self)
+        self.chat = SimpleNamespace(completions=self._completions(self))
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """Stand-in for openai.AsyncOpenAI."""
+
+    _embeddings = _FakeAsyncEmbeddings
+    _completions = _FakeAsyncCompletions
+
+
+class FakeCohere:
+    """Stand-in for cohere.Client: rerank keeps the documents in their given order."""
+
+    def __init__(self, latency=0.1):
+        self.latency = latency
+
+    def _response(self, documents, top_n):
+        return SimpleNamespace(results=[SimpleNamespace(index=i, relevance_score=1.0 - i / len(documents))
+                                        for i in range(min(top_n, len(documents)))])
+
+    def rerank(self, model, documents, query, top_n=None, **kwargs):
+        time.sleep(self.latency)
+        return self._response(documents, top_n or len(documents))
+
+
+class FakeAsyncCohere(FakeCohere):
+    """Stand-in for cohere.AsyncClient."""
+
+    async def rerank(self, model, documents, query, top_n=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(documents, top_n or len(documents))
+
+
+class _FakeNamespace:
+    """The vectors of one namespace: a normalized float32 matrix plus IDs and metadata."""
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.vectors = np.zeros((1024, dimension), dtype=np.float32)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.rows = {}          # id -> row
+        self.ids = []
+        self.metadata = []
+
+    def _grow(self, size):
+        capacity = len(self.alive)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        extra = capacity - len(self.alive)
+        self.vectors = np.vstack([self.vectors, np.zeros((extra, self.dimension), dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def upsert(self, vectors):
+        for vector_id, values, metadata in vectors:
+            row = self.rows.get(vector_id)
+            if row is None:
+                row = self.rows[vector_id] = len(self.ids)
+                self._grow(row + 1)
+                self.ids.append(vector_id)
+                self.metadata.append(metadata)
+            self.metadata[row] = metadata
+            vector = np.asarray(values, dtype=np.float32)
+            self.vectors[row] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+            self.alive[row] = True
+
+    def search(self, vector, top_k, filter):
+        from filters import matches_filter
+
+        size = len(self.ids)
+        if size == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors[:size] @ query
+        scores[~self.alive[:size]] = -np.inf
+        order = np.argsort(-scores) if filter else np.argsort(-scores)[:top_k]
+        matches = []
+        for row in order:
+            if scores[row] == -np.inf or len(matches) == top_k:
+                break
+            if filter and not matches_filter(self.metadata[row], filter):
+                continue
+            matches.append({'id': self.ids[row], 'score': float(scores[row]), 'metadata': self.metadata[row]})
+        return matches
+
+    def delete(self, ids):
+        for vector_id in ids:
+            row = self.rows.pop(vector_id, None)
+            if row is not None:
+                self.alive[row] = False
+
+
+class FakePineconeIndex:
+    """
+    In-memory stand-in for a Pinecone index: upsert, query (cosine, with metadata
+    filters), list, delete and describe_index_stats, per namespace.
+
+    Each namespace keeps its vectors normalized in its own float32 matrix, so a query
+    is a single matrix-vector product over that namespace only, as with Pinecone's
+    per-namespace storage; filters are checked on the best-scoring rows until top_k of
+    them match.
+
+    upsert_bytes and response_bytes add up the JSON size of what upserts send (values and
+    metadata) and queries return, as a measure of index size and network payload.
+    """
+
+    def __init__(self, dimension=1536, latency=0.02):
+        self.dimension = dimension
+        self.latency = latency
+        self.round_trips = 0
+        self.upsert_bytes = 0
+        self.response_bytes = 0
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        self._round_trip()
+        size = sum(len(vector_id) + 4 * len(values) + len(json.dumps(metadata)) for vector_id, values, metadata in vectors)
+        with self._lock:
+            self.upsert_bytes += size
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = _FakeNamespace(self.dimension)
+            self._namespaces[namespace].upsert(vectors)
+        return {'upserted_count': len(vectors)}
+
+    def _search(self, vector, top_k, namespace, filter):
+        with self._lock:
+            space = self._namespaces.get(namespace)
+            matches = space.search(vector, top_k, filter) if space else []
+            self.response_bytes += len(json.dumps(matches))
+        return {'matches': matches, 'namespace': namespace}
+
+    def query(self, vector, top_k=10, namespace="", filter=None, include_metadata=True, **kwargs):
+        self._round_trip()
+        return self._search(vector, top_k, namespace, filter)
+
+    def list(self, prefix="", namespace="", limit=100, **kwargs):
+        """Yield pages of vector IDs starting with prefix."""
+        self._round_trip()
+        with self._lock:
+            space = self._namespaces.get(namespace)
+            ids = [vector_id for vector_id in space.rows if vector_id.startswith(prefix)] if space else []
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def delete(self, ids=None, delete_all=False, namespace="", **kwargs):
+        self._round_trip()
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+            elif namespace in self._namespaces:
+                self._namespaces[namespace].delete(ids or [])
+        return {}
+
+    def describe_index_stats(self, **kwargs):
+        self._round_trip()
+        with self._lock:
+            counts = {namespace: len(space.rows) for namespace, space in self._namespaces.items() if space.rows}
+        return {'dimension': self.dimension, 'total_vector_count': sum(counts.values()),
+                'namespaces': {namespace: {'vector_count': count} for namespace, count in counts.items()}}
+
+
+class FakeAsyncPineconeIndex:
+    """Stand-in for pinecone's IndexAsyncio over the same in-memory data as a FakePineconeIndex."""
+
+    def __init__(self, index):
+        self._index = index
+
+    async def query(self, vector, top_k=10, namespace="", filter=None, include_metadata=True, **kwargs):
+        with self._index._lock:
+            self._index.round_trips += 1
+        if self._index.latency:
+            await asyncio.sleep(self._index.latency)
+        return self._index._search(vector, top_k, namespace, filter)
+
+    async def close(self):
+        pass
+
+
+class FakePinecone:
+    """
+    Stand-in for pinecone.Pinecone. Indexes are created with the fake's `dimension`
+    whatever the caller asks for, so benchmarks can shrink vectors to fit big mailboxes
+    in memory (FakeOpenAI must then use the same dimension).
+    """
+
+    def __init__(self, api_key=None, dimension=1536, latency=0.02):
+        self.dimension = dimension
+        self.latency = latency
+        self.indexes = {}
+
+    def list_indexes(self):
+        names = list(self.indexes)
+        return SimpleNamespace(names=lambda: names)
+
+    def create_index(self, name, dimension=None, metric='cosine', spec=None, **kwargs):
+        self.indexes.setdefault(name, FakePineconeIndex(self.dimension, self.latency))
+
+    def Index(self, name=None, host=None, **kwargs):
+        return self.indexes[name or host]
+
+    def describe_index(self, name):
+        return SimpleNamespace(name=name, host=name, dimension=self.dimension)
+
+    def IndexAsyncio(self, host, **kwargs):
+        return FakeAsyncPineconeIndex(self.indexes[host])
@@ -0,0 +1,292 @@
+import os
+import logging
+import numpy as np
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 10, spherical: bool = False,
+           seed: int = 0) -> np.ndarray:
+    """
+    Lloyd's k-means on the rows of `data`.
+
+    Args:
+        data (np.ndarray): (n, d) float32 training vectors
+        k (int): Number of centroids
+        iterations (int, optional): Lloyd iterations. Defaults to 10.
+        spherical (bool, optional): Assign by inner product and keep centroids unit-length,
+            which suits normalized embeddings compared by cosine. Defaults to False.
+        seed (int, optional): Seed for the initial centroid sample. Defaults to 0.
+
+    Returns:
+        np.ndarray: (k, d) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(data, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        # Re-seed empty clusters from random points so every centroid stays useful
+        sums[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        counts[empty] = 1
+        centroids = sums / counts[:, None].astype(np.float32)
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray, spherical: bool, chunk: int = 65536) -> np.ndarray:
+    """Index of the nearest centroid for every row, computed in chunks to bound memory."""
+    out = np.empty(len(data), dtype=np.int32)
+    sq_norms = None if spherical else (centroids ** 2).sum(axis=1)
+    for start in range(0, len(data), chunk):
+        sims = data[start:start + chunk] @ centroids.T
+        if not spherical:
+            sims = 2 * sims - sq_norms
+        out[start:start + chunk] = sims.argmax(axis=1)
+    return out
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbor index over normalized vectors.
+
+    Vectors are clustered around `nlist` centroids; a query scans only the `nprobe`
+    closest clusters. Candidates can be scored from compact codes instead of the full
+    float32 vectors:
+        quantization=None     score candidates exactly from the float32 vectors
+        quantization="int8"   per-dimension scalar quantization (4x smaller)
+        quantization="pq"     product quantization with `pq_m` one-byte sub-codes
+                              (1536 dims, pq_m=96 -> 64x smaller, pq_m=384 -> 16x)
+    With quantization, the best `rerank_factor * top_k` candidates are re-scored exactly
+    against the float32 vectors (at least MIN_RERANK of them).
+
+    The index does not own the float32 vectors; callers pass the matrix on every call.
+    Rows are the row numbers of that matrix. Deleted or moved rows are filtered lazily
+    through the `assign` array and the caller's live-row mask.
+    """
+
+    MIN_RERANK = 64
+
+    def __init__(self, dimension: int, nlist: int = 1024, nprobe: int = 16,
+                 quantization: Optional[str] = None, pq_m: int = 96, rerank_factor: int = 10):
+        """
+        Args:
+            dimension (int): Vector dimension
+            nlist (int, optional): Number of clusters. ~sqrt(N) to 4*sqrt(N) works well. Defaults to 1024.
+            nprobe (int, optional): Clusters scanned per query; higher is slower and more accurate. Defaults to 16.
+            quantization (str, optional): None, "int8" or "pq". Defaults to None.
+            pq_m (int, optional): Number of PQ sub-quantizers; must divide dimension. Defaults to 96.
+            rerank_factor (int, optional): Candidates re-scored exactly per result. Defaults to 10.
+        """
+        if quantization not in (None, "int8", "pq"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if quantization == "pq" and dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the dimension {dimension}")
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.pq_m = pq_m
+        self.rerank_factor = rerank_factor
+
+        self.centroids: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None        # int8: per-dimension scale
+        self.codebooks: Optional[np.ndarray] = None     # pq: (pq_m, 256, dimension // pq_m)
+        self.assign = np.full(0, -1, dtype=np.int32)    # cluster of each row, -1 if unindexed
+        self.codes = np.zeros((0, self.code_size), dtype=self.code_dtype)
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def code_size(self) -> int:
+        return {None: 0, "int8": self.dimension, "pq": self.pq_m}[self.quantization]
+
+    @property
+    def code_dtype(self):
+        return np.int8 if self.quantization == "int8" else np.uint8
+
+    def train(self, vectors: np.ndarray, rows: np.ndarray, sample_size: int = 100000) -> None:
+        """
+        Learn centroids (and quantizers) from a sample of rows, then index all of `rows`.
+
+        Args:
+            vectors (np.ndarray): Matrix holding the vectors
+            rows (np.ndarray): Rows to train on and index
+            sample_size (int, optional): Maximum training sample. Defaults to 100000.
+        """
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(rows, min(sample_size, len(rows)), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+        nlist = min(self.nlist, max(1, len(rows) // 39))
+        logger.info(f"Training IVF index: {nlist} lists on {len(sample)} vectors, quantization={self.quantization}")
+
+        self.centroids = kmeans(sample, nlist, spherical=True)
+        if self.quantization == "int8":
+            self.scales = np.maximum(np.abs(sample).max(axis=0), 1e-6).astype(np.float32)
+        elif self.quantization == "pq":
+            # 100 points per sub-centroid is plenty for 256-entry codebooks
+            sub = self.dimension // self.pq_m
+            pq_sample = sample[:25600]
+            self.codebooks = np.stack([
+                kmeans(pq_sample[:, j * sub:(j + 1) * sub], 256, iterations=8, seed=j)
+                for j in range(self.pq_m)
+            ])
+
+        self.assign = np.full(0, -1, dtype=np.int32)
+        self.codes = np.zeros((0, self.code_size), dtype=self.code_dtype)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = [None] * len(self.centroids)
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            self.add(chunk, np.asarray(vectors[chunk], dtype=np.float32))
+
+    def _encode(self, matrix: np.ndarray) -> np.ndarray:
+        if self.quantization == "int8":
+            return np.clip(np.rint(matrix / self.scales * 127), -127, 127).astype(np.int8)
+        if self.quantization == "pq":
+            sub = self.dimension // self.pq_m
+            return np.stack([
+                _nearest(matrix[:, j * sub:(j + 1) * sub], self.codebooks[j], spherical=False)
+                for j in range(self.pq_m)
+            ], axis=1).astype(np.uint8)
+        return np.zeros((len(matrix), 0), dtype=np.uint8)
+
+    def _grow(self, size: int) -> None:
+        if size <= len(self.assign):
+            return
+        capacity = max(size, len(self.assign) * 2, 1024)
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:len(self.assign)] = self.assign
+        codes = np.zeros((capacity, self.code_size), dtype=self.code_dtype)
+        codes[:len(self.codes)] = self.codes
+        self.assign, self.codes = assign, codes
+
+    def add(self, rows: np.ndarray, matrix: np.ndarray) -> None:
+        """
+        Index (or re-index) rows after their vectors were written.
+
+        Args:
+            rows (np.ndarray): Row numbers
+            matrix (np.ndarray): The normalized vectors stored at those rows
+        """
+        if not self.trained:
+            return
+        rows = np.asarray(rows)
+        self._grow(int(rows.max()) + 1)
+        clusters = _nearest(matrix, self.centroids, spherical=True)
+        self.codes[rows] = self._encode(matrix)
+        for row, cluster in zip(rows.tolist(), clusters.tolist()):
+            # Moved rows leave a stale entry behind, filtered out at query time
+            if self.assign[row] != cluster:
+                self._lists[cluster].append(row)
+                self._list_arrays[cluster] = None
+            self.assign[row] = cluster
+
+    def remove(self, row: int) -> None:
+        """Forget a row. Its list entry becomes stale and is skipped by searches."""
+        if row < len(self.assign):
+            self.assign[row] = -1
+
+    def _list_array(self, cluster: int) -> np.ndarray:
+        if self._list_arrays[cluster] is None:
+            rows = np.asarray(self._lists[cluster], dtype=np.int64)
+            live = self.assign[rows] == cluster
+            if not live.all():
+                # Compact away stale entries while we are at it
+                rows = rows[live]
+                self._lists[cluster] = rows.tolist()
+            self._list_arrays[cluster] = rows
+        return self._list_arrays[cluster]
+
+    def search(self, query: np.ndarray, top_k: int, vectors: np.ndarray, alive: np.ndarray,
+               nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k inner-product search.
+
+        Args:
+            query (np.ndarray): Normalized query vector
+            top_k (int): Number of results
+            vectors (np.ndarray): Matrix holding the float32 vectors
+            alive (np.ndarray): Live-row mask
+            nprobe (int, optional): Override the number of clusters scanned
+
+        Returns:
+            tuple: (rows, scores) best first; scores are exact cosine similarities
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        # A row re-added to its old cluster can be listed twice, hence the unique
+        candidates = np.unique(np.concatenate([self._list_array(int(c)) for c in probes]))
+        candidates = candidates[(self.assign[candidates] >= 0) & alive[candidates]]
+        if not len(candidates):
+            return candidates, np.zeros(0, dtype=np.float32)
+
+        if self.quantization is not None:
+            approx = self._approximate_scores(query, candidates)
+            keep = min(len(candidates), max(top_k * self.rerank_factor, self.MIN_RERANK))
+            candidates = candidates[np.argpartition(-approx, keep - 1)[:keep]]
+
+        # Sorted rows keep memmap reads sequential
+        candidates = np.sort(candidates)
+        scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top], scores[top]
+
+    def _approximate_scores(self, query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        codes = self.codes[candidates]
+        if self.quantization == "int8":
+            return codes.astype(np.float32) @ (query * self.scales / 127)
+        sub = self.dimension // self.pq_m
+        # Asymmetric distance: look up the query's similarity to every sub-centroid
+        tables = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.pq_m, sub))
+        return tables[np.arange(self.pq_m), codes].sum(axis=1)
+
+    def memory_bytes(self) -> int:
+        """Approximate in-memory size of the codes and assignments."""
+        return self.codes.nbytes + self.assign.nbytes
+
+    def save(self, path: str) -> None:
+        """Write the index state to an .npz file."""
+        if not self.trained:
+            return
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, assign=self.assign, codes=self.codes,
+                 scales=self.scales if self.scales is not None else np.zeros(0, dtype=np.float32),
+                 codebooks=self.codebooks if self.codebooks is not None else np.zeros(0, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Restore state written by save().
+
+        Returns:
+            bool: False if there was nothing to load or it was built with other settings
+        """
+        if not os.path.exists(path):
+            return False
+        data = np.load(path)
+        if data['codes'].shape[1] != self.code_size or data['centroids'].shape[1] != self.dimension:
+            logger.warning(f"Ignoring IVF index at {path}: built with different settings")
+            return False
+        self.centroids = data['centroids']
+        self.assign = data['assign']
+        self.codes = data['codes']
+        self.scales = data['scales'] if len(data['scales']) else None
+        self.codebooks = data['codebooks'] if len(data['codebooks']) else None
+        order = np.argsort(self.assign, kind='stable')
+        bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(len(self.centroids))]
+        self._list_arrays = [None] * len(self.centroids)
+        return True
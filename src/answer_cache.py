@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+from tenants import tenant_path
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers, looked up by question embedding.
+
+    A question is answered from the cache when an earlier question's embedding has a
+    cosine similarity of at least `threshold` with it, both questions resolve to the same
+    metadata filter (see filters.parse_query_filters; relative dates are resolved to
+    absolute ones, so "last week" and "last month" never share an answer), the entry is
+    younger than `ttl` seconds, and none of the emails it was answered from has changed
+    since. Entries are stored in SQLite, so invalidations made by an ingest process
+    reach a running chat; the question embeddings are also kept in memory as one
+    normalized matrix, so a lookup is a single matrix-vector product. Beyond
+    `max_entries` the least recently used entries are evicted.
+
+    Newly ingested emails do not invalidate anything (they are not tied to any answer
+    yet); the TTL bounds how long an answer can miss them.
+    """
+
+    def __init__(self, path: str = "answer_cache.sqlite", threshold: float = 0.93, ttl: float = 86400,
+                 max_entries: int = 1000):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path (str, optional): SQLite file location. Defaults to "answer_cache.sqlite".
+            threshold (float, optional): Minimum cosine similarity of a hit. Defaults to 0.93.
+            ttl (float, optional): Seconds an answer stays valid. Defaults to one day.
+            max_entries (int, optional): Maximum number of cached answers. Defaults to 1000.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL, embedding BLOB NOT NULL,"
+            " answer TEXT NOT NULL, email_ids TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " filter TEXT)"
+        )
+        # Caches created before filters were stored: their entries have none and never match
+        if 'filter' not in [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]:
+            self._conn.execute("ALTER TABLE answers ADD COLUMN filter TEXT")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS answer_emails (answer_id INTEGER NOT NULL, email_id TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answer_emails_email ON answer_emails(email_id)")
+        self._conn.commit()
+
+        self._ids: List[int] = []
+        self._filters: List[Optional[str]] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        rows = self._conn.execute("SELECT id, embedding, filter FROM answers WHERE created > ?",
+                                  (time.time() - ttl,)).fetchall()
+        if rows:
+            self._ids = [answer_id for answer_id, _, _ in rows]
+            self._filters = [filter_key for _, _, filter_key in rows]
+            self._matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+        logger.info(f"Opened answer cache {path} with {len(self._ids)} answers")
+
+    @staticmethod
+    def _filter_key(filter: Optional[Dict[str, Any]]) -> str:
+        return json.dumps(filter, sort_keys=True)
+
+    def lookup(self, embedding: List[float], filter: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer to a question similar to the given one.
+
+        Args:
+            embedding (list): Embedding of the question
+            filter (dict, optional): Metadata filter parsed from the question. Only answers
+                stored with an identical filter match. Defaults to None (no filter).
+
+        Returns:
+            dict: 'question', 'answer', 'email_ids' and 'score' of the hit, or None
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        filter_key = self._filter_key(filter)
+        with self._lock:
+            if self._ids:
+                scores = self._matrix @ query
+                # Candidates above the threshold, best first; stale ones are dropped as we go
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    if self._filters[i] != filter_key:
+                        continue
+                    answer_id = self._ids[i]
+                    row = self._conn.execute(
+                        "SELECT question, answer, email_ids, created FROM answers WHERE id = ?",
+                        (answer_id,)).fetchone()
+                    now = time.time()
+                    if row is None or row[3] + self.ttl < now:
+                        continue
+                    self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, answer_id))
+                    self._conn.commit()
+                    self.hits += 1
+                    return {'question': row[0], 'answer': row[1], 'email_ids': json.loads(row[2]),
+                            'score': float(scores[i])}
+            self.misses += 1
+            return None
+
+    def store(self, question: str, embedding: List[float], answer: str, email_ids: List[str],
+              filter: Dict[str, Any] = None) -> None:
+        """
+        Cache an answer.
+
+        Args:
+            question (str): The question
+            embedding (list): Embedding of the question
+            answer (str): Generated answer
+            email_ids (list): IDs of the emails the answer was generated from
+            filter (dict, optional): Metadata filter parsed from the question. Defaults to None.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / max(np.linalg.norm(vector), 1e-12)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (question, embedding, answer, email_ids, created, last_used, filter) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (question, vector.tobytes(), answer, json.dumps(email_ids), now, now, self._filter_key(filter)))
+            self._conn.executemany("INSERT INTO answer_emails (answer_id, email_id) VALUES (?, ?)",
+                                   [(cursor.lastrowid, email_id) for email_id in set(email_ids)])
+            self._ids.append(cursor.lastrowid)
+            self._filters.append(self._filter_key(filter))
+            self._matrix = np.vstack([self._matrix.reshape(-1, len(vector)), vector])
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                evicted = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM answers ORDER BY last_used LIMIT ?", (count - self.max_entries,))]
+                self._delete(evicted)
+            self._conn.commit()
+
+    def invalidate(self, email_ids: Optional[Iterable[str]]) -> int:
+        """
+        Drop the answers generated from any of the given emails.
+
+        Args:
+            email_ids (iterable): IDs of changed or deleted emails, or None to drop everything
+
+        Returns:
+            int: Number of answers dropped
+        """
+        with self._lock:
+            if email_ids is None:
+                answer_ids = [row[0] for row in self._conn.execute("SELECT id FROM answers")]
+            else:
+                email_ids = list(email_ids)
+                answer_ids = set()
+                for i in range(0, len(email_ids), 500):
+                    chunk = email_ids[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    answer_ids.update(row[0] for row in self._conn.execute(
+                        f"SELECT answer_id FROM answer_emails WHERE email_id IN ({placeholders})", chunk))
+            self._delete(list(answer_ids))
+            self._conn.commit()
+        if answer_ids:
+            logger.info(f"Invalidated {len(answer_ids)} cached answers")
+        return len(answer_ids)
+
+    def _delete(self, answer_ids: List[int]) -> None:
+        if not answer_ids:
+            return
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(answer_id,) for answer_id in answer_ids])
+        self._conn.executemany("DELETE FROM answer_emails WHERE answer_id = ?",
+                               [(answer_id,) for answer_id in answer_ids])
+        dropped = set(answer_ids)
+        keep = [i for i, answer_id in enumerate(self._ids) if answer_id not in dropped]
+        self._ids = [self._ids[i] for i in keep]
+        self._filters = [self._filters[i] for i in keep]
+        self._matrix = self._matrix[keep]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return hit/miss counters.
+
+        Returns:
+            dict: hits, misses, hit_rate and entries
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._ids),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_caches: Dict[Optional[str], AnswerCache] = {}
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache(tenant: str = None) -> Optional[AnswerCache]:
+    """
+    Return the process-wide answer cache of a tenant, or None when disabled.
+
+    Configured through ANSWER_CACHE (set to "0" to disable), ANSWER_CACHE_PATH,
+    ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL (seconds) and ANSWER_CACHE_MAX_ENTRIES
+    environment variables. Each tenant gets its own cache file (see tenants.tenant_path),
+    so an answer is never served from another user's emails.
+
+    Args:
+        tenant (str, optional): Tenant name. Defaults to None (single-tenant).
+    """
+    if os.getenv("ANSWER_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if tenant not in _caches:
+            _caches[tenant] = AnswerCache(
+                path=tenant_path(os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite"), tenant),
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93")),
+                ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+            )
+        return _caches[tenant]
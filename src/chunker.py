@@ -0,0 +1,238 @@
+import re
+from typing import List, Dict, Any, Tuple
+from utils import count_tokens, get_encoding
+
+# Lines that open a quoted reply or forwarded message; everything after them is quoted
+QUOTE_HEADER = re.compile(
+    r"^(On .{0,200}wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|From: .+\n(Sent|Date): )",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Lines that open a signature block; everything after them up to a quote is dropped
+SIGNATURE = re.compile(
+    r"^(-- ?$|Sent from my \w+|Get Outlook for \w+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+CHUNK_SEPARATOR = "#"
+
+# Email fields copied into every chunk's metadata, when present
+EMAIL_FIELDS = ('sender_domain', 'sender_org', 'date', 'labels', 'thread_id')
+
+
+def chunk_id(message_id: str, n: int) -> str:
+    """Vector ID of the n-th chunk of a Gmail message."""
+    return f"{message_id}{CHUNK_SEPARATOR}{n}"
+
+
+def message_id_of(vector_id: str) -> str:
+    """Gmail message ID a vector ID belongs to (also accepts unchunked IDs)."""
+    return vector_id.split(CHUNK_SEPARATOR, 1)[0]
+
+
+def split_sections(body: str) -> List[Tuple[str, str]]:
+    """
+    Split an email body into its own text, signature and quoted reply.
+
+    Args:
+        body (str): Decoded email body
+
+    Returns:
+        list: (kind, text) pairs with kind "body" or "quote", in order. Signatures are
+            dropped, and ">"-prefixed quote lines are unwrapped into the quote section.
+    """
+    quote_start = len(body)
+    match = QUOTE_HEADER.search(body)
+    if match:
+        quote_start = match.start()
+    # A run of ">" lines also starts the quote, if it comes before any quote header
+    lines = body[:quote_start].split("\n")
+    offset = 0
+    for line in lines:
+        if line.startswith(">"):
+            quote_start = offset
+            break
+        offset += len(line) + 1
+
+    own, quoted = body[:quote_start], body[quote_start:]
+    signature = SIGNATURE.search(own)
+    if signature:
+        own = own[:signature.start()]
+    quoted = "\n".join(line.lstrip("> ") if line.startswith(">") else line for line in quoted.split("\n"))
+
+    sections = []
+    if own.strip():
+        sections.append(("body", own.strip()))
+    if quoted.strip():
+        sections.append(("quote", quoted.strip()))
+    return sections
+
+
+def _pieces(text: str, max_tokens: int) -> List[str]:
+    """Split text into paragraphs, then sentences, then raw token windows, each within max_tokens."""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE_END.split(paragraph):
+            if count_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+                continue
+            tokens = get_encoding().encode(sentence, disallowed_special=())
+            for start in range(0, len(tokens), max_tokens):
+                pieces.append(get_encoding().decode(tokens[start:start + max_tokens]))
+    return pieces
+
+
+def _pack(text: str, max_tokens: int, overlap_tokens: int) -> List[Tuple[str, int]]:
+    """chunk_text, with each chunk's number of leading characters repeated from the previous chunk."""
+    chunks, current, current_tokens, overlap = [], [], 0, 0
+    for piece in _pieces(text, max_tokens):
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(("\n\n".join(current), overlap))
+            # Carry over trailing pieces that fit in the overlap budget
+            tail, tail_tokens = [], 0
+            for previous in reversed(current):
+                previous_tokens = count_tokens(previous)
+                if tail_tokens + previous_tokens > overlap_tokens or tail_tokens + previous_tokens + tokens > max_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_tokens += previous_tokens
+            current, current_tokens = tail, tail_tokens
+            overlap = len("\n\n".join(tail)) + 2 if tail else 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(("\n\n".join(current), overlap))
+    return chunks
+
+
+def chunk_text(text: str, max_tokens: int = 400, overlap_tokens: int = 50) -> List[str]:
+    """
+    Pack paragraphs/sentences of a text into chunks of at most max_tokens.
+
+    Consecutive chunks share up to overlap_tokens of trailing pieces so that a fact
+    spanning a boundary is still retrievable from one chunk.
+
+    Args:
+        text (str): Text of one section
+        max_tokens (int, optional): Token budget per chunk. Defaults to 400.
+        overlap_tokens (int, optional): Token budget of the carried-over tail. Defaults to 50.
+
+    Returns:
+        list: Chunk texts
+    """
+    return [chunk for chunk, _ in _pack(text, max_tokens, overlap_tokens)]
+
+
+def email_header(sender: str, subject: str) -> str:
+    return f"From: {sender}\nSubject: {subject}"
+
+
+def chunk_email(email: Dict[str, Any], max_tokens: int = 400, overlap_tokens: int = 50) -> List[Dict[str, Any]]:
+    """
+    Split an email into chunks ready for embedding.
+
+    Chunks never cross the boundary between the sender's own text and a quoted reply.
+    Each chunk's embedding text starts with the From/Subject header so it carries the
+    email's context; the stored metadata keeps only the chunk's own span, and 'overlap'
+    the number of its leading characters repeated from the previous chunk.
+
+    Args:
+        email (dict): Email data with 'id', 'subject', 'sender' and 'body' keys, and
+            optionally the EMAIL_FIELDS used for filtering
+        max_tokens (int, optional): Token budget per chunk, header excluded. Defaults to 400.
+        overlap_tokens (int, optional): Overlap between consecutive chunks. Defaults to 50.
+
+    Returns:
+        list: Dicts with 'id' (message ID + "#n"), 'text' (to embed) and 'metadata'
+    """
+    sender = email.get('sender', 'Unknown Sender')
+    subject = email.get('subject', 'No Subject')
+    header = email_header(sender, subject)
+    spans = []
+    for kind, section in split_sections(email.get('body', '')):
+        spans.extend((kind, span, overlap) for span, overlap in _pack(section, max_tokens, overlap_tokens))
+    if not spans:
+        # Header-only email, still worth finding by sender/subject
+        spans = [("body", "", 0)]
+
+    # Structured fields for filtered retrieval; absent ones are left out (Pinecone rejects nulls)
+    fields = {key: email[key] for key in EMAIL_FIELDS if email.get(key) is not None}
+
+    return [{
+        'id': chunk_id(email['id'], n),
+        'text': f"{header}\n{span}",
+        'metadata': {
+            'text': span,
+            'message_id': email['id'],
+            'chunk': n,
+            'section': kind,
+            'overlap': overlap,
+            'sender': sender,
+            'subject': subject,
+            **fields,
+        },
+    } for n, (kind, span, overlap) in enumerate(spans)]
+
+
+def collapse_matches(matches: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    """
+    Group chunk matches by message and reassemble each message from its matched spans.
+
+    Args:
+        matches (list): Chunk matches ('id', 'score', 'metadata'), best first
+        top_k (int): Number of messages to return
+
+    Returns:
+        list: Message matches best first, each with 'id' (message ID), 'score' (best chunk
+            score), 'chunks' (matched chunk IDs) and 'metadata' whose 'text' holds the header
+            and the matched spans in their original order. Text that consecutive chunks
+            share is kept once; gaps between non-adjacent spans are marked with "...".
+    """
+    messages: Dict[str, Dict[str, Any]] = {}
+    for match in matches:
+        metadata = match['metadata']
+        message_id = metadata.get('message_id', message_id_of(match['id']))
+        message = messages.get(message_id)
+        if message is None:
+            if len(messages) == top_k:
+                continue
+            message = messages[message_id] = {'id': message_id, 'score': match['score'], 'chunks': [], 'spans': []}
+        message['chunks'].append(match['id'])
+        message['spans'].append((metadata.get('chunk', 0), metadata))
+
+    results = []
+    for message in messages.values():
+        spans = sorted(message.pop('spans'), key=lambda span: span[0])
+        first = spans[0][1]
+        if 'message_id' not in first:
+            # Vector stored before chunking: the metadata text is the whole email
+            text = first['text']
+        else:
+            body, previous = "", None
+            for n, metadata in spans:
+                if previous is None:
+                    body = metadata['text']
+                elif n == previous + 1:
+                    # Adjacent chunk: drop the text it repeats from the previous one
+                    body += "\n\n" + metadata['text'][metadata.get('overlap', 0):]
+                else:
+                    body += "\n...\n" + metadata['text']
+                previous = n
+            text = f"{email_header(first['sender'], first['subject'])}\nBody: {body}"
+        meta = {key: value for key, value in first.items() if key not in ('text', 'chunk', 'section', 'overlap')}
+        meta['text'] = text
+        message['metadata'] = meta
+        results.append(message)
+    return results
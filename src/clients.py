@@ -0,0 +1,113 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# One client per service (and per API key) for the whole process. The SDKs are
+# imported by the factories, so a process only pays for the ones it actually uses.
+_clients: Dict[Hashable, Any] = {}
+_lock = threading.Lock()
+# Async clients hold an HTTP session bound to the event loop they were first used on,
+# so they are built once per loop and kept with it, by key
+_async_clients: Dict[Hashable, Tuple[asyncio.AbstractEventLoop, Any]] = {}
+
+
+def _shared(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return the client stored under key, building it with factory on first use."""
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+                logger.debug(f"Created {key} client")
+    return client
+
+
+def _shared_async(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """
+    Return the async client stored under key for the running event loop, building it
+    with factory on first use in that loop. A client set with set_client is returned as is.
+    """
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _async_clients.get(key)
+        if entry is None or entry[0] is not loop:
+            # A client of an earlier loop cannot be used (nor closed) from this one
+            entry = _async_clients[key] = (loop, factory())
+            logger.debug(f"Created {key} client")
+    return entry[1]
+
+
+def set_client(key: Hashable, client: Any) -> None:
+    """
+    Replace a shared client, e.g. with an offline fake.
+
+    Args:
+        key (str): "openai", "async_openai", "cohere", "async_cohere", or
+            ("pinecone", api_key)
+        client: The client to hand out from now on
+    """
+    with _lock:
+        _clients[key] = client
+
+
+def reset_clients() -> None:
+    """Forget every shared client; the next request for one builds it again."""
+    with _lock:
+        _clients.clear()
+        _async_clients.clear()
+
+
+def get_openai_client():
+    """Return the process-wide OpenAI client, keyed from OPENAI_API_KEY2."""
+    def build():
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY2"))
+    return _shared("openai", build)
+
+
+def get_async_openai_client():
+    """Return the AsyncOpenAI client of the running event loop, keyed from OPENAI_API_KEY2."""
+    def build():
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY2"))
+    return _shared_async("async_openai", build)
+
+
+def get_pinecone(api_key: str):
+    """
+    Return the process-wide Pinecone client for an API key.
+
+    Args:
+        api_key (str): Pinecone API key
+
+    Returns:
+        pinecone.Pinecone: The client
+    """
+    def build():
+        from pinecone import Pinecone
+        return Pinecone(api_key=api_key)
+    return _shared(("pinecone", api_key), build)
+
+
+def get_cohere_client():
+    """Return the process-wide Cohere client, keyed from COHERE_API_KEY."""
+    def build():
+        from cohere import Client
+        return Client(api_key=os.getenv("COHERE_API_KEY"))
+    return _shared("cohere", build)
+
+
+def get_async_cohere_client():
+    """Return the Cohere AsyncClient of the running event loop, keyed from COHERE_API_KEY."""
+    def build():
+        from cohere import AsyncClient
+        return AsyncClient(api_key=os.getenv("COHERE_API_KEY"))
+    return _shared_async("async_cohere", build)
@@ -0,0 +1,232 @@
+import os
+import re
+import math
+import time
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+from chunker import QUOTE_HEADER, SENTENCE_END, split_sections
+from lexical_index import tokenize
+from utils import count_chat_tokens
+
+logger = logging.getLogger(__name__)
+
+# Marks the sentences left out between two kept ones
+GAP = "..."
+
+# Weight of sentences from a quoted reply relative to the sender's own text
+QUOTE_WEIGHT = 0.5
+
+_SHINGLE_WORDS = re.compile(r"[a-z0-9]+")
+
+
+def _split_header(text: str) -> Tuple[str, str]:
+    """Split an email text from collapse_matches into its From/Subject header and body."""
+    if text.startswith("From:") and "\nBody: " in text:
+        header, body = text.split("\nBody: ", 1)
+        return f"{header}\nBody: ", body
+    return "", text
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(_SHINGLE_WORDS.findall(sentence.lower()))
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _SHINGLE_WORDS.findall(text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class ContextBuilder:
+    """
+    Packs retrieved emails into a prompt context of at most `max_tokens` tokens.
+
+    Emails are taken in rank order. An email whose word shingles overlap an already
+    packed email's by `duplicate_threshold` or more is dropped, as are sentences that
+    already appeared in a packed email, which removes quoted reply chains repeated down a
+    thread. The token budget is then shared out so that short emails fit whole and long
+    ones split the rest evenly; an email over its share keeps the sentences that match the
+    question best (quoted text counting half), in their original order.
+    """
+
+    def __init__(self, max_tokens: int = 6000, duplicate_threshold: float = 0.8,
+                 count_tokens: Callable[[str], int] = None):
+        """
+        Args:
+            max_tokens (int, optional): Token budget of the packed emails. Defaults to 6000.
+            duplicate_threshold (float, optional): Shingle overlap at which an email counts
+                as a near-duplicate of an earlier one. Defaults to 0.8.
+            count_tokens (callable, optional): Token counter. Defaults to the chat model's tokenizer.
+        """
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.count_tokens = count_tokens or count_chat_tokens
+
+    def build(self, question: str, email_texts: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        Pack emails into the token budget.
+
+        Args:
+            question (str): User question, used to pick the sentences worth keeping
+            email_texts (list): Email texts, best first
+
+        Returns:
+            tuple: The packed email texts (best first) and stats with 'emails', 'packed_emails',
+                'duplicates', 'tokens_before', 'tokens' and 'ms'
+        """
+        started = time.perf_counter()
+        tokens_before = 0
+        emails = []
+        seen_shingles = []
+        seen_sentences = set()
+        duplicates = 0
+        for text in email_texts:
+            tokens_before += self.count_tokens(text)
+            shingles = _shingles(text)
+            if any(_jaccard(shingles, seen) >= self.duplicate_threshold for seen in seen_shingles):
+                duplicates += 1
+                continue
+            seen_shingles.append(shingles)
+
+            header, body = _split_header(text)
+            sentences = []
+            for kind, section in split_sections(body):
+                section_sentences = []
+                for line in section.split("\n"):
+                    line = line.strip()
+                    if not line or line == GAP:
+                        continue
+                    for n, sentence in enumerate(SENTENCE_END.split(line)):
+                        key = _sentence_key(sentence)
+                        if key in seen_sentences:
+                            continue
+                        if key:
+                            seen_sentences.add(key)
+                        # +1 for the separator each sentence is joined with
+                        section_sentences.append({'text': sentence, 'quote': kind == "quote", 'starts_line': n == 0,
+                                                  'tokens': self.count_tokens(sentence) + 1,
+                                                  'terms': set(tokenize(sentence))})
+                # A quote whose text was all seen before leaves only its "On ... wrote:" line
+                if kind == "quote" and all(QUOTE_HEADER.match(sentence['text'])
+                                           for sentence in section_sentences):
+                    continue
+                sentences.extend(section_sentences)
+            if not sentences and body.strip():
+                # Nothing left that an earlier email did not already say
+                duplicates += 1
+                continue
+            emails.append({'header': header, 'header_tokens': self.count_tokens(header) if header else 0,
+                           'sentences': sentences})
+
+        budgets = self._allocate(emails)
+        weights = self._term_weights(question, emails)
+        packed = []
+        tokens = 0
+        for email, budget in zip(emails, budgets):
+            if budget < 0:
+                continue
+            keep = self._select(email['sentences'], budget, weights)
+            packed.append(email['header'] + self._join(email['sentences'], keep))
+            tokens += self.count_tokens(packed[-1])
+
+        stats = {
+            'emails': len(email_texts),
+            'packed_emails': len(packed),
+            'duplicates': duplicates,
+            'tokens_before': tokens_before,
+            'tokens': tokens,
+            'ms': (time.perf_counter() - started) * 1000,
+        }
+        return packed, stats
+
+    def _allocate(self, emails: List[Dict[str, Any]]) -> List[int]:
+        """
+        Body token budget per email.
+
+        Headers are paid for first, in rank order, and an email whose header does not fit
+        is left out. The rest is water-filled: emails are served smallest first, each
+        getting its full size or an even share of what is left, whichever is less.
+        """
+        remaining = self.max_tokens
+        budgets = [0] * len(emails)
+        included = []
+        for i, email in enumerate(emails):
+            if email['header_tokens'] < remaining:
+                remaining -= email['header_tokens']
+                included.append(i)
+            else:
+                budgets[i] = -1
+        sizes = {i: sum(sentence['tokens'] for sentence in emails[i]['sentences']) for i in included}
+        for position, i in enumerate(sorted(included, key=sizes.get)):
+            share = remaining // (len(included) - position)
+            budgets[i] = min(sizes[i], share)
+            remaining -= budgets[i]
+        return budgets
+
+    @staticmethod
+    def _term_weights(question: str, emails: List[Dict[str, Any]]) -> Dict[str, float]:
+        """IDF of the question terms over all candidate sentences."""
+        terms = set(tokenize(question))
+        if not terms:
+            return {}
+        counts = dict.fromkeys(terms, 0)
+        total = 0
+        for email in emails:
+            for sentence in email['sentences']:
+                total += 1
+                for term in terms & sentence['terms']:
+                    counts[term] += 1
+        return {term: math.log(1 + (total - count + 0.5) / (count + 0.5)) for term, count in counts.items()}
+
+    @staticmethod
+    def _select(sentences: List[Dict[str, Any]], budget: int, weights: Dict[str, float]) -> List[int]:
+        """Indices of the most relevant sentences that fit in the budget, in text order."""
+        if sum(sentence['tokens'] for sentence in sentences) <= budget:
+            return list(range(len(sentences)))
+        scores = []
+        for i, sentence in enumerate(sentences):
+            score = sum(weights.get(term, 0.0) for term in sentence['terms'])
+            if sentence['quote']:
+                score *= QUOTE_WEIGHT
+            # Ties go to earlier sentences, which tend to carry the point of an email
+            scores.append((score + 1.0 / (i + 2), i))
+        keep = []
+        used = 0
+        for _, i in sorted(scores, reverse=True):
+            if used + sentences[i]['tokens'] <= budget:
+                keep.append(i)
+                used += sentences[i]['tokens']
+        return sorted(keep)
+
+    @staticmethod
+    def _join(sentences: List[Dict[str, Any]], keep: List[int]) -> str:
+        parts = []
+        previous = None
+        for i in keep:
+            if previous is not None:
+                if i > previous + 1:
+                    parts.append(f"\n{GAP}\n")
+                else:
+                    parts.append("\n" if sentences[i]['starts_line'] else " ")
+            elif i > 0:
+                parts.append(f"{GAP}\n")
+            parts.append(sentences[i]['text'])
+            previous = i
+        return "".join(parts)
+
+
+def get_context_builder(**kwargs) -> ContextBuilder:
+    """
+    Create a context builder; the budget defaults to CONTEXT_MAX_TOKENS (6000).
+
+    Args:
+        **kwargs: Passed to ContextBuilder
+
+    Returns:
+        ContextBuilder: The context builder
+    """
+    kwargs.setdefault("max_tokens", int(os.getenv("CONTEXT_MAX_TOKENS", "6000")))
+    return ContextBuilder(**kwargs)
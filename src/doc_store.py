@@ -0,0 +1,233 @@
+import os
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from tenants import tenant_path
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentStore:
+    """
+    Compressed on-disk store of chunk texts, kept out of the vector index.
+
+    Texts written together are packed into blocks of about `block_bytes` and each block
+    is zlib-compressed as a whole, which compresses far better than short texts one by
+    one. The docs table maps a chunk ID to its block and byte range, so the texts of the
+    final top-k matches are fetched by ID, decompressing each block once. Recently read
+    blocks are kept decompressed in memory.
+
+    Replaced and deleted texts leave dead bytes in their block; a block is dropped once
+    nothing in it is live, and flush() rewrites the live texts of mostly dead blocks.
+    """
+
+    # Decompressed blocks kept in memory
+    CACHE_BLOCKS = 64
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path: str = "doc_store.sqlite", block_bytes: int = 32768, level: int = 6):
+        """
+        Open (or create) the store.
+
+        Args:
+            path (str, optional): SQLite file location. Defaults to "doc_store.sqlite".
+            block_bytes (int, optional): Uncompressed size at which a block is closed. Larger
+                blocks compress better but cost more to decompress per lookup. Defaults to 32768.
+            level (int, optional): zlib compression level. Defaults to 6.
+        """
+        self.path = path
+        self.block_bytes = block_bytes
+        self.level = level
+        self._lock = threading.RLock()
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            " block INTEGER PRIMARY KEY, data BLOB NOT NULL, raw_bytes INTEGER NOT NULL, live_bytes INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " id TEXT PRIMARY KEY, block INTEGER NOT NULL, start INTEGER NOT NULL, length INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_block ON docs(block)")
+        self._conn.commit()
+        count = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        logger.info(f"Opened document store {path} with {count} documents")
+
+    def _lookup(self, sql: str, ids: List[str]) -> List[Tuple]:
+        rows = []
+        for start in range(0, len(ids), self.LOOKUP_CHUNK):
+            chunk = ids[start:start + self.LOOKUP_CHUNK]
+            rows.extend(self._conn.execute(sql.format(",".join("?" * len(chunk))), chunk))
+        return rows
+
+    def put(self, docs: List[Tuple[str, str]]) -> None:
+        """
+        Store (or replace) texts.
+
+        Args:
+            docs (list): (id, text) tuples
+        """
+        docs = dict(docs)
+        if not docs:
+            return
+        with self._lock:
+            self._forget(list(docs))
+            parts, entries, size = [], [], 0
+
+            def write_block():
+                cursor = self._conn.execute(
+                    "INSERT INTO blocks (data, raw_bytes, live_bytes) VALUES (?, ?, ?)",
+                    (zlib.compress(b"".join(parts), self.level), size, size))
+                self._conn.executemany("INSERT INTO docs (id, block, start, length) VALUES (?, ?, ?, ?)",
+                                       [(doc_id, cursor.lastrowid, start, length) for doc_id, start, length in entries])
+
+            for doc_id, text in docs.items():
+                data = text.encode('utf-8')
+                if parts and size + len(data) > self.block_bytes:
+                    write_block()
+                    parts, entries, size = [], [], 0
+                parts.append(data)
+                entries.append((doc_id, size, len(data)))
+                size += len(data)
+            write_block()
+            self._conn.commit()
+
+    def get(self, ids: List[str]) -> Dict[str, str]:
+        """
+        Fetch texts by ID.
+
+        Args:
+            ids (list): Document IDs
+
+        Returns:
+            dict: ID -> text for the IDs that are stored
+        """
+        if not ids:
+            return {}
+        with self._lock:
+            texts = {}
+            for doc_id, block, start, length in sorted(
+                    self._lookup("SELECT id, block, start, length FROM docs WHERE id IN ({})", list(ids)),
+                    key=lambda row: row[1]):
+                texts[doc_id] = self._block(block)[start:start + length].decode('utf-8')
+            return texts
+
+    def _block(self, block: int) -> bytes:
+        data = self._blocks.get(block)
+        if data is not None:
+            self._blocks.move_to_end(block)
+            return data
+        data = zlib.decompress(self._conn.execute("SELECT data FROM blocks WHERE block = ?", (block,)).fetchone()[0])
+        self._blocks[block] = data
+        if len(self._blocks) > self.CACHE_BLOCKS:
+            self._blocks.popitem(last=False)
+        return data
+
+    def _forget(self, ids: List[str]) -> None:
+        """Remove IDs and release their bytes from their blocks (uncommitted)."""
+        dead: Dict[int, int] = {}
+        for block, length in self._lookup("SELECT block, length FROM docs WHERE id IN ({})", ids):
+            dead[block] = dead.get(block, 0) + length
+        if not dead:
+            return
+        for start in range(0, len(ids), self.LOOKUP_CHUNK):
+            chunk = ids[start:start + self.LOOKUP_CHUNK]
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        self._conn.executemany("UPDATE blocks SET live_bytes = live_bytes - ? WHERE block = ?",
+                               [(length, block) for block, length in dead.items()])
+        # Zero-length texts keep an otherwise empty block alive; only drop blocks nothing points to
+        self._conn.executemany(
+            "DELETE FROM blocks WHERE block = ? AND NOT EXISTS (SELECT 1 FROM docs WHERE docs.block = blocks.block)",
+            [(block,) for block in dead])
+        for block in dead:
+            self._blocks.pop(block, None)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        Delete texts by ID.
+
+        Args:
+            ids (list): Document IDs
+        """
+        with self._lock:
+            self._forget(list(ids))
+            self._conn.commit()
+
+    def delete(self, message_ids: Optional[List[str]], separator: str = "#") -> None:
+        """
+        Delete the texts of messages: the ID itself and every "<id><separator>..." chunk ID.
+
+        Args:
+            message_ids (list): Message IDs, or None to delete everything
+            separator (str, optional): Chunk ID separator. Defaults to "#".
+        """
+        with self._lock:
+            if message_ids is None:
+                self._conn.execute("DELETE FROM docs")
+                self._conn.execute("DELETE FROM blocks")
+                self._blocks.clear()
+            else:
+                ids = []
+                for message_id in message_ids:
+                    prefix = f"{message_id}{separator}"
+                    ids.extend(row[0] for row in self._conn.execute(
+                        "SELECT id FROM docs WHERE id = ? OR (id >= ? AND id < ?)",
+                        (message_id, prefix, prefix[:-1] + chr(ord(separator) + 1))))
+                self._forget(ids)
+            self._conn.commit()
+
+    def compact(self, max_dead_fraction: float = 0.5) -> int:
+        """
+        Rewrite the live texts of blocks that are mostly dead.
+
+        Args:
+            max_dead_fraction (float, optional): Rewrite blocks with a larger share of dead bytes. Defaults to 0.5.
+
+        Returns:
+            int: Number of blocks rewritten
+        """
+        with self._lock:
+            blocks = [row[0] for row in self._conn.execute(
+                "SELECT block FROM blocks WHERE live_bytes < raw_bytes * ?", (1 - max_dead_fraction,))]
+            if not blocks:
+                return 0
+            ids = [row[0] for row in self._lookup("SELECT id FROM docs WHERE block IN ({})", blocks)]
+            self.put(list(self.get(ids).items()))
+        logger.info(f"Compacted {len(blocks)} document blocks")
+        return len(blocks)
+
+    def flush(self) -> None:
+        """Reclaim the space of mostly dead blocks."""
+        self.compact()
+
+    def stats(self) -> Dict[str, int]:
+        """Number of documents, their total text size and the compressed size on disk."""
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            text_bytes, stored_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(live_bytes), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blocks").fetchone()
+        return {'documents': documents, 'text_bytes': text_bytes, 'stored_bytes': stored_bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_document_store(tenant: str = None) -> Optional[DocumentStore]:
+    """
+    Open the document store configured through DOC_STORE (set to "0" to keep chunk texts
+    in the vector index metadata instead) and DOC_STORE_PATH environment variables, or
+    return None when disabled.
+
+    Args:
+        tenant (str, optional): Open this tenant's own store (see tenants.tenant_path).
+            Defaults to None (single-tenant).
+    """
+    if os.getenv("DOC_STORE", "1") == "0":
+        return None
+    return DocumentStore(path=tenant_path(os.getenv("DOC_STORE_PATH", "doc_store.sqlite"), tenant))
@@ -0,0 +1,202 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: an in-process LRU in front of a SQLite file.
+
+    Entries are keyed by a SHA-256 of the model name and the text and stored as packed
+    float32 blobs; the in-process LRU keeps the same float32 values as numpy arrays
+    (about 6 KB per 1536-dimension vector, where a list of Python floats takes ~50 KB).
+    The file is trimmed back under `max_bytes` by evicting the least recently used rows.
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path: str = "embedding_cache.sqlite", max_bytes: int = 1 << 30,
+                 memory_entries: int = 10000):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path (str, optional): SQLite file location. Defaults to "embedding_cache.sqlite".
+            max_bytes (int, optional): Maximum size of stored vectors on disk. Defaults to 1 GiB.
+            memory_entries (int, optional): Entries kept in the in-process LRU. Defaults to 10000.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        logger.info(f"Opened embedding cache {path} ({self._disk_bytes / 1e6:.1f} MB)")
+
+    @staticmethod
+    def make_key(text: str, engine: str) -> str:
+        """Return the cache key for a text embedded with the given model."""
+        return hashlib.sha256(f"{engine}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up several keys at once.
+
+        Args:
+            keys (list): Cache keys
+
+        Returns:
+            dict: Embeddings for the keys that were found
+        """
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key].tolist()
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+            now = time.time()
+            for i in range(0, len(missing), self.LOOKUP_CHUNK):
+                chunk = missing[i:i + self.LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector.tolist()
+                    self._remember(key, vector)
+                if rows:
+                    self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                           [(now, key) for key, _ in rows])
+                self.disk_hits += len(rows)
+            if missing:
+                self._conn.commit()
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """
+        Store several embeddings at once.
+
+        Args:
+            items (dict): Mapping of cache key to embedding
+        """
+        if not items:
+            return
+        now = time.time()
+        vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in items.items()}
+        rows = [(key, vector.tobytes(), now) for key, vector in vectors.items()]
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+            # Replaced rows only change the size by the difference
+            keys = list(items)
+            replaced = 0
+            for i in range(0, len(keys), self.LOOKUP_CHUNK):
+                chunk = keys[i:i + self.LOOKUP_CHUNK]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            self._disk_bytes += sum(len(blob) for _, blob, _ in rows) - replaced
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        """Drop least recently used rows until the file is back under 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._disk_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            # Only as many of the oldest rows as it takes to get under the target
+            victims = []
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                victims.append(key)
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in victims])
+            evicted += len(victims)
+        self._conn.commit()
+        logger.info(f"Evicted {evicted} embeddings from cache ({self._disk_bytes / 1e6:.1f} MB left)")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return hit/miss counters.
+
+        Returns:
+            dict: memory_hits, disk_hits, misses, hit_rate and disk_bytes
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'disk_bytes': self._disk_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Return the process-wide embedding cache, or None when disabled.
+
+    Configured through EMBEDDING_CACHE (set to "0" to disable), EMBEDDING_CACHE_PATH and
+    EMBEDDING_CACHE_MAX_MB environment variables.
+    """
+    global _cache
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"),
+                max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * (1 << 20)),
+            )
+        return _cache
@@ -0,0 +1,277 @@
+import re
+import calendar
+from datetime import datetime, timedelta
+from email.utils import parseaddr
+from typing import Any, Dict, List, Optional, Tuple
+
+# Metadata fields that can be filtered on in every backend
+FILTER_FIELDS = ('sender_domain', 'sender_org', 'date', 'labels', 'thread_id', 'message_id')
+
+RANGE_OPERATORS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+# Second-level labels under which organizations register (amazon.co.uk, irctc.co.in...)
+_GENERIC_SLDS = {'co', 'com', 'org', 'net', 'ac', 'gov', 'edu', 'gen', 'firm', 'ind'}
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+
+# Gmail system labels a question can ask for directly
+LABEL_WORDS = {
+    'unread': 'UNREAD',
+    'starred': 'STARRED',
+}
+
+_DOMAIN = re.compile(r"\b(?:[a-z0-9-]+\.)+[a-z]{2,}\b")
+_FROM_SENDER = re.compile(r"\b(?:from|sent by)\s+@?([a-z0-9][a-z0-9.&'-]*)", re.IGNORECASE)
+_LAST_N = re.compile(r"\b(?:in the )?(?:last|past)\s+(\d+)\s+(day|week|month|year)s?\b", re.IGNORECASE)
+_RELATIVE = re.compile(r"\b(today|yesterday|(?:this|last|past) (?:week|month|year))\b", re.IGNORECASE)
+_IN_MONTH = re.compile(r"\b(?:in|during|from)\s+(" + "|".join(sorted(MONTHS, key=len, reverse=True)) +
+                       r")\b\.?(?:\s+(\d{4}))?", re.IGNORECASE)
+_IN_YEAR = re.compile(r"\b(?:in|during)\s+(\d{4})\b", re.IGNORECASE)
+_LABEL = re.compile(r"\b(" + "|".join(LABEL_WORDS) + r")\b", re.IGNORECASE)
+
+
+def sender_fields(sender: str) -> Dict[str, str]:
+    """
+    Split a From header into filterable fields.
+
+    Args:
+        sender (str): From header, e.g. "Amazon <auto-confirm@amazon.in>"
+
+    Returns:
+        dict: 'sender_domain' ("amazon.in") and 'sender_org' ("amazon"), empty if there is no address
+    """
+    address = parseaddr(sender)[1].lower()
+    if '@' not in address:
+        return {}
+    domain = address.rsplit('@', 1)[1]
+    parts = domain.split('.')
+    org = parts[-2] if len(parts) >= 2 else parts[0]
+    if len(parts) >= 3 and org in _GENERIC_SLDS:
+        org = parts[-3]
+    return {'sender_domain': domain, 'sender_org': org}
+
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """
+    Evaluate a Pinecone-style metadata filter against one metadata dict.
+
+    Supports $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $and and $or. A list-valued
+    field matches when any of its values does (like Pinecone).
+
+    Args:
+        metadata (dict): Metadata of a stored chunk
+        filter (dict): Filter, e.g. {"date": {"$gte": 1700000000}, "sender_org": "amazon"}
+
+    Returns:
+        bool: Whether the metadata satisfies the filter
+    """
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            value = metadata.get(key)
+            values = value if isinstance(value, list) else [value]
+            for op, operand in condition.items():
+                if not _compare(values, op, operand):
+                    return False
+    return True
+
+
+def _compare(values: List[Any], op: str, operand: Any) -> bool:
+    present = [value for value in values if value is not None]
+    if op == '$eq':
+        return operand in present
+    if op == '$ne':
+        return operand not in present
+    if op == '$in':
+        return any(value in operand for value in present)
+    if op == '$nin':
+        return not any(value in operand for value in present)
+    comparisons = {'$gt': lambda v: v > operand, '$gte': lambda v: v >= operand,
+                   '$lt': lambda v: v < operand, '$lte': lambda v: v <= operand}
+    if op in comparisons:
+        return any(isinstance(value, (int, float)) and comparisons[op](value) for value in present)
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def field_rows(key: int, metadata: Dict[str, Any]) -> List[Tuple[int, str, Any]]:
+    """
+    Rows of a doc_fields table for one document: (key, field, value), one per value of
+    each FILTER_FIELDS field present in its metadata.
+    """
+    rows = []
+    for field in FILTER_FIELDS:
+        value = metadata.get(field)
+        for item in (value if isinstance(value, list) else [value]):
+            if item is not None:
+                rows.append((key, field, item))
+    return rows
+
+
+def compile_filter(filter: Dict[str, Any], key: str = "row") -> Tuple[str, List[Any]]:
+    """
+    Translate a Pinecone-style filter into a SQLite SELECT of the matching document keys.
+
+    The query runs over a doc_fields (<key>, field, value) table filled with field_rows,
+    and a docs table holding the key of every document (for $ne and $nin).
+
+    Args:
+        filter (dict): Filter over FILTER_FIELDS (see matches_filter)
+        key (str, optional): Name of the document key column in both tables. Defaults to "row".
+
+    Returns:
+        tuple: SQL and its parameters
+    """
+    parts, params = [], []
+    for field, condition in filter.items():
+        if field in ('$and', '$or'):
+            compiled = [compile_filter(part, key) for part in condition]
+            joiner = " INTERSECT " if field == '$and' else " UNION "
+            parts.append(joiner.join(f"SELECT {key} FROM ({sql})" for sql, _ in compiled))
+            params.extend(param for _, part_params in compiled for param in part_params)
+            continue
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Field {field!r} cannot be filtered on; filterable fields: {FILTER_FIELDS}")
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            select = f"SELECT {key} FROM doc_fields WHERE field = ? AND "
+            if op in ('$eq', '$ne'):
+                sql, op_params = select + "value = ?", [field, operand]
+            elif op in ('$in', '$nin'):
+                sql, op_params = select + f"value IN ({','.join('?' * len(operand))})", [field, *operand]
+            elif op in RANGE_OPERATORS:
+                sql = select + f"typeof(value) IN ('integer', 'real') AND value {RANGE_OPERATORS[op]} ?"
+                op_params = [field, operand]
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            if op in ('$ne', '$nin'):
+                sql = f"SELECT {key} FROM docs EXCEPT {sql}"
+            parts.append(sql)
+            params.extend(op_params)
+    if not parts:
+        return f"SELECT {key} FROM docs", []
+    if len(parts) == 1:
+        return parts[0], params
+    return " INTERSECT ".join(f"SELECT {key} FROM ({part})" for part in parts), params
+
+
+def prefix_values(conn, field: str, prefix: str) -> List[Any]:
+    """
+    Distinct text values of a field in a doc_fields table that start with prefix.
+
+    Args:
+        conn (sqlite3.Connection): Database holding the doc_fields table
+        field (str): Field name
+        prefix (str): Value prefix
+
+    Returns:
+        list: Matching values, sorted
+    """
+    # A range over the (field, value) index; numbers sort before any text
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT value FROM doc_fields WHERE field = ? AND value >= ? AND value < ? ORDER BY value",
+        (field, prefix, prefix + chr(0x10FFFF)))]
+
+
+def _month_start(year: int, month: int) -> datetime:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1)
+
+
+def _date_range(match: re.Match, now: datetime) -> Tuple[datetime, datetime]:
+    """Start (inclusive) and end (exclusive) of a relative date phrase."""
+    phrase = match.group(1).lower()
+    today = datetime(now.year, now.month, now.day)
+    if phrase == 'today':
+        return today, today + timedelta(days=1)
+    if phrase == 'yesterday':
+        return today - timedelta(days=1), today
+    which, unit = phrase.split()
+    if which == 'past':
+        days = {'week': 7, 'month': 30, 'year': 365}[unit]
+        return now - timedelta(days=days), now + timedelta(days=1)
+    if unit == 'week':
+        start = today - timedelta(days=today.weekday())
+        return (start - timedelta(days=7), start) if which == 'last' else (start, start + timedelta(days=7))
+    if unit == 'month':
+        start = _month_start(now.year, now.month)
+        if which == 'last':
+            return _month_start(now.year, now.month - 1), start
+        return start, _month_start(now.year, now.month + 1)
+    start = datetime(now.year, 1, 1)
+    return (datetime(now.year - 1, 1, 1), start) if which == 'last' else (start, datetime(now.year + 1, 1, 1))
+
+
+def parse_query_filters(question: str, now: datetime = None) -> Optional[Dict[str, Any]]:
+    """
+    Pull obvious metadata filters out of a question.
+
+    Recognizes senders ("from amazon", "from github.com", "noreply@rapido.bike"), dates
+    ("today", "last month", "past 3 weeks", "in March 2024", "in 2023") and Gmail labels
+    ("unread", "starred"). Anything else is left to similarity search.
+
+    Args:
+        question (str): User question
+        now (datetime, optional): Reference time for relative dates. Defaults to now.
+
+    Returns:
+        dict: Pinecone-style filter, or None if the question names no filters
+    """
+    now = now or datetime.now()
+    conditions = []
+
+    text = question.lower()
+    address = re.search(r"[a-z0-9._%+-]+@((?:[a-z0-9-]+\.)+[a-z]{2,})", text)
+    domain = address.group(1) if address else None
+    sender = _FROM_SENDER.search(question)
+    if domain is None and sender and _DOMAIN.fullmatch(sender.group(1).lower().rstrip('.')):
+        domain = sender.group(1).lower().rstrip('.')
+    if domain:
+        conditions.append({'sender_domain': {'$eq': domain}})
+    elif sender:
+        org = re.sub(r"[^a-z0-9]", "", sender.group(1).lower())
+        # "from last month", "from yesterday"... name a date, not a sender
+        if org and org not in {'last', 'this', 'past', 'the', 'today', 'yesterday', 'my', 'me'} | set(MONTHS):
+            conditions.append({'sender_org': {'$eq': org}})
+
+    start = end = None
+    last_n = _LAST_N.search(question)
+    relative = _RELATIVE.search(question)
+    in_month = _IN_MONTH.search(question)
+    in_year = _IN_YEAR.search(question)
+    if last_n:
+        count, unit = int(last_n.group(1)), last_n.group(2).lower()
+        days = {'day': 1, 'week': 7, 'month': 30, 'year': 365}[unit] * count
+        start, end = now - timedelta(days=days), None
+    elif relative:
+        start, end = _date_range(relative, now)
+    elif in_month:
+        month = MONTHS[in_month.group(1).lower()]
+        year = int(in_month.group(2)) if in_month.group(2) else now.year - (month > now.month)
+        start, end = _month_start(year, month), _month_start(year, month + 1)
+    elif in_year:
+        year = int(in_year.group(1))
+        start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    if start is not None:
+        date = {'$gte': int(start.timestamp())}
+        if end is not None:
+            date['$lt'] = int(end.timestamp())
+        conditions.append({'date': date})
+
+    labels = sorted({LABEL_WORDS[word.lower()] for word in _LABEL.findall(question)})
+    if labels:
+        conditions.append({'labels': {'$in': labels}})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
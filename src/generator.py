@@ -1,9 +1,15 @@
 import os
+import time
+import asyncio
 import logging
-from openai import OpenAI
-from cohere import Client
-from vector_db import PineconeClient
-from utils import get_embedding
+from vector_db import get_vector_store
+from utils import get_embedding, aget_embedding, count_chat_tokens, record_usage
+from answer_cache import get_answer_cache
+from filters import parse_query_filters
+from reranker import get_reranker
+from context import get_context_builder
+from tracing import get_tracer, profiled, span
+from clients import get_openai_client, get_async_openai_client
 
 # Configure logging
 logging.basicConfig(
@@ -16,41 +22,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Default of retrieve's filter argument: resolve the filter from the question
+# (None is a resolved filter too, meaning no filter)
+_FROM_QUESTION = object()
+
+SYSTEM_PROMPT = "You are a helpful assistant using chain-of-thought reasoning."
+
 class Generator:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY2"))
-        self.cohere_client = Client(api_key=os.getenv("COHERE_API_KEY"))
-        self.pc = PineconeClient()
-
-    def rerank_results(self, user_question, email_texts):
-        cohere_response = self.cohere_client.rerank(
-            model='rerank-english-v2.0',
-            documents=email_texts,
-            query=user_question,
-            top_n=5
-        )
-        return [email_texts[item.index] for item in cohere_response.results]
-
-    def generate_answer(self, user_question):
-        # Step 1: Generate embeddings and query Pinecone
-        logger.debug("Generating embedding for question")
-        question_embedding = get_embedding(user_question)
-
-        # Query Pinecone for relevant emails
-        logger.debug("Querying Pinecone for relevant emails")
-        email_texts = self.pc.query_emails(user_question, top_k=3)
-        logger.info(f"Retrieved {len(email_texts)} email chunks from vector store")
-        for i, email in enumerate(email_texts):
-            print(f"Email {i+1}: {email[:100]}")
+    # Chat clients; None means the process-wide ones (see clients.py), built on first use
+    _client = None
+    _async_client = None
 
-        # Step 2: Re-rank results using Cohere for better relevance
-        logger.info("Re-ranking results using Cohere")
-        reranked_texts = self.rerank_results(user_question, email_texts)
-        for i, email in enumerate(reranked_texts):
-            print(f"Reranked Email {i+1}: {email[:100]}")
-        email_text = "\n\n".join(reranked_texts)
+    def __init__(self, tenant=None):
+        """
+        Args:
+            tenant (str, optional): User or mailbox whose emails questions are answered from;
+                retrieval and the answer cache are scoped to it. Defaults to None (single-tenant).
+        """
+        self.pc = get_vector_store(tenant=tenant)
+        self.answer_cache = get_answer_cache(tenant)
+        self.reranker = get_reranker()
+        self.context_builder = get_context_builder()
+        self.top_k = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+
+    @property
+    def client(self):
+        return self._client or get_openai_client()
+
+    @client.setter
+    def client(self, client):
+        self._client = client
 
-        # Step 3: Generate response using OpenAI
+    @property
+    def async_client(self):
+        return self._async_client or get_async_openai_client()
+
+    @async_client.setter
+    def async_client(self, client):
+        self._async_client = client
+
+    def rerank_results(self, user_question, email_texts, scores=None):
+        """Rerank email texts with the configured reranker, best first."""
+        order = self.reranker.rerank(user_question, email_texts, scores)
+        return [email_texts[i] for i in order]
+
+    async def arerank_results(self, user_question, email_texts, scores=None):
+        """Async rerank_results."""
+        order = await self.reranker.arerank(user_question, email_texts, scores)
+        return [email_texts[i] for i in order]
+
+    def build_messages(self, user_question, email_texts):
+        """Build the chat messages asking GPT-4o to answer from the given emails."""
+        email_text = "\n\n".join(email_texts)
         prompt = f"""
         You are an AI email assistant. Use the following chain of thought approach:
 
@@ -63,19 +86,319 @@ class Generator:
 
         Now answer this question based on my emails: {user_question}
         """
-        logger.debug("Sending prompt to OpenAI for final response")
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant using chain-of-thought reasoning."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        answer = response.choices[0].message.content
-        logger.info("Successfully generated response")
-        return answer
-    
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+    def build_prompt(self, user_question, email_texts):
+        """
+        Pack the emails into the context token budget and build the chat messages.
+
+        Args:
+            user_question (str): The question
+            email_texts (list): Email texts, best first
+
+        Returns:
+            list: Chat messages
+        """
+        with span("pack_context", emails=len(email_texts)) as stage:
+            packed, stats = self.context_builder.build(user_question, email_texts)
+            messages = self.build_messages(user_question, packed)
+            prompt_tokens = sum(count_chat_tokens(message['content']) for message in messages)
+            stage.set(packed_emails=stats['packed_emails'], duplicates=stats['duplicates'],
+                      tokens_before=stats['tokens_before'], tokens=stats['tokens'], prompt_tokens=prompt_tokens)
+        logger.info(f"Packed {stats['packed_emails']}/{stats['emails']} emails "
+                    f"({stats['duplicates']} duplicates) from {stats['tokens_before']} to {stats['tokens']} "
+                    f"tokens in {stats['ms']:.1f}ms; prompt is {prompt_tokens} tokens")
+        return messages
+
+    def generate_answer(self, user_question, stream=False, profile=False):
+        """
+        Answer a question from the user's emails.
+
+        Questions close enough to one answered before are served from the answer cache
+        without reranking or calling the chat API. Every stage is timed as a tracing span
+        under one "answer" span (see tracing.py).
+
+        Args:
+            user_question (str): The question
+            stream (bool, optional): Return an iterator over answer tokens as they arrive
+                instead of the full answer. Defaults to False.
+            profile (bool, optional): Run this request under cProfile and log where the time
+                went. With streaming, the token stream itself is not profiled. Defaults to False.
+
+        Returns:
+            str | Iterator[str]: The answer, or its tokens when streaming
+        """
+        with profiled(profile), span("answer", stream=stream) as answer_span:
+            started = time.perf_counter()
+            logger.debug("Generating embedding for question")
+            question_embedding = get_embedding(user_question)
+            filter = self.query_filter(user_question)
+            cached = self._cached_answer(question_embedding, filter, started)
+            answer_span.set(cache_hit=cached is not None)
+            if cached is not None:
+                return iter([cached]) if stream else cached
+
+            reranked_texts, email_ids = self.retrieve(user_question, question_embedding, filter)
+
+            # Step 3: Generate response using OpenAI
+            logger.debug("Sending prompt to OpenAI for final response")
+            messages = self.build_prompt(user_question, reranked_texts)
+            on_complete = lambda answer: self._cache_answer(user_question, question_embedding, filter, answer,
+                                                            email_ids)
+            if stream:
+                # The answer span stays open until the last token
+                answer_span.detach()
+                return self._stream_answer(messages, started, on_complete, answer_span)
+            with span("completion", stream=False) as stage:
+                response = self.client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages
+                )
+                record_usage(stage, response)
+
+            answer = response.choices[0].message.content
+            logger.info(f"Successfully generated response in {time.perf_counter() - started:.2f}s")
+            on_complete(answer)
+            return answer
+
+    def _stream_answer(self, messages, started, on_complete, answer_span):
+        recorder = _StreamRecorder(started, on_complete, answer_span)
+        try:
+            response = self.client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                stream=True
+            )
+            for chunk in response:
+                token = recorder.add(chunk)
+                if token:
+                    yield token
+            recorder.finish()
+        finally:
+            recorder.close()
+
+    def query_filter(self, user_question):
+        """
+        Metadata filter named in a question (see filters.parse_query_filters), with its
+        sender names matched against the senders actually stored.
+        """
+        return self.pc.resolve_filter(parse_query_filters(user_question))
+
+    def _cached_answer(self, question_embedding, filter, started):
+        """Return a cached answer to a similar question asking for the same filter, or None."""
+        if self.answer_cache is None:
+            return None
+        with span("answer_cache_lookup"):
+            cached = self.answer_cache.lookup(question_embedding, filter)
+        if cached is None:
+            return None
+        logger.info(f"Answered from cache in {time.perf_counter() - started:.3f}s "
+                    f"(similarity {cached['score']:.3f} to '{cached['question'][:50]}')")
+        return cached['answer']
+
+    def _cache_answer(self, user_question, question_embedding, filter, answer, email_ids):
+        if self.answer_cache is not None and answer:
+            self.answer_cache.store(user_question, question_embedding, answer, email_ids, filter)
+
+    def retrieve(self, user_question, question_embedding=None, filter=_FROM_QUESTION):
+        """
+        Find the emails most relevant to a question.
+
+        Args:
+            user_question (str): The question
+            question_embedding (list, optional): Embedding of the question, computed if not given
+            filter (dict, optional): Filter already resolved with query_filter (None for no
+                filter). Resolved from the question if not given.
+
+        Returns:
+            tuple: Reranked email texts (best first) and the IDs of all retrieved emails
+        """
+        # Step 1: Generate embeddings and query the vector store
+        if question_embedding is None:
+            logger.debug("Generating embedding for question")
+            question_embedding = get_embedding(user_question)
+
+        # Query the vector store for relevant emails, narrowed by filters named in the question
+        logger.debug("Querying vector store for relevant emails")
+        if filter is _FROM_QUESTION:
+            filter = self.query_filter(user_question)
+        matches = self.pc.query_matches(user_question, top_k=self.top_k, query_vector=question_embedding,
+                                        filter=filter)
+        if filter and not matches:
+            logger.info(f"No emails match {filter}, retrying without filters")
+            matches = self.pc.query_matches(user_question, top_k=self.top_k, query_vector=question_embedding)
+        email_texts = [match['metadata']['text'] for match in matches]
+        logger.info(f"Retrieved {len(email_texts)} emails from "
+                    f"{sum(len(match['chunks']) for match in matches)} chunks in the vector store")
+        for i, email in enumerate(email_texts):
+            logger.debug(f"Email {i+1}: {email[:100]}")
+
+        # Step 2: Re-rank results for better relevance
+        with span("rerank", reranker=type(self.reranker).__name__, candidates=len(email_texts)) as stage:
+            reranked_texts = self.rerank_results(user_question, email_texts, [match['score'] for match in matches])
+        logger.info(f"Re-ranked {len(email_texts)} emails with {type(self.reranker).__name__} "
+                    f"in {stage.duration * 1000:.1f}ms")
+        for i, email in enumerate(reranked_texts):
+            logger.debug(f"Reranked Email {i+1}: {email[:100]}")
+        return reranked_texts, [match['id'] for match in matches]
+
+    async def agenerate_answer(self, user_question, stream=False, profile=False):
+        """
+        Async generate_answer. Every network call is awaited on the async OpenAI, reranker
+        and vector store clients, so one event loop can serve many questions at once.
+        With stream=True an async iterator over the answer tokens is returned. The profile
+        covers the whole event loop thread, so concurrent requests show up in it too.
+        """
+        with profiled(profile), span("answer", stream=stream) as answer_span:
+            started = time.perf_counter()
+            logger.debug("Generating embedding for question")
+            embedding = asyncio.create_task(aget_embedding(user_question))
+            lexical = None
+            try:
+                # The filter lookup and the BM25 search need no embedding, so they run
+                # while the question is embedded
+                filter = await asyncio.to_thread(self.query_filter, user_question)
+                lexical = self.pc.alexical_search(user_question, top_k=self.top_k, filter=filter)
+                question_embedding = await embedding
+            except BaseException:
+                embedding.cancel()
+                if lexical is not None:
+                    lexical.cancel()
+                raise
+            cached = self._cached_answer(question_embedding, filter, started)
+            answer_span.set(cache_hit=cached is not None)
+            if cached is not None:
+                lexical.cancel()
+                return _aiter([cached]) if stream else cached
+
+            reranked_texts, email_ids = await self.aretrieve(user_question, question_embedding, lexical, filter)
+
+            # Step 3: Generate response using OpenAI
+            logger.debug("Sending prompt to OpenAI for final response")
+            messages = self.build_prompt(user_question, reranked_texts)
+            on_complete = lambda answer: self._cache_answer(user_question, question_embedding, filter, answer,
+                                                            email_ids)
+            if stream:
+                answer_span.detach()
+                return self._astream_answer(messages, started, on_complete, answer_span)
+            with span("completion", stream=False) as stage:
+                response = await self.async_client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages
+                )
+                record_usage(stage, response)
+
+            answer = response.choices[0].message.content
+            logger.info(f"Successfully generated response in {time.perf_counter() - started:.2f}s")
+            on_complete(answer)
+            return answer
+
+    async def _astream_answer(self, messages, started, on_complete, answer_span):
+        recorder = _StreamRecorder(started, on_complete, answer_span)
+        try:
+            response = await self.async_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                stream=True
+            )
+            async for chunk in response:
+                token = recorder.add(chunk)
+                if token:
+                    yield token
+            recorder.finish()
+        finally:
+            recorder.close()
+
+    async def aretrieve(self, user_question, question_embedding=None, lexical_matches=None,
+                        filter=_FROM_QUESTION):
+        """
+        Async retrieve.
+
+        Args:
+            lexical_matches (asyncio.Task, optional): BM25 search for the question already
+                started with the vector store's alexical_search, under the same filter.
+                Defaults to None.
+            filter (dict, optional): As for retrieve.
+        """
+        # Step 1: Embed the question and query the vector store, with the BM25 search
+        # running alongside both
+        if filter is _FROM_QUESTION:
+            filter = await asyncio.to_thread(self.query_filter, user_question)
+        if lexical_matches is None:
+            lexical_matches = self.pc.alexical_search(user_question, top_k=self.top_k, filter=filter)
+        if question_embedding is None:
+            logger.debug("Generating embedding for question")
+            try:
+                question_embedding = await aget_embedding(user_question)
+            except BaseException:
+                lexical_matches.cancel()
+                raise
+        matches = await self.pc.aquery_matches(user_question, top_k=self.top_k, query_vector=question_embedding,
+                                               filter=filter, lexical_matches=lexical_matches)
+        if filter and not matches:
+            logger.info(f"No emails match {filter}, retrying without filters")
+            matches = await self.pc.aquery_matches(user_question, top_k=self.top_k,
+                                                   query_vector=question_embedding)
+        email_texts = [match['metadata']['text'] for match in matches]
+        logger.info(f"Retrieved {len(email_texts)} emails from "
+                    f"{sum(len(match['chunks']) for match in matches)} chunks in the vector store")
+
+        # Step 2: Re-rank results for better relevance
+        with span("rerank", reranker=type(self.reranker).__name__, candidates=len(email_texts)) as stage:
+            reranked_texts = await self.arerank_results(user_question, email_texts,
+                                                        [match['score'] for match in matches])
+        logger.info(f"Re-ranked {len(email_texts)} emails with {type(self.reranker).__name__} "
+                    f"in {stage.duration * 1000:.1f}ms")
+        return reranked_texts, [match['id'] for match in matches]
+
+class _StreamRecorder:
+    """
+    Bookkeeping shared by the sync and async streaming paths: times the first token,
+    collects the answer for on_complete and owns the completion span.
+    """
+
+    def __init__(self, started, on_complete, answer_span):
+        self.started = started
+        self.on_complete = on_complete
+        self.answer_span = answer_span
+        # Spans are ended by hand: a generator must not hold the current span across yields
+        self.stage = get_tracer().start_span("completion", parent=answer_span, stream=True)
+        self.first_token_at = None
+        self.tokens = []
+
+    def add(self, chunk):
+        """Record a streamed chunk and return its token, or None if it carries none."""
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if not token:
+            return None
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            logger.debug(f"First token after {self.first_token_at - self.started:.2f}s")
+        self.tokens.append(token)
+        return token
+
+    def finish(self):
+        """Record the completed stream and hand the full answer to on_complete."""
+        finished = time.perf_counter()
+        ttft = (self.first_token_at or finished) - self.started
+        # Streamed responses carry no usage; each chunk is about one token
+        self.stage.set(ttft_ms=round(ttft * 1000, 3), completion_chunks=len(self.tokens))
+        logger.info(f"Successfully streamed response: time to first token {ttft:.2f}s, "
+                    f"total {finished - self.started:.2f}s")
+        self.on_complete("".join(self.tokens))
+
+    def close(self):
+        """End the spans, whether or not the stream completed."""
+        self.stage.end()
+        self.answer_span.end()
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
 # if __name__ == "__main__":
 #     generator = Generator()
 #     print(generator.generate_answer("What is the latest rapido invoice amount?"))
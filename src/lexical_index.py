@@ -0,0 +1,355 @@
+import os
+import re
+import json
+import math
+import sqlite3
+import logging
+import threading
+import numpy as np
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from filters import compile_filter, field_rows, prefix_values
+from tenants import tenant_path
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"[a-z0-9]+")
+# Sender addresses, order numbers, invoice IDs... also indexed whole, for exact lookups
+# (the lookbehind keeps the scan from retrying inside every word)
+COMPOUND = re.compile(r"(?<![a-z0-9])[a-z0-9]+(?:[-_./@#:][a-z0-9]+)+")
+# Too common to help ranking; leaving them out keeps their huge posting lists off the query path
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its me my of on or our so that the "
+    "their this to was we were what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens of a text, plus every compound token (e.g. "403-1234567-7654321")."""
+    text = text.lower()
+    return [word for word in WORD.findall(text) if word not in STOPWORDS] + COMPOUND.findall(text)
+
+
+def encode_postings(postings: Iterable[Tuple[int, int]]) -> bytes:
+    """Encode (doc number, term frequency) pairs, sorted by doc number, as delta varints."""
+    out = bytearray()
+    previous = 0
+    for docno, tf in postings:
+        for value in (docno - previous, tf):
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        previous = docno
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inverse of encode_postings, vectorized.
+
+    Returns:
+        tuple: Doc numbers and term frequencies as int64 arrays
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    last = raw < 0x80
+    # Group every byte with the varint it belongs to and weight it by its 7-bit position
+    group = np.concatenate(([0], np.cumsum(last)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    position = np.arange(len(raw)) - starts[group]
+    values = np.bincount(group, weights=(raw & 0x7F) * np.exp2(7 * position)).astype(np.int64)
+    return np.cumsum(values[0::2]), values[1::2]
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Merge ranked match lists with reciprocal rank fusion.
+
+    Args:
+        result_lists (list): Lists of matches ('id', 'score', 'metadata'), each best first
+        k (int, optional): RRF damping constant. Defaults to 60.
+
+    Returns:
+        list: Matches best first; 'score' is the fused score sum(1 / (k + rank))
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, match in enumerate(results, start=1):
+            entry = fused.get(match['id'])
+            if entry is None:
+                entry = fused[match['id']] = {'id': match['id'], 'score': 0.0, 'metadata': match['metadata']}
+            entry['score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda match: -match['score'])
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over email chunks, stored in SQLite.
+
+    Postings are kept as blobs of delta-encoded varints, one row per term per write
+    batch, so an upsert only appends. Deleted or replaced chunks leave stale postings
+    behind that are skipped at query time; `compact()` merges each term's blocks and
+    drops them. Chunk metadata is stored with the document so lexical-only hits can be
+    returned without a round trip to the vector store, and its filterable fields are
+    indexed in doc_fields (as in LocalVectorStore), so a filter is resolved in SQL and
+    applied to the scores before ranking.
+    """
+
+    # Merge a term's posting blocks on flush once it has this many
+    COMPACT_BLOCKS = 8
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path: str = "lexical_index.sqlite", k1: float = 1.2, b: float = 0.75):
+        """
+        Open (or create) the index.
+
+        Args:
+            path (str, optional): SQLite file location. Defaults to "lexical_index.sqlite".
+            k1 (float, optional): BM25 term-frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " docno INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, length INTEGER NOT NULL,"
+            " metadata TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL, block INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (term, block))")
+        backfill = self._conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'doc_fields'").fetchone()[0] == 0
+        self._conn.execute("CREATE TABLE IF NOT EXISTS doc_fields (docno INTEGER NOT NULL, field TEXT NOT NULL, value)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS doc_fields_value ON doc_fields(field, value, docno)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS doc_fields_docno ON doc_fields(docno)")
+        if backfill:
+            self._conn.executemany("INSERT INTO doc_fields (docno, field, value) VALUES (?, ?, ?)",
+                                   [field_row for docno, metadata in self._conn.execute("SELECT docno, metadata FROM docs").fetchall()
+                                    for field_row in field_rows(docno, json.loads(metadata))])
+        self._conn.commit()
+        # Length of every document by doc number (-1: deleted), needed for every query
+        self._lengths = np.full(1024, -1, dtype=np.int32)
+        self._doc_count = self._total_length = 0
+        for docno, length in self._conn.execute("SELECT docno, length FROM docs"):
+            self._set_length(docno, length)
+        self._next_block = self._conn.execute("SELECT COALESCE(MAX(block), 0) + 1 FROM postings").fetchone()[0]
+        logger.info(f"Opened lexical index {path} with {self._doc_count} documents")
+
+    def _set_length(self, docno: int, length: int) -> None:
+        if docno >= len(self._lengths):
+            grown = np.full(max(len(self._lengths) * 2, docno + 1), -1, dtype=np.int32)
+            grown[:len(self._lengths)] = self._lengths
+            self._lengths = grown
+        self._lengths[docno] = length
+        self._doc_count += 1
+        self._total_length += length
+
+    def add(self, docs: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """
+        Index (or re-index) documents.
+
+        Args:
+            docs (list): (id, text, metadata) tuples
+        """
+        if not docs:
+            return
+        with self._lock:
+            self._delete_ids([doc_id for doc_id, _, _ in docs])
+            term_postings = defaultdict(list)
+            for doc_id, text, metadata in docs:
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                cursor = self._conn.execute("INSERT INTO docs (id, length, metadata) VALUES (?, ?, ?)",
+                                            (doc_id, length, json.dumps(metadata)))
+                self._conn.executemany("INSERT INTO doc_fields (docno, field, value) VALUES (?, ?, ?)",
+                                       field_rows(cursor.lastrowid, metadata))
+                self._set_length(cursor.lastrowid, length)
+                for term, tf in counts.items():
+                    term_postings[term].append((cursor.lastrowid, tf))
+            block = self._next_block
+            self._next_block += 1
+            self._conn.executemany("INSERT INTO postings (term, block, data) VALUES (?, ?, ?)",
+                                   [(term, block, encode_postings(postings))
+                                    for term, postings in term_postings.items()])
+            self._conn.commit()
+
+    def delete(self, message_ids: Optional[List[str]], separator: str = "#") -> None:
+        """
+        Remove every chunk of the given messages.
+
+        Args:
+            message_ids (list): Gmail message IDs, or None to clear the index
+            separator (str, optional): Separator between message ID and chunk number. Defaults to "#".
+        """
+        with self._lock:
+            if message_ids is None:
+                self._conn.execute("DELETE FROM docs")
+                self._conn.execute("DELETE FROM doc_fields")
+                self._conn.execute("DELETE FROM postings")
+                self._lengths[:] = -1
+                self._doc_count = self._total_length = 0
+            else:
+                ids = []
+                for message_id in message_ids:
+                    prefix = f"{message_id}{separator}"
+                    # Chunk IDs sort between "<id>#" and "<id>" + the character after "#"
+                    ids.extend(row[0] for row in self._conn.execute(
+                        "SELECT id FROM docs WHERE id = ? OR (id >= ? AND id < ?)",
+                        (message_id, prefix, prefix[:-1] + chr(ord(separator) + 1))))
+                self._delete_ids(ids)
+            self._conn.commit()
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """
+        Remove documents by ID.
+
+        Args:
+            ids (list): Chunk IDs
+        """
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.commit()
+
+    def _delete_ids(self, ids: List[str]) -> None:
+        for i in range(0, len(ids), self.LOOKUP_CHUNK):
+            chunk = ids[i:i + self.LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(f"SELECT docno, length FROM docs WHERE id IN ({placeholders})", chunk).fetchall()
+            for docno, length in rows:
+                self._lengths[docno] = -1
+                self._doc_count -= 1
+                self._total_length -= length
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", chunk)
+            self._conn.executemany("DELETE FROM doc_fields WHERE docno = ?", [(docno,) for docno, _ in rows])
+
+    def _postings(self, term_blocks: Iterable[Tuple[str, bytes]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Decode posting blocks per term, keeping only live documents."""
+        blocks = defaultdict(list)
+        for term, data in term_blocks:
+            blocks[term].append(decode_postings(data))
+        postings = {}
+        for term, decoded in blocks.items():
+            docnos = np.concatenate([docno for docno, _ in decoded])
+            tfs = np.concatenate([tf for _, tf in decoded])
+            live = self._lengths[docnos] >= 0
+            postings[term] = (docnos[live], tfs[live])
+        return postings
+
+    def search(self, query: str, top_k: int, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Rank documents against a query with BM25.
+
+        Args:
+            query (str): Query text
+            top_k (int): Number of matches to return
+            filter (dict, optional): Pinecone-style metadata filter over filters.FILTER_FIELDS
+
+        Returns:
+            list: Matches best first, as dicts with 'id', 'score' and 'metadata'
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            if not self._doc_count:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            postings = self._postings(self._conn.execute(
+                f"SELECT term, data FROM postings WHERE term IN ({placeholders})", terms))
+
+            average_length = self._total_length / self._doc_count
+            scores = np.zeros(len(self._lengths), dtype=np.float64)
+            for docnos, tfs in postings.values():
+                if not len(docnos):
+                    continue
+                idf = math.log(1 + (self._doc_count - len(docnos) + 0.5) / (len(docnos) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[docnos] / average_length)
+                # A document appears at most once in a term's postings
+                scores[docnos] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+            if filter:
+                # Statistics stay corpus-wide; only documents outside the filter are dropped
+                sql, params = compile_filter(filter, key="docno")
+                allowed = np.array(self._conn.execute(sql, params).fetchall(), dtype=np.int64).reshape(-1)
+                mask = np.zeros(len(scores), dtype=bool)
+                mask[allowed] = True
+                scores[~mask] = 0
+
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            hits = hits[np.argsort(-scores[hits])].tolist()
+            if not hits:
+                return []
+            rows = self._conn.execute(
+                f"SELECT docno, id, metadata FROM docs WHERE docno IN ({','.join('?' * len(hits))})", hits)
+            docs = {docno: (doc_id, json.loads(metadata)) for docno, doc_id, metadata in rows}
+        return [{'id': docs[docno][0], 'score': float(scores[docno]), 'metadata': docs[docno][1]} for docno in hits]
+
+    def field_values(self, field: str, prefix: str) -> List[Any]:
+        """
+        Distinct stored values of a filterable text field that start with prefix.
+
+        Args:
+            field (str): One of filters.FILTER_FIELDS
+            prefix (str): Value prefix
+
+        Returns:
+            list: Matching values, sorted
+        """
+        with self._lock:
+            return prefix_values(self._conn, field, prefix)
+
+    def compact(self, min_blocks: int = None) -> int:
+        """
+        Merge the posting blocks of each term into one and drop postings of deleted documents.
+
+        Args:
+            min_blocks (int, optional): Only merge terms with at least this many blocks. Defaults to 2.
+
+        Returns:
+            int: Number of terms rewritten
+        """
+        min_blocks = min_blocks or 2
+        with self._lock:
+            terms = [row[0] for row in self._conn.execute(
+                "SELECT term FROM postings GROUP BY term HAVING COUNT(*) >= ?", (min_blocks,))]
+            for term in terms:
+                docnos, tfs = self._postings(self._conn.execute(
+                    "SELECT term, data FROM postings WHERE term = ?", (term,)))[term]
+                order = np.argsort(docnos)
+                self._conn.execute("DELETE FROM postings WHERE term = ?", (term,))
+                if len(order):
+                    self._conn.execute("INSERT INTO postings (term, block, data) VALUES (?, 0, ?)",
+                                       (term, encode_postings(zip(docnos[order].tolist(), tfs[order].tolist()))))
+            self._conn.commit()
+        if terms:
+            logger.info(f"Compacted postings of {len(terms)} terms")
+        return len(terms)
+
+    def flush(self) -> None:
+        """Merge terms whose postings have become fragmented by many small writes."""
+        self.compact(self.COMPACT_BLOCKS)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_lexical_index(tenant: str = None) -> Optional[LexicalIndex]:
+    """
+    Open the lexical index configured through LEXICAL_INDEX (set to "0" to disable)
+    and LEXICAL_INDEX_PATH environment variables, or return None when disabled.
+
+    Args:
+        tenant (str, optional): Open this tenant's own index (see tenants.tenant_path).
+            Defaults to None (single-tenant).
+    """
+    if os.getenv("LEXICAL_INDEX", "1") == "0":
+        return None
+    return LexicalIndex(path=tenant_path(os.getenv("LEXICAL_INDEX_PATH", "lexical_index.sqlite"), tenant))
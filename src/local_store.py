@@ -0,0 +1,385 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Any, Tuple
+from vector_db import VectorStore
+from ann_index import IVFIndex
+from chunker import CHUNK_SEPARATOR
+from filters import compile_filter, field_rows, prefix_values
+
+logger = logging.getLogger(__name__)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store backed by a memory-mapped matrix of normalized float32 vectors.
+
+    Layout of the index directory:
+        vectors.f32   row-major (capacity x dimension) float32 matrix, grown by doubling
+        docs.sqlite   email ID, matrix row and JSON metadata for every stored email, plus
+                      the filterable metadata fields (one row per value) in doc_fields
+
+        ivf.npz       IVF centroids, assignments and codes (index_type="ivf" only)
+        codes.i8      int8 copy of the matrix, and its per-row scales in scales.f32
+                      (index_type="flat" with quantization="int8" only)
+
+    Vectors are L2-normalized on write, so cosine similarity is a single matrix-vector
+    product. Deleted rows are put on a free list and reused by later upserts.
+
+    With quantization="int8", exact search scans the int8 codes, a quarter of the size of
+    the float32 matrix, and re-scores only the best RERANK_FACTOR * top_k candidates from
+    the float32 vectors, so the full matrix no longer has to stay in memory.
+
+    With index_type="ivf", queries go through an approximate IVFIndex once the store holds
+    `ivf_min_size` vectors; smaller stores are searched exactly.
+
+    Metadata filters are resolved against doc_fields first. Up to FILTER_EXACT_LIMIT
+    matching rows are scored exactly; larger sets restrict the IVF search instead.
+    """
+
+    FILTER_EXACT_LIMIT = 10000
+    # int8 flat search: candidates re-scored exactly per result (at least MIN_RERANK), and
+    # rows converted to float32 at a time while scanning the codes
+    RERANK_FACTOR = 10
+    MIN_RERANK = 64
+    SCAN_BLOCK = 1024
+
+    def __init__(self, path: str = "local_index", dimension: int = 1536, index_type: str = "flat",
+                 nlist: int = 1024, nprobe: int = 16, quantization: str = None, pq_m: int = 96,
+                 ivf_min_size: int = 50000, **kwargs):
+        """
+        Open (or create) a local index.
+
+        Args:
+            path (str, optional): Directory holding the index files. Defaults to "local_index".
+            dimension (int, optional): Embedding dimension. Defaults to 1536 (text-embedding-3-small).
+            index_type (str, optional): "flat" for exact search or "ivf" for approximate. Defaults to "flat".
+            nlist (int, optional): IVF clusters. Defaults to 1024.
+            nprobe (int, optional): IVF clusters scanned per query (recall/latency knob). Defaults to 16.
+            quantization (str, optional): Candidate scoring codes: None, "int8" or, with the IVF
+                index only, "pq". Defaults to None.
+            pq_m (int, optional): PQ sub-quantizers. Defaults to 96.
+            ivf_min_size (int, optional): Store size at which the IVF index is trained. Defaults to 50000.
+            **kwargs: Pipeline settings passed to VectorStore (batch_size, max_batch_tokens, concurrency)
+        """
+        super().__init__(**kwargs)
+        if index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+        if index_type == "flat" and quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization for a flat index: {quantization}")
+        self.path = path
+        self.dimension = dimension
+        self.index_type = index_type
+        self.ivf_min_size = ivf_min_size
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(path, "docs.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, row INTEGER NOT NULL, metadata TEXT NOT NULL)")
+        backfill = self._db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'doc_fields'").fetchone()[0] == 0
+        # Untyped value column, so numbers and strings keep their own type and comparisons.
+        # The (field, value, row) index covers filter lookups without touching the table.
+        self._db.execute("CREATE TABLE IF NOT EXISTS doc_fields (row INTEGER NOT NULL, field TEXT NOT NULL, value)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS doc_fields_value ON doc_fields(field, value, row)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS doc_fields_row ON doc_fields(row)")
+        if backfill:
+            self._db.executemany("INSERT INTO doc_fields (row, field, value) VALUES (?, ?, ?)",
+                                 [field_row for row, metadata in self._db.execute("SELECT row, metadata FROM docs").fetchall()
+                                  for field_row in field_rows(row, json.loads(metadata))])
+        self._db.commit()
+
+        # ID <-> row maps and the live-row mask are small enough to keep in memory
+        self._rows: Dict[str, int] = {}
+        self._ids: Dict[int, str] = {}
+        for email_id, row in self._db.execute("SELECT id, row FROM docs"):
+            self._rows[email_id] = row
+            self._ids[row] = email_id
+        self._size = max(self._ids, default=-1) + 1
+        self._free = [row for row in range(self._size) if row not in self._ids]
+
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._codes_path = self._scales_path = None
+        if index_type == "flat" and quantization == "int8":
+            self._codes_path = os.path.join(path, "codes.i8")
+            self._scales_path = os.path.join(path, "scales.f32")
+        encode_existing = self._codes_path is not None and not os.path.exists(self._codes_path) and self._ids
+        self._capacity = 0
+        self._vectors = self._codes = self._scales = None
+        self._open_vectors(max(self._size, 1024))
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._alive[list(self._ids)] = True
+        if encode_existing:
+            # Quantization turned on for an existing store: encode what is already there
+            rows = np.flatnonzero(self._alive[:self._size])
+            logger.info(f"Encoding {len(rows)} stored vectors to int8")
+            for start in range(0, len(rows), 65536):
+                chunk = rows[start:start + 65536]
+                self._write_codes(chunk, np.asarray(self._vectors[chunk]))
+
+        self._ivf_path = os.path.join(path, "ivf.npz")
+        self._ivf = None
+        if index_type == "ivf":
+            self._ivf = IVFIndex(dimension, nlist=nlist, nprobe=nprobe, quantization=quantization, pq_m=pq_m)
+            if self._ivf.load(self._ivf_path):
+                # Index rows written after the last flush
+                missing = np.flatnonzero(self._alive[:self._size] & (self._padded_assign() < 0))
+                if len(missing):
+                    self._ivf.add(missing, np.asarray(self._vectors[missing]))
+        logger.info(f"Opened local vector store at {path} with {len(self._rows)} emails")
+
+    def _open_vectors(self, capacity: int) -> None:
+        """Map the vector file (and int8 code files), growing them to hold at least `capacity` rows."""
+        for matrix in (self._vectors, self._codes, self._scales):
+            if matrix is not None:
+                matrix.flush()
+        self._vectors = self._codes = self._scales = None
+        row_bytes = self.dimension * 4
+        existing = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        capacity = max(capacity, existing)
+        self._vectors = self._map_rows(self._vectors_path, np.float32, capacity, (self.dimension,))
+        if self._codes_path is not None:
+            self._codes = self._map_rows(self._codes_path, np.int8, capacity, (self.dimension,))
+            self._scales = self._map_rows(self._scales_path, np.float32, capacity, ())
+        self._capacity = capacity
+
+    @staticmethod
+    def _map_rows(path: str, dtype, capacity: int, row_shape: Tuple[int, ...]) -> np.memmap:
+        with open(path, 'ab') as f:
+            f.truncate(capacity * np.dtype(dtype).itemsize * int(np.prod(row_shape)))
+        return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity, *row_shape))
+
+    def _write_codes(self, rows, matrix: np.ndarray) -> None:
+        """Store the int8 codes of normalized vectors: each row scaled so its largest component is 127."""
+        scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127
+        self._codes[rows] = np.rint(matrix / scales[:, None]).astype(np.int8)
+        self._scales[rows] = scales
+        self._codes.flush()
+        self._scales.flush()
+
+    def _padded_assign(self) -> np.ndarray:
+        assign = np.full(self._size, -1, dtype=np.int32)
+        known = min(self._size, len(self._ivf.assign))
+        assign[:known] = self._ivf.assign[:known]
+        return assign
+
+    def _allocate_rows(self, count: int) -> List[int]:
+        rows = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        if len(rows) < count:
+            needed = count - len(rows)
+            if self._size + needed > self._capacity:
+                self._open_vectors(max(self._capacity * 2, self._size + needed))
+                alive = np.zeros(self._capacity, dtype=bool)
+                alive[:len(self._alive)] = self._alive
+                self._alive = alive
+            rows.extend(range(self._size, self._size + needed))
+            self._size += needed
+        return rows
+
+    def _upsert_vectors(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        matrix = np.asarray([vector for _, vector, _ in vectors], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        with self._lock:
+            new_ids = [email_id for email_id in dict.fromkeys(email_id for email_id, _, _ in vectors)
+                       if email_id not in self._rows]
+            for email_id, row in zip(new_ids, self._allocate_rows(len(new_ids))):
+                self._rows[email_id] = row
+                self._ids[row] = email_id
+            rows = [self._rows[email_id] for email_id, _, _ in vectors]
+            self._vectors[rows] = matrix
+            self._alive[rows] = True
+            self._vectors.flush()
+            if self._codes is not None:
+                self._write_codes(rows, matrix)
+            if self._ivf is not None:
+                if self._ivf.trained:
+                    self._ivf.add(np.asarray(rows), matrix)
+                elif len(self._rows) >= self.ivf_min_size:
+                    self._ivf.train(self._vectors, np.flatnonzero(self._alive[:self._size]))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO docs (id, row, metadata) VALUES (?, ?, ?)",
+                [(email_id, row, json.dumps(metadata))
+                 for (email_id, _, metadata), row in zip(vectors, rows)])
+            self._db.executemany("DELETE FROM doc_fields WHERE row = ?", [(row,) for row in rows])
+            self._db.executemany("INSERT INTO doc_fields (row, field, value) VALUES (?, ?, ?)",
+                                 [field_row for (_, _, metadata), row in zip(vectors, rows)
+                                  for field_row in field_rows(row, metadata)])
+            self._db.commit()
+
+    def _query_vectors(self, vector: List[float], top_k: int, filter: Dict[str, Any] = None,
+                       nprobe: int = None) -> List[Dict[str, Any]]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        with self._lock:
+            if not self._rows:
+                return []
+            candidates = None
+            if filter:
+                candidates = self._filter_rows(filter)
+                if not len(candidates):
+                    return []
+            if candidates is not None and (len(candidates) <= self.FILTER_EXACT_LIMIT or
+                                           self._ivf is None or not self._ivf.trained):
+                # Gathering scattered rows costs more than a sequential scan once they are dense
+                if len(candidates) * 4 > self._size:
+                    mask = np.zeros(self._size, dtype=bool)
+                    mask[candidates] = True
+                    top, scores = self._exact_search(query, top_k, mask=mask)
+                else:
+                    top, scores = self._exact_search(query, top_k, candidates)
+            elif self._ivf is not None and self._ivf.trained:
+                alive = self._alive
+                if candidates is not None:
+                    alive = np.zeros_like(self._alive)
+                    alive[candidates] = True
+                top, scores = self._ivf.search(query, top_k, self._vectors, alive, nprobe=nprobe)
+            else:
+                top, scores = self._exact_search(query, top_k)
+            ids = [self._ids[int(row)] for row in top]
+            metadata = self._fetch_metadata(ids)
+        return [{'id': email_id, 'score': float(score), 'metadata': metadata[email_id]}
+                for email_id, score in zip(ids, scores)]
+
+    def _exact_search(self, query: np.ndarray, top_k: int, rows: np.ndarray = None, mask: np.ndarray = None):
+        if self._codes is not None:
+            return self._quantized_search(query, top_k, rows, mask)
+        if rows is not None:
+            # Sorted rows keep memmap reads sequential
+            rows = np.sort(rows)
+            # Gathered in blocks that stay in cache instead of copying every row out first
+            vectors = self._vectors.view(np.ndarray)
+            scores = np.concatenate([vectors[rows[start:start + 512]] @ query
+                                     for start in range(0, len(rows), 512)])
+            k = min(top_k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return rows[top], scores[top]
+        scores = self._vectors[:self._size] @ query
+        mask = self._alive[:self._size] if mask is None else mask
+        scores[~mask] = -np.inf
+        k = min(top_k, int(mask.sum()))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def _quantized_search(self, query: np.ndarray, top_k: int, rows: np.ndarray = None, mask: np.ndarray = None):
+        """_exact_search over the int8 codes, re-scoring the best candidates from the float32 vectors."""
+        codes = self._codes.view(np.ndarray)
+        block = self.SCAN_BLOCK
+        if rows is None:
+            mask = self._alive[:self._size] if mask is None else mask
+            rows = np.arange(self._size)
+            scores = np.concatenate([codes[start:min(start + block, self._size)].astype(np.float32) @ query
+                                     for start in range(0, self._size, block)])
+            scores *= self._scales[:self._size]
+            scores[~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            rows = np.sort(rows)
+            scores = np.concatenate([codes[rows[start:start + block]].astype(np.float32) @ query
+                                     for start in range(0, len(rows), block)])
+            scores *= self._scales[rows]
+            available = len(rows)
+        keep = min(available, max(top_k * self.RERANK_FACTOR, self.MIN_RERANK))
+        candidates = np.sort(rows[np.argpartition(-scores, keep - 1)[:keep]])
+        exact = np.asarray(self._vectors[candidates]) @ query
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-exact, k - 1)[:k]
+        top = top[np.argsort(-exact[top])]
+        return candidates[top], exact[top]
+
+    def _field_values(self, field: str, prefix: str) -> List[Any]:
+        with self._lock:
+            return prefix_values(self._db, field, prefix)
+
+    def _filter_rows(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Rows of the chunks whose metadata satisfies a Pinecone-style filter."""
+        sql, params = compile_filter(filter)
+        rows = np.array(self._db.execute(sql, params).fetchall(), dtype=np.int64).reshape(-1)
+        return rows[self._alive[rows]]
+
+    def flush(self) -> None:
+        """Save the IVF index so it does not have to be rebuilt on the next start."""
+        super().flush()
+        with self._lock:
+            if self._ivf is not None:
+                self._ivf.save(self._ivf_path)
+
+    def _fetch_metadata(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        placeholders = ",".join("?" * len(ids))
+        rows = self._db.execute(f"SELECT id, metadata FROM docs WHERE id IN ({placeholders})", ids)
+        return {email_id: json.loads(metadata) for email_id, metadata in rows}
+
+    def get_email_count(self) -> int:
+        """
+        Get the total count of email vectors in the database.
+
+        Returns:
+            int: Total number of stored vectors
+        """
+        count = len(self._rows)
+        logger.info(f"Current email count in database: {count}")
+        return count
+
+    def _chunk_ids(self, email_id: str) -> List[str]:
+        # Chunk IDs are "<email_id>#<n>"; "$" sorts right after "#", bounding the range
+        prefix = f"{email_id}{CHUNK_SEPARATOR}"
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT id FROM docs WHERE id = ? OR (id >= ? AND id < ?)",
+                (email_id, prefix, prefix[:-1] + chr(ord(CHUNK_SEPARATOR) + 1)))]
+
+    def _delete_vectors(self, ids: List[str]) -> None:
+        with self._lock:
+            rows = [self._rows.pop(vector_id) for vector_id in ids if vector_id in self._rows]
+            for row in rows:
+                del self._ids[row]
+                self._alive[row] = False
+                if self._ivf is not None:
+                    self._ivf.remove(row)
+                self._free.append(row)
+            self._db.executemany("DELETE FROM docs WHERE id = ?", [(vector_id,) for vector_id in ids])
+            self._db.executemany("DELETE FROM doc_fields WHERE row = ?", [(row,) for row in rows])
+            self._db.commit()
+
+    def delete_email(self, email_id: str) -> None:
+        """
+        Delete a specific email (all of its chunks) from the database by its ID.
+
+        Args:
+            email_id (str): The ID of the email to delete
+        """
+        logger.info(f"Deleting email with ID: {email_id}")
+        with self._lock:
+            ids = self._chunk_ids(email_id)
+            self._delete_vectors(ids)
+        self._on_deleted([email_id])
+        logger.info(f"Successfully deleted email {email_id} ({len(ids)} vectors)")
+
+    def delete_all_emails(self) -> None:
+        """
+        Delete all emails from the database.
+        Warning: This is a destructive operation that cannot be undone.
+        """
+        logger.warning("Initiating deletion of ALL emails from the database")
+        with self._lock:
+            self._rows.clear()
+            self._ids.clear()
+            self._free = []
+            self._size = 0
+            self._alive[:] = False
+            self._db.execute("DELETE FROM docs")
+            self._db.execute("DELETE FROM doc_fields")
+            self._db.commit()
+            if self._ivf is not None:
+                self._ivf = IVFIndex(self.dimension, nlist=self._ivf.nlist, nprobe=self._ivf.nprobe,
+                                     quantization=self._ivf.quantization, pq_m=self._ivf.pq_m)
+                if os.path.exists(self._ivf_path):
+                    os.remove(self._ivf_path)
+        self._on_deleted(None)
+        logger.info("Successfully deleted all emails from the database")
@@ -1,13 +1,17 @@
 import os
 from tqdm import tqdm
 import json
-import base64
+import time
+import random
 import logging
-from openai import OpenAI
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2.credentials import Credentials
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from googleapiclient.errors import HttpError
+from filters import sender_fields
+from mime import parse_messages
+from tracing import get_tracer, span
+from ratelimit import get_rate_limiter
 
 # Configure logging
 logging.basicConfig(
@@ -20,15 +24,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# MIME parsing pool shared by every MailClient of the process, so that mailboxes
+# ingested concurrently split the cores instead of each starting a pool of its own
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
 class MailClient:
     """A class to handle Gmail API operations and email processing."""
     
     # Gmail API Scope - Required for read-only access to Gmail messages
     SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+    # HTTP statuses worth retrying: rate limiting and transient server errors
+    RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+    BACKOFF_BASE = 1.0   # seconds before the first retry, doubled on each attempt
+    BACKOFF_MAX = 32.0
+
+    # Gmail API quota units per call, drawn from the shared 'gmail_units' rate limit
+    QUOTA_UNITS = {'messages.get': 5, 'messages.list': 5, 'history.list': 2, 'getProfile': 1}
     
-    def __init__(self):
-        """Initialize Mail instance with Gmail service."""
-        self.service = self._get_gmail_service()
+    def __init__(self, service=None, parallelism: int = 8, batch_size: int = 50, max_retries: int = 5,
+                 parse_processes: int = None, token_path: str = 'token.json'):
+        """
+        Initialize Mail instance with Gmail service.
+
+        Args:
+            service: Prebuilt Gmail service object. When given, no authentication is done and
+                the same object is shared by all fetch workers (used for offline fakes).
+            parallelism: Number of worker threads fetching messages concurrently
+            batch_size: Number of messages.get calls grouped into one batch HTTP request
+                (Gmail allows up to 100, 50 or fewer avoids rate limiting)
+            max_retries: Retries per message on rate-limit (429) and 5xx errors
+            parse_processes: Worker processes parsing MIME bodies (see mime.py), started on
+                demand. 0 parses in the fetch threads instead. Defaults to the number of CPUs,
+                or 0 on a single CPU where a pool only adds overhead.
+            token_path: Where this mailbox's OAuth token is stored; one per mailbox when
+                several are ingested (credentials.json, the OAuth app, is shared)
+        """
+        self.parallelism = parallelism
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        if parse_processes is None:
+            parse_processes = os.cpu_count() or 1
+            parse_processes = parse_processes if parse_processes > 1 else 0
+        self.parse_processes = parse_processes
+        self.token_path = token_path
+        self.creds = None
+        self._local = threading.local()
+        self.service = service or self._get_gmail_service()
     
     def _get_gmail_service(self):
         """
@@ -38,17 +81,24 @@ class MailClient:
             service: Authenticated Gmail API service object
         
         This method handles the OAuth2 authentication flow:
-        1. Checks for existing credentials in token.json
+        1. Checks for existing credentials in the token file
         2. Refreshes expired credentials if possible
         3. Initiates new authentication flow if needed
         """
+        # The Google API client and auth stack are slow to import, so only pay for them
+        # when a real Gmail connection is made (not with a prebuilt service)
+        from googleapiclient.discovery import build
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.oauth2.credentials import Credentials
+
         logger.info("Initializing Gmail service authentication")
         creds = None
         
         # Load existing credentials if available
-        if os.path.exists('token.json'):
-            logger.debug("Found existing token.json file")
-            creds = Credentials.from_authorized_user_file('token.json', self.SCOPES)
+        if os.path.exists(self.token_path):
+            logger.debug(f"Found existing {self.token_path} file")
+            creds = Credentials.from_authorized_user_file(self.token_path, self.SCOPES)
 
         # Handle credential validation and refresh
         if not creds or not creds.valid:
@@ -62,13 +112,348 @@ class MailClient:
                 creds = flow.run_local_server(port=0)
             
             # Save the credentials for future use
-            with open('token.json', 'w') as token:
+            with open(self.token_path, 'w') as token:
                 token.write(creds.to_json())
-                logger.debug("Saved new credentials to token.json")
+                logger.debug(f"Saved new credentials to {self.token_path}")
 
         logger.info("Gmail service authentication successful")
+        self.creds = creds
         return build('gmail', 'v1', credentials=creds)
+
+    def _thread_service(self):
+        """
+        Return a Gmail service object owned by the calling thread.
+
+        The underlying httplib2 connection is not thread-safe, so each fetch worker builds
+        its own service from the shared credentials.
+        """
+        if self.creds is None:
+            return self.service
+        if not hasattr(self._local, 'service'):
+            from googleapiclient.discovery import build
+            self._local.service = build('gmail', 'v1', credentials=self.creds)
+        return self._local.service
+
+    def _backoff(self, attempt):
+        """Sleep with exponential backoff and jitter before retry number `attempt`."""
+        delay = min(self.BACKOFF_BASE * 2 ** attempt, self.BACKOFF_MAX)
+        delay += random.uniform(0, delay)
+        logger.debug(f"Backing off for {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
+
+    def _throttle(self, call, count=1):
+        """Wait for the quota units of `count` calls, if a shared Gmail limit is configured."""
+        limiter = get_rate_limiter('gmail_units')
+        if limiter:
+            limiter.acquire(self.QUOTA_UNITS[call] * count)
+
+    def _is_retryable(self, error):
+        """Rate limiting, transient server errors and network failures (timeouts, resets, TLS, DNS)."""
+        if isinstance(error, HttpError):
+            return error.resp.status in self.RETRYABLE_STATUSES
+        if isinstance(error, OSError):
+            return True
+        import httplib2  # already loaded by the Gmail client
+        return isinstance(error, httplib2.HttpLib2Error)
+
+    def _fetch_one(self, msg_id):
+        """Fetch a single message, retrying on rate-limit, server and network errors."""
+        service = self._thread_service()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._throttle('messages.get')
+                return service.users().messages().get(userId='me', id=msg_id).execute()
+            except Exception as e:
+                if not self._is_retryable(e) or attempt == self.max_retries:
+                    raise
+                self._backoff(attempt)
+
+    def _fetch_batch(self, msg_ids):
+        """
+        Fetch a group of messages with one batch HTTP request.
+
+        Messages that fail with a retryable status are resent in a smaller batch after a
+        backoff; other failures are logged and dropped. A failure of the batch request
+        itself is retried the same way when transient; otherwise, or once the retries
+        run out, the batch's remaining messages are logged and skipped. Never raises.
+
+        Args:
+            msg_ids: List of Gmail message IDs
+
+        Returns:
+            dict: Mapping of message ID to the full message resource
+        """
+        if len(msg_ids) == 1:
+            try:
+                return {msg_ids[0]: self._fetch_one(msg_ids[0])}
+            except Exception as e:
+                logger.error(f"Error fetching message ID {msg_ids[0]}: {str(e)}")
+                return {}
+
+        fetched = {}
+        pending = list(msg_ids)
+        for attempt in range(self.max_retries + 1):
+            retry = []
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif self._is_retryable(exception):
+                    retry.append(request_id)
+                else:
+                    logger.error(f"Error fetching message ID {request_id}: {str(exception)}")
+
+            try:
+                service = self._thread_service()
+                batch = service.new_batch_http_request(callback=callback)
+                for msg_id in pending:
+                    batch.add(service.users().messages().get(userId='me', id=msg_id), request_id=msg_id)
+                self._throttle('messages.get', len(pending))
+                batch.execute()
+            except Exception as e:
+                retry = [msg_id for msg_id in pending if msg_id not in fetched]
+                if not self._is_retryable(e):
+                    logger.error(f"Error fetching batch, skipping {len(retry)} messages: {str(e)}")
+                    break
+                logger.warning(f"Transient error fetching batch of {len(pending)} messages: {str(e)}")
+
+            if not retry:
+                break
+            if attempt == self.max_retries:
+                logger.error(f"Giving up on {len(retry)} messages after {self.max_retries} retries")
+                break
+            pending = retry
+            self._backoff(attempt)
+        return fetched
+
+    def _traced_fetch_batch(self, msg_ids):
+        """_fetch_batch in a tracing span recording how many messages came back and their size."""
+        with span("gmail_fetch", messages=len(msg_ids)) as stage:
+            fetched = self._fetch_batch(msg_ids)
+            stage.set(fetched=len(fetched),
+                      bytes=sum(message.get('sizeEstimate', 0) for message in fetched.values()))
+        return fetched
+
+    def _fetch_and_parse(self, msg_ids):
+        """Fetch a batch and parse it in the calling thread; returns what parse_messages does."""
+        fetched = self._traced_fetch_batch(msg_ids)
+        messages = [fetched[msg_id] for msg_id in msg_ids if msg_id in fetched]
+        with span("parse_mime", messages=len(messages)) as stage:
+            parsed, skipped = parse_messages(messages)
+            stage.set(emails=len(parsed))
+        return parsed, skipped
+
+    def _submit_batch(self, fetch_pool, parse_pool, msg_ids):
+        """
+        Fetch a batch on a thread, then parse it in a worker process.
+
+        Only the message resources go to the worker and only the compact parsed fields
+        come back. Without a parse_pool both steps run on the fetch thread.
+
+        Returns:
+            Future: Resolves to the (parsed, skipped) result of mime.parse_messages
+        """
+        if parse_pool is None:
+            return fetch_pool.submit(self._fetch_and_parse, msg_ids)
+        result = Future()
+
+        def on_parsed(parsing, stage):
+            try:
+                parsed, skipped = parsing.result()
+            except BaseException as e:
+                stage.set(error=type(e).__name__)
+                result.set_exception(e)
+            else:
+                stage.set(emails=len(parsed))
+                result.set_result((parsed, skipped))
+            stage.end()
+
+        def on_fetched(fetch):
+            try:
+                fetched = fetch.result()
+                messages = [fetched[msg_id] for msg_id in msg_ids if msg_id in fetched]
+                # Timed from submission, so the span includes waiting for a free worker
+                stage = get_tracer().start_span("parse_mime", messages=len(messages))
+                parsing = parse_pool.submit(parse_messages, messages)
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            parsing.add_done_callback(lambda parsing: on_parsed(parsing, stage))
+
+        fetch_pool.submit(self._traced_fetch_batch, msg_ids).add_done_callback(on_fetched)
+        return result
+
+    def _get_parse_pool(self):
+        """
+        Return the process-wide MIME parsing pool, or None to parse in the fetch threads.
+
+        The pool is sized by the first client that asks for it and lives until exit.
+        """
+        global _parse_pool
+        if self.parse_processes <= 0:
+            return None
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                # spawn rather than fork: the fetch and upsert threads are already running
+                _parse_pool = ProcessPoolExecutor(max_workers=self.parse_processes,
+                                                  mp_context=multiprocessing.get_context('spawn'))
+            return _parse_pool
+
+    @staticmethod
+    def _to_email(fields):
+        """Build the email dict from the fields mime.parse_message extracted."""
+        msg_id, thread_id, labels, internal_date, subject, sender, body = fields
+        email = {
+            'id': msg_id,
+            'subject': subject,
+            'sender': sender,
+            'body': body,
+            'text': f"From: {sender}\nSubject: {subject}\nBody: {body}",
+            'thread_id': thread_id,
+            'labels': labels,
+        }
+        if internal_date is not None:
+            # Epoch milliseconds; stored as seconds so date filters compare plain integers
+            email['date'] = int(internal_date) // 1000
+        email.update(sender_fields(sender))
+        return email
+
+    def _emails_from(self, future, msg_ids):
+        """Yield the emails of one parsed batch, logging the messages left out."""
+        try:
+            parsed, skipped = future.result()
+        except Exception as e:
+            # e.g. a crashed parsing worker: lose this batch, not the whole ingest
+            logger.error(f"Error processing batch, skipping {len(msg_ids)} messages: {str(e)}")
+            return
+        for msg_id, reason in skipped:
+            if reason == "no body content":
+                logger.warning(f"No body content found for message ID: {msg_id}, Skipping...")
+            else:
+                logger.error(f"Error processing message ID {msg_id}: {reason}")
+        for fields in parsed:
+            yield self._to_email(fields)
     
+    def iter_message_id_pages(self, query='category:primary', page_size=500):
+        """
+        Yield the IDs of messages matching a Gmail query, one listing page at a time.
+
+        Args:
+            query: Gmail search query string (default: 'category:primary')
+            page_size: Message IDs per listing request (Gmail allows up to 500)
+
+        Yields:
+            list: Message IDs of one page, in the order Gmail returns them (newest first)
+        """
+        page_token = None
+        while True:
+            kwargs = {'userId': 'me', 'q': query, 'maxResults': page_size}
+            if page_token:
+                kwargs['pageToken'] = page_token
+            with span("gmail_list", page_size=page_size) as stage:
+                self._throttle('messages.list')
+                results = self.service.users().messages().list(**kwargs).execute()
+                stage.set(messages=len(results.get('messages', [])))
+            if 'messages' not in results:
+                break
+            yield [msg['id'] for msg in results['messages']]
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+            logger.debug("Fetching next page of messages")
+
+    def list_message_ids(self, query='category:primary'):
+        """
+        List the IDs of all messages matching a Gmail query.
+
+        Args:
+            query: Gmail search query string (default: 'category:primary')
+
+        Returns:
+            list: Message IDs in the order Gmail returns them (newest first)
+        """
+        return [msg_id for page in self.iter_message_id_pages(query) for msg_id in page]
+
+    def iter_fetch_emails(self, msg_ids):
+        """
+        Fetch and parse the given messages concurrently, yielding them as they are ready.
+
+        Batches are downloaded over the thread pool and their MIME bodies parsed over
+        the process pool, so parsing uses every core while later batches download. At
+        most two rounds of batches are in flight, so memory stays bounded by the window
+        size rather than the number of IDs. Batches are yielded in the order they finish.
+
+        Args:
+            msg_ids: Iterable of Gmail message IDs
+
+        Yields:
+            dict: Email data, batch by batch in completion order; messages that could not
+                be fetched or have no body are left out
+        """
+        def chunks():
+            chunk = []
+            for msg_id in msg_ids:
+                chunk.append(msg_id)
+                if len(chunk) == self.batch_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        max_in_flight = max(self.parallelism, self.parse_processes) * 2
+        parse_pool = self._get_parse_pool()
+        with ThreadPoolExecutor(max_workers=self.parallelism) as fetch_pool:
+            in_flight = {}
+            for chunk in chunks():
+                in_flight[self._submit_batch(fetch_pool, parse_pool, chunk)] = chunk
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from self._emails_from(future, in_flight.pop(future))
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self._emails_from(future, in_flight.pop(future))
+
+    def fetch_emails(self, msg_ids):
+        """
+        Fetch and parse the given messages concurrently.
+
+        Args:
+            msg_ids: List of Gmail message IDs
+
+        Returns:
+            list: Email dictionaries in the same order as msg_ids; messages that could not
+                be fetched or have no body are left out
+        """
+        logger.info(f"Fetching {len(msg_ids)} messages "
+                    f"(parallelism={self.parallelism}, batch_size={self.batch_size})")
+        emails = list(tqdm(self.iter_fetch_emails(msg_ids), total=len(msg_ids), desc="Processing emails"))
+        position = {msg_id: i for i, msg_id in enumerate(msg_ids)}
+        return sorted(emails, key=lambda email: position[email['id']])
+
+    def iter_emails(self, query='category:primary'):
+        """
+        Stream emails matching a Gmail query, page by page.
+
+        Each listing page is fetched while the caller consumes the previous one, so the
+        first emails are available after a single page instead of after the whole
+        mailbox has been listed and downloaded.
+
+        Args:
+            query: Gmail search query string (default: 'category:primary')
+
+        Yields:
+            dict: Email data, batch by batch as parsing finishes
+        """
+        logger.info(f"Starting email stream with query: {query}")
+        count = 0
+        ids = (msg_id for page in self.iter_message_id_pages(query) for msg_id in page)
+        for email in self.iter_fetch_emails(ids):
+            count += 1
+            yield email
+        logger.info(f"Successfully streamed {count} emails")
+
     def get_emails(self, query='category:primary'):
         """
         Fetch emails from Gmail using the provided query.
@@ -79,70 +464,74 @@ class MailClient:
         Returns:
             list: List of dictionaries containing email data
         """
-        logger.info(f"Starting email fetch with query: {query}")
-        
-        # Fetch message IDs matching the query
-        results = self.service.users().messages().list(userId='me', q=query, maxResults=500).execute()
-        messages = []
-        
-        # Handle pagination to get all messages
-        while 'messages' in results:
-            messages.extend(results['messages'])
-            if 'nextPageToken' in results:
-                logger.debug(f"Fetching next page of messages. Current count: {len(messages)}")
-                results = self.service.users().messages().list(
-                    userId='me', 
-                    q=query, 
-                    maxResults=500, 
-                    pageToken=results['nextPageToken']
-                ).execute()
-            else:
-                break
+        return list(tqdm(self.iter_emails(query), desc="Processing emails"))
 
-        logger.info(f"Found {len(messages)} messages to process")
-        
-        email_data = []
-        for msg in tqdm(messages, desc="Processing emails"):
-            try:
-                msg_id = msg['id']
-                message = self.service.users().messages().get(userId='me', id=msg_id).execute()
-                payload = message['payload']
-
-                # Extract email headers
-                headers = payload['headers']
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-
-                # Extract email body
-                if 'parts' in payload and 'data' in payload['parts'][0]['body']:
-                    data = payload['parts'][0]['body']['data']
-                    body = base64.urlsafe_b64decode(data).decode('utf-8')
-                else:
-                    body = payload.get('body', {}).get('data', '')
-                    if body:
-                        body = base64.urlsafe_b64decode(body).decode('utf-8')
-                    else:
-                        body = 'No Body Found'
-                        logger.warning(f"No body content found for message ID: {msg_id}, Skipping...")
-                        continue
-
-                # Combine email components
-                email_text = f"From: {sender}\nSubject: {subject}\nBody: {body}"
-
-                email_data.append({
-                    'id': msg_id,
-                    'subject': subject,
-                    'sender': sender,
-                    'body': body,
-                    'text': email_text
-                })
-                
-            except Exception as e:
-                logger.error(f"Error processing message ID {msg_id}: {str(e)}")
-                continue
+    def get_history_id(self):
+        """
+        Return the mailbox's current historyId.
+
+        Returns:
+            str: History ID to pass to get_history on the next sync
+        """
+        self._throttle('getProfile')
+        return self.service.users().getProfile(userId='me').execute()['historyId']
+
+    def get_history(self, start_history_id, label_id=None):
+        """
+        List mailbox changes since a historyId.
+
+        Args:
+            start_history_id: historyId recorded at the previous sync
+            label_id: Only report changes to messages carrying this label
+                (a message gaining the label counts as added, losing it as deleted)
+
+        Returns:
+            tuple: (added_ids, deleted_ids, history_id) where the ID sets are disjoint and
+                history_id is the latest historyId covered by the listing
+
+        Raises:
+            HttpError: With status 404 when start_history_id is too old and a full sync is needed
+        """
+        logger.info(f"Listing mailbox history since {start_history_id}")
+        added, deleted = set(), set()
+        history_id = start_history_id
+        page_token = None
+        while True:
+            kwargs = {'userId': 'me', 'startHistoryId': start_history_id,
+                      'historyTypes': ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']}
+            if label_id:
+                kwargs['labelId'] = label_id
+            if page_token:
+                kwargs['pageToken'] = page_token
+            with span("gmail_history") as stage:
+                self._throttle('history.list')
+                results = self.service.users().history().list(**kwargs).execute()
+                stage.set(records=len(results.get('history', [])))
+
+            # Records are in chronological order, so later changes win
+            for record in results.get('history', []):
+                for change in record.get('messagesAdded', []):
+                    added.add(change['message']['id'])
+                    deleted.discard(change['message']['id'])
+                for change in record.get('labelsAdded', []):
+                    if not label_id or label_id in change.get('labelIds', []):
+                        added.add(change['message']['id'])
+                        deleted.discard(change['message']['id'])
+                for change in record.get('labelsRemoved', []):
+                    if label_id and label_id in change.get('labelIds', []):
+                        deleted.add(change['message']['id'])
+                        added.discard(change['message']['id'])
+                for change in record.get('messagesDeleted', []):
+                    deleted.add(change['message']['id'])
+                    added.discard(change['message']['id'])
+
+            history_id = results.get('historyId', history_id)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
 
-        logger.info(f"Successfully processed {len(email_data)} emails")
-        return email_data
+        logger.info(f"History lists {len(added)} added and {len(deleted)} deleted messages")
+        return added, deleted, history_id
 
 # if __name__ == "__main__":
 #     try:
@@ -9,11 +9,17 @@ a vector database (Pinecone), and uses OpenAI to generate relevant responses.
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
 
+import os
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from mail import MailClient
-from vector_db import PineconeClient
+from vector_db import get_vector_store
 from generator import Generator
+from sync import sync_emails
+from embedding_cache import get_embedding_cache
+from tracing import get_tracer
+from tenants import tenant_path, validate_tenant
 
 # Configure logging
 logging.basicConfig(
@@ -27,34 +33,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def ingest_emails():
-    """Fetch emails from Gmail and store them in the vector database."""
-    try:
-        # Initialize Gmail client and fetch emails
-        logger.info("Initializing Gmail client...")
-        mail_client = MailClient()
-        logger.info("Fetching emails from Gmail...")
-        emails = mail_client.get_emails(query="category:primary")
-        logger.info(f"Successfully retrieved {len(emails)} emails")
-
-        # Initialize Pinecone client and store emails
-        logger.info("Initializing Pinecone client...")
-        pinecone_client = PineconeClient()
-        logger.info("Upserting emails to Pinecone vector database...")
-        pinecone_client.upsert_emails(emails)
-        logger.info("Successfully stored emails in vector database")
-        print("\n Emails have been successfully loaded into the database!")
+def ingest_mailbox(mail_client, tenant=None, batch_size=100, concurrency=4, full=False):
+    """
+    Sync one mailbox into its tenant's vector store.
+
+    Args:
+        mail_client: Authenticated Gmail client of the mailbox
+        tenant: Tenant the mailbox belongs to (None: the single default mailbox)
+        batch_size: Maximum number of emails embedded and upserted per request
+        concurrency: Number of batches processed in parallel
+        full: Ignore the saved sync state and re-ingest the whole mailbox
+
+    Returns:
+        dict: Sync counts (see sync.sync_emails)
+    """
+    vector_store = get_vector_store(tenant=tenant, batch_size=batch_size, concurrency=concurrency)
+    return sync_emails(mail_client, vector_store, query="category:primary", full=full,
+                       state_path=tenant_path("sync_state.json", tenant))
+
+def ingest_emails(batch_size=100, concurrency=4, fetch_parallelism=8, parse_processes=None, full=False,
+                  tenants=None, max_concurrent_mailboxes=4):
+    """
+    Fetch emails from Gmail and store them in the vector database.
 
+    Runs incrementally: only messages added or removed since the last ingest are
+    fetched, embedded or deleted (see sync.sync_emails). Several mailboxes are synced
+    concurrently, each into its own tenant namespace, sharing the API clients, the MIME
+    parsing pool and the rate limits (see ratelimit.py); one failing does not stop the others.
+
+    Args:
+        batch_size: Maximum number of emails embedded and upserted per request
+        concurrency: Number of batches processed in parallel
+        fetch_parallelism: Number of threads fetching messages from Gmail
+        parse_processes: Number of processes parsing MIME bodies (default: one per CPU, 0 on a single CPU)
+        full: Ignore the saved sync state and re-ingest the whole mailbox
+        tenants: Tenants whose mailboxes to ingest (default: the single default mailbox)
+        max_concurrent_mailboxes: Number of mailboxes synced at the same time
+    """
+    tenants = tenants or [None]
+    try:
+        # One mailbox at a time: a first login opens the browser for the OAuth flow
+        logger.info("Initializing Gmail clients...")
+        mail_clients = {tenant: MailClient(parallelism=fetch_parallelism, parse_processes=parse_processes,
+                                           token_path=tenant_path("token.json", tenant))
+                        for tenant in tenants}
     except Exception as e:
-        logger.error(f"An error occurred during ingestion: {str(e)}", exc_info=True)
-        print("\n Sorry, an error occurred while loading emails.")
+        logger.error(f"An error occurred during Gmail authentication: {str(e)}", exc_info=True)
+        print("\n Sorry, an error occurred while connecting to Gmail.")
+        return
+
+    logger.info(f"Syncing {len(tenants)} mailbox(es) from Gmail ({'full' if full else 'incremental'})...")
+    with ThreadPoolExecutor(max_workers=max_concurrent_mailboxes) as pool:
+        futures = {pool.submit(ingest_mailbox, mail_client, tenant, batch_size, concurrency, full): tenant
+                   for tenant, mail_client in mail_clients.items()}
+        for future in as_completed(futures):
+            tenant = futures[future]
+            label = f" for {tenant}" if tenant else ""
+            try:
+                counts = future.result()
+                logger.info(f"Successfully synced emails{label}: {counts}")
+                print(f"\n Emails{label} have been successfully loaded into the database! "
+                      f"({counts['upserted']} added/updated, {counts['deleted']} removed)")
+            except Exception as e:
+                logger.error(f"An error occurred during ingestion{label}: {str(e)}", exc_info=True)
+                print(f"\n Sorry, an error occurred while loading emails{label}.")
+
+    cache = get_embedding_cache()
+    if cache:
+        logger.info(f"Embedding cache: {cache.stats()}")
 
-def chat_loop():
-    """Interactive loop for querying the email database."""
+def chat_loop(stream=True, tenant=None):
+    """
+    Interactive loop for querying the email database.
+
+    Besides questions, the loop accepts "/profile <question>" to answer one question under
+    cProfile and "/stats" to print per-stage latency percentiles.
+
+    Args:
+        stream: Print the answer token by token as it is generated
+        tenant: Answer from this tenant's emails only (default: the single default mailbox)
+    """
     try:
         # Initialize Pinecone client for querying
-        generator = Generator()
-        print("\nWelcome to Email Chatbot! Type 'exit' to quit.")
+        generator = Generator(tenant=tenant)
+        print("\nWelcome to Email Chatbot! Type 'exit' to quit, '/stats' for stage timings "
+              "or '/profile <question>' to profile one answer.")
         while True:
             # Get user's question about their emails
             user_query = input("\nAsk something about your emails (like: Show my Amazon orders): ")
@@ -63,16 +126,29 @@ def chat_loop():
                 print("Goodbye! ")
                 break
 
+            if user_query.strip() == '/stats':
+                print(get_tracer().export_json())
+                continue
+
+            profile = user_query.startswith('/profile ')
+            if profile:
+                user_query = user_query[len('/profile '):]
+
             logger.info(f"Received user query: {user_query}")
 
             # Generate response using OpenAI
             logger.info("Generating response using OpenAI...")
-            response = generator.generate_answer(user_query)
-            logger.info("Successfully generated response")
+            response = generator.generate_answer(user_query, stream=stream, profile=profile)
 
             # Display the response to the user
             print("\n Answer from OpenAI:")
-            print(response)
+            if stream:
+                for token in response:
+                    print(token, end="", flush=True)
+                print()
+            else:
+                print(response)
+            logger.info("Successfully generated response")
 
     except Exception as e:
         logger.error(f"An error occurred during chat: {str(e)}", exc_info=True)
@@ -81,9 +157,35 @@ def chat_loop():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Email Chatbot with RAG")
     parser.add_argument('--ingest', action='store_true', help='Fetch and store emails in the vector database')
+    parser.add_argument('--batch-size', type=int, default=100, help='Emails per embedding/upsert batch during ingest')
+    parser.add_argument('--concurrency', type=int, default=4, help='Batches processed in parallel during ingest')
+    parser.add_argument('--fetch-parallelism', type=int, default=8, help='Threads fetching messages from Gmail during ingest')
+    parser.add_argument('--parse-processes', type=int, help='Processes parsing email bodies during ingest '
+                        '(default: one per CPU; 0 parses in the fetch threads)')
+    parser.add_argument('--full', action='store_true', help='Ignore the saved sync state and re-ingest every email')
+    parser.add_argument('--tenant', action='append', type=validate_tenant,
+                        help='User or mailbox to work on, kept in its own namespace; '
+                        'repeat with --ingest to ingest several mailboxes concurrently')
+    parser.add_argument('--max-concurrent-mailboxes', type=int, default=4,
+                        help='Mailboxes synced at the same time during ingest')
+    parser.add_argument('--backend', choices=['pinecone', 'local'], help='Vector store backend (default: $VECTOR_BACKEND or pinecone)')
+    parser.add_argument('--no-stream', action='store_true', help='Print each answer only once it is complete')
+    parser.add_argument('--metrics', metavar='PATH', help='On exit, write per-stage latency metrics to PATH '
+                        '(Prometheus text for .prom/.txt, JSON otherwise)')
     args = parser.parse_args()
+    if args.tenant and len(args.tenant) > 1 and not args.ingest:
+        parser.error("the chat works on a single --tenant")
 
-    if args.ingest:
-        ingest_emails()
-    else:
-        chat_loop()
\ No newline at end of file
+    if args.backend:
+        os.environ['VECTOR_BACKEND'] = args.backend
+
+    try:
+        if args.ingest:
+            ingest_emails(batch_size=args.batch_size, concurrency=args.concurrency,
+                          fetch_parallelism=args.fetch_parallelism, parse_processes=args.parse_processes,
+                          full=args.full, tenants=args.tenant, max_concurrent_mailboxes=args.max_concurrent_mailboxes)
+        else:
+            chat_loop(stream=not args.no_stream, tenant=args.tenant[0] if args.tenant else None)
+    finally:
+        if args.metrics:
+            get_tracer().write_metrics(args.metrics)
\ No newline at end of file
@@ -0,0 +1,228 @@
+import re
+import base64
+import codecs
+import unicodedata
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+# Parsing workers are spawned, not forked: each starts a fresh interpreter that inherits
+# nothing from the parent. It re-imports the parent's main script (as __mp_main__, so
+# its __main__ block does not run) and then imports this module to unpickle
+# parse_messages, so every module-level constant below is rebuilt once per worker. The
+# module is kept free of third-party imports so that this part of the startup stays cheap.
+
+# Elements whose content is never visible text
+SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template', 'svg'}
+
+# Elements that end the current line
+LINE_TAGS = {'br', 'div', 'tr', 'li', 'dt', 'dd', 'section', 'article', 'header', 'footer', 'center'}
+
+# Elements that are set off from their surroundings by a blank line
+PARAGRAPH_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'ul', 'ol', 'blockquote', 'hr', 'pre'}
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+_INVISIBLE = re.compile('[\u00ad\u034f\u200b-\u200f\u2060\ufeff]')
+_SPACES = re.compile(r'[ \t\f\v]+')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+# Compact form of a parsed message, cheap to send back from a worker process:
+# (id, thread_id, labels, internal_date, subject, sender, body)
+MessageFields = Tuple[str, Optional[str], List[str], Optional[str], str, str, str]
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document, one output line per block."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []
+        self.line: List[str] = []
+        self.skip_depth = 0
+        self.quote_depth = 0
+
+    def _break(self, blank: bool = False) -> None:
+        text = " ".join("".join(self.line).split())
+        if text:
+            # Quoted replies keep a "> " prefix so the chunker can tell them apart
+            self.lines.append("> " * self.quote_depth + text)
+        if blank and self.lines and self.lines[-1]:
+            self.lines.append("")
+        self.line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in PARAGRAPH_TAGS:
+            self._break(blank=True)
+            if tag == 'blockquote':
+                self.quote_depth += 1
+        elif tag in LINE_TAGS:
+            self._break()
+            if tag == 'li':
+                self.line.append("- ")
+        elif tag in ('td', 'th'):
+            self.line.append(" ")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in ('br', 'hr'):
+            self._break(blank=tag == 'hr')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in PARAGRAPH_TAGS:
+            self._break(blank=True)
+            if tag == 'blockquote':
+                self.quote_depth = max(self.quote_depth - 1, 0)
+        elif tag in LINE_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.line.append(data)
+
+    def text(self) -> str:
+        self._break()
+        return "\n".join(self.lines)
+
+
+def html_to_text(html: str) -> str:
+    """
+    Extract the visible text of an HTML email.
+
+    Scripts, styles and the document head are dropped, entities are decoded, block
+    elements become line breaks, list items get a "- " bullet and blockquoted text a
+    "> " prefix per level.
+
+    Args:
+        html (str): HTML source
+
+    Returns:
+        str: Plain text
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize an email body: NFKC, unified line endings, no invisible characters,
+    single spaces, no trailing whitespace and at most one blank line in a row.
+    """
+    text = unicodedata.normalize('NFKC', text.replace('\r\n', '\n').replace('\r', '\n'))
+    text = _INVISIBLE.sub('', text)
+    lines = [_SPACES.sub(' ', line).strip() for line in text.split('\n')]
+    return _BLANK_LINES.sub('\n\n', "\n".join(lines)).strip()
+
+
+def _header(headers: List[Dict[str, str]], name: str) -> Optional[str]:
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), None)
+
+
+def _decode(part: Dict[str, Any]) -> str:
+    """Decode a part's base64url body in the charset its Content-Type names."""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ""
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    match = _CHARSET.search(_header(part.get('headers', []), 'Content-Type') or '')
+    charset = match.group(1).lower() if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return raw.decode(charset, errors='replace')
+
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    disposition = (_header(part.get('headers', []), 'Content-Disposition') or '').lower()
+    return bool(part.get('filename')) or disposition.startswith('attachment')
+
+
+def _part_text(part: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Text of a MIME part and its kind ('plain', 'html' or '' when it has none).
+
+    multipart/alternative keeps its plain text version when that has any text, else the
+    first alternative that does; other multiparts (mixed, related, signed, a forwarded
+    message/rfc822...) join the text of all their non-attachment parts.
+    """
+    mime_type = part.get('mimeType', '').lower()
+    if _is_attachment(part):
+        return "", ""
+    if mime_type.startswith('multipart/') or part.get('parts'):
+        children = [_part_text(child) for child in part.get('parts', [])]
+        children = [(kind, text) for kind, text in children if text.strip()]
+        if not children:
+            return "", ""
+        if mime_type == 'multipart/alternative':
+            return next((child for child in children if child[0] == 'plain'), children[0])
+        kinds = {kind for kind, _ in children}
+        return ('plain' if 'plain' in kinds else 'html'), "\n\n".join(text for _, text in children)
+    if mime_type == 'text/html':
+        return 'html', html_to_text(_decode(part))
+    if mime_type in ('text/plain', ''):
+        return 'plain', _decode(part)
+    return "", ""
+
+
+def extract_body(payload: Dict[str, Any]) -> str:
+    """
+    Extract the readable text of a Gmail message payload (format='full').
+
+    Walks the whole MIME tree: nested multiparts, HTML-only messages (converted with
+    html_to_text) and non-UTF-8 charsets; attachments are skipped.
+
+    Args:
+        payload (dict): The message's 'payload'
+
+    Returns:
+        str: Normalized body text, empty if the message has none
+    """
+    return normalize_text(_part_text(payload)[1])
+
+
+def parse_message(message: Dict[str, Any]) -> Optional[MessageFields]:
+    """
+    Parse a Gmail message resource into its compact fields (see MessageFields).
+
+    Args:
+        message (dict): Message resource as returned by messages.get
+
+    Returns:
+        tuple: The fields, or None if the message has no body text
+    """
+    payload = message['payload']
+    body = extract_body(payload)
+    if not body:
+        return None
+    headers = payload.get('headers', [])
+    return (message['id'], message.get('threadId'), message.get('labelIds', []), message.get('internalDate'),
+            _header(headers, 'Subject') or 'No Subject', _header(headers, 'From') or 'Unknown Sender', body)
+
+
+def parse_messages(messages: List[Dict[str, Any]]) -> Tuple[List[MessageFields], List[Tuple[str, str]]]:
+    """
+    Parse a batch of messages; the unit of work of a parsing worker process.
+
+    Args:
+        messages (list): Message resources
+
+    Returns:
+        tuple: The parsed fields, and (message ID, reason) for each message left out
+    """
+    parsed, skipped = [], []
+    for message in messages:
+        try:
+            fields = parse_message(message)
+        except Exception as e:
+            skipped.append((message.get('id'), f"parse error: {e}"))
+            continue
+        if fields is None:
+            skipped.append((message['id'], "no body content"))
+        else:
+            parsed.append(fields)
+    return parsed, skipped
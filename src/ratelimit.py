@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Shared limits: environment variable holding the limit, and the period in seconds it
+# is stated over (OpenAI quotes per minute, Gmail and Pinecone per second)
+LIMITS = {
+    'openai_requests': ('OPENAI_REQUESTS_PER_MINUTE', 60.0),
+    'openai_tokens': ('OPENAI_TOKENS_PER_MINUTE', 60.0),
+    'gmail_units': ('GMAIL_QUOTA_UNITS_PER_SECOND', 1.0),
+    'pinecone_requests': ('PINECONE_REQUESTS_PER_SECOND', 1.0),
+}
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread and event loop of the process.
+
+    The bucket holds up to `capacity` units and refills at `rate` units per second.
+    Callers reserve what they need up front; once the bucket is overdrawn each caller
+    waits for its own share to refill, so waiting callers are served first come, first
+    served and a request larger than the whole bucket still goes through.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Args:
+            rate (float): Units added per second
+            capacity (float, optional): Bucket size, the largest burst. Defaults to one
+                second's worth (rate).
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        Take amount from the bucket without waiting.
+
+        Args:
+            amount (float, optional): Units to spend. Defaults to 1.
+
+        Returns:
+            float: Seconds to wait before spending them
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= amount
+            return max(-self._available / self.rate, 0.0)
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        Block until amount units may be spent.
+
+        Args:
+            amount (float, optional): Units to spend (requests, tokens, quota units). Defaults to 1.
+
+        Returns:
+            float: Seconds waited
+        """
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, amount: float = 1.0) -> float:
+        """Async acquire; waits without blocking the event loop."""
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_limiters: Dict[str, Optional[RateLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """
+    Return the process-wide limiter for one of LIMITS, or None when it is not configured.
+
+    A limit of N per period refills at N / period units per second with a bucket of N,
+    e.g. OPENAI_TOKENS_PER_MINUTE=1000000 allows a minute's tokens in one burst and then
+    about 16667 tokens a second. Every ingest running in the process (one per mailbox)
+    draws from the same buckets.
+
+    Args:
+        name (str): "openai_requests", "openai_tokens", "gmail_units" or "pinecone_requests"
+
+    Returns:
+        RateLimiter: The limiter, or None
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            variable, period = LIMITS[name]
+            limit = float(os.getenv(variable, "0"))
+            _limiters[name] = RateLimiter(limit / period, capacity=limit) if limit > 0 else None
+            if limit > 0:
+                logger.info(f"Rate limiting {name} to {limit:g} per {period:g}s")
+        return _limiters[name]
@@ -0,0 +1,198 @@
+import os
+import math
+import asyncio
+import logging
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from lexical_index import tokenize
+from clients import get_cohere_client, get_async_cohere_client
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker(ABC):
+    """
+    Reorders retrieved emails by relevance to the question.
+
+    Backends implement `_rerank`; `rerank` skips them when there are no more candidates
+    than `top_n`, since the prompt then gets every candidate anyway.
+    """
+
+    def __init__(self, top_n: int = 5):
+        """
+        Args:
+            top_n (int, optional): Number of documents kept after reranking. Defaults to 5.
+        """
+        self.top_n = top_n
+
+    @abstractmethod
+    def _rerank(self, query: str, documents: List[str], scores: Optional[List[float]]) -> List[int]:
+        """Return the indices of the top_n documents, best first."""
+
+    async def _arerank(self, query: str, documents: List[str], scores: Optional[List[float]]) -> List[int]:
+        """Async _rerank. Runs the sync version in a worker thread unless overridden."""
+        return await asyncio.to_thread(self._rerank, query, documents, scores)
+
+    def rerank(self, query: str, documents: List[str], scores: List[float] = None) -> List[int]:
+        """
+        Rank documents against a query.
+
+        Args:
+            query (str): User question
+            documents (list): Candidate texts, in retrieval order
+            scores (list, optional): Retrieval scores of the candidates, best first
+
+        Returns:
+            list: Indices into documents of at most top_n documents, best first
+        """
+        if len(documents) <= self.top_n:
+            logger.debug(f"Skipping rerank: {len(documents)} candidates for top_n={self.top_n}")
+            return list(range(len(documents)))
+        return self._rerank(query, documents, scores)
+
+    async def arerank(self, query: str, documents: List[str], scores: List[float] = None) -> List[int]:
+        """Async rerank."""
+        if len(documents) <= self.top_n:
+            logger.debug(f"Skipping rerank: {len(documents)} candidates for top_n={self.top_n}")
+            return list(range(len(documents)))
+        return await self._arerank(query, documents, scores)
+
+
+class CohereReranker(Reranker):
+    """Reranks with the Cohere rerank API."""
+
+    def __init__(self, model: str = 'rerank-english-v2.0', client=None, async_client=None, **kwargs):
+        """
+        Args:
+            model (str, optional): Cohere rerank model. Defaults to 'rerank-english-v2.0'.
+            client (cohere.Client, optional): Sync client. Defaults to the process-wide one
+                (see clients.get_cohere_client).
+            async_client (cohere.AsyncClient, optional): Async client. Defaults to the
+                process-wide one.
+            **kwargs: Passed to Reranker (top_n)
+        """
+        super().__init__(**kwargs)
+        self.model = model
+        self._client = client
+        self._async_client = async_client
+
+    @property
+    def client(self):
+        return self._client or get_cohere_client()
+
+    @property
+    def async_client(self):
+        return self._async_client or get_async_cohere_client()
+
+    def _rerank(self, query, documents, scores):
+        response = self.client.rerank(model=self.model, documents=documents, query=query, top_n=self.top_n)
+        return [item.index for item in response.results]
+
+    async def _arerank(self, query, documents, scores):
+        response = await self.async_client.rerank(model=self.model, documents=documents, query=query,
+                                                  top_n=self.top_n)
+        return [item.index for item in response.results]
+
+
+class LocalReranker(Reranker):
+    """
+    CPU-only reranker blending BM25 over the candidate set with the retrieval scores.
+
+    All candidates are scored in one pass: they are tokenized once into a candidates x
+    query-terms count matrix, and BM25 is computed on the whole matrix. The BM25
+    scores and the retrieval scores are min-max normalized and mixed with weight
+    `lexical_weight`.
+    """
+
+    def __init__(self, lexical_weight: float = 0.5, k1: float = 1.2, b: float = 0.75, **kwargs):
+        """
+        Args:
+            lexical_weight (float, optional): Share of BM25 in the blended score. Defaults to 0.5.
+            k1 (float, optional): BM25 term-frequency saturation. Defaults to 1.2.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+            **kwargs: Passed to Reranker (top_n)
+        """
+        super().__init__(**kwargs)
+        self.lexical_weight = lexical_weight
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, documents: List[str], scores: List[float] = None) -> np.ndarray:
+        """
+        Blended relevance of every document.
+
+        Args:
+            query (str): User question
+            documents (list): Candidate texts
+            scores (list, optional): Retrieval scores; without them the rank order stands in
+
+        Returns:
+            np.ndarray: One score per document, higher is better
+        """
+        terms = {term: i for i, term in enumerate(dict.fromkeys(tokenize(query)))}
+        counts = np.zeros((len(documents), max(len(terms), 1)), dtype=np.float32)
+        lengths = np.zeros(len(documents), dtype=np.float32)
+        for row, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                column = terms.get(token)
+                if column is not None:
+                    counts[row, column] += 1
+
+        df = (counts > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        lexical = (idf * counts * (self.k1 + 1) / (counts + norm[:, None])).sum(axis=1)
+
+        if scores is None:
+            # Retrieval order, as a decreasing score
+            scores = [1.0 / (rank + 1) for rank in range(len(documents))]
+        return (self.lexical_weight * _normalize(lexical) +
+                (1 - self.lexical_weight) * _normalize(np.asarray(scores, dtype=np.float32)))
+
+    def _rerank(self, query, documents, scores):
+        blended = self.score(query, documents, scores)
+        # Stable sort keeps retrieval order among ties
+        return np.argsort(-blended, kind='stable')[:self.top_n].tolist()
+
+    async def _arerank(self, query, documents, scores):
+        # Pure CPU work on a handful of documents: a thread hop would cost more than it saves
+        return self._rerank(query, documents, scores)
+
+
+class NoReranker(Reranker):
+    """Keeps the retrieval order."""
+
+    def _rerank(self, query, documents, scores):
+        return list(range(min(self.top_n, len(documents))))
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    span = values.max() - values.min() if len(values) else 0.0
+    if span <= 0 or not math.isfinite(span):
+        return np.zeros_like(values, dtype=np.float32)
+    return (values - values.min()) / span
+
+
+RERANKERS = {'cohere': CohereReranker, 'local': LocalReranker, 'none': NoReranker}
+
+
+def get_reranker(backend: str = None, **kwargs) -> Reranker:
+    """
+    Create the configured reranker.
+
+    Args:
+        backend (str, optional): "cohere", "local" or "none". Defaults to the RERANKER
+            environment variable, or "local" if unset.
+        **kwargs: Passed to the reranker constructor; top_n defaults to RERANK_TOP_N (5)
+
+    Returns:
+        Reranker: The reranker
+    """
+    backend = (backend or os.getenv("RERANKER", "local")).lower()
+    if backend not in RERANKERS:
+        raise ValueError(f"Unknown reranker: {backend}")
+    kwargs.setdefault("top_n", int(os.getenv("RERANK_TOP_N", "5")))
+    return RERANKERS[backend](**kwargs)
@@ -0,0 +1,219 @@
+import os
+import json
+import logging
+from typing import Dict, List
+from googleapiclient.errors import HttpError
+from utils import my_hash
+
+logger = logging.getLogger(__name__)
+
+# Gmail search queries that map onto a single label, so history.list can be filtered by it
+QUERY_LABELS = {
+    'category:primary': 'CATEGORY_PERSONAL',
+    'category:social': 'CATEGORY_SOCIAL',
+    'category:promotions': 'CATEGORY_PROMOTIONS',
+    'category:updates': 'CATEGORY_UPDATES',
+    'category:forums': 'CATEGORY_FORUMS',
+    'in:inbox': 'INBOX',
+}
+
+
+class SyncState:
+    """
+    Sync cursor persisted between ingest runs: the last Gmail historyId, a content hash
+    per message in the store, and the IDs of messages that could not be fetched, to be
+    retried by the next run.
+
+    Changes made during a sync are appended to a journal next to the state file as they
+    happen (record, forget), so an interrupted sync keeps its progress; save() folds the
+    journal into the state file.
+    """
+
+    def __init__(self, path: str = "sync_state.json"):
+        """
+        Load the sync state from disk, starting empty if the file does not exist.
+
+        Args:
+            path (str, optional): Location of the state file. Defaults to "sync_state.json".
+        """
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.query = None
+        self.history_id = None
+        self.hashes: Dict[str, str] = {}
+        self.pending: List[str] = []
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.query = data.get('query')
+            self.history_id = data.get('history_id')
+            self.hashes = data.get('hashes', {})
+            self.pending = data.get('pending', [])
+        if os.path.exists(self.journal_path):
+            self._replay()
+        if self.hashes or self.history_id:
+            logger.info(f"Loaded sync state from {path}: {len(self.hashes)} messages, historyId {self.history_id}")
+
+    def _replay(self) -> None:
+        """Apply the changes journaled by a sync that did not finish."""
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line of a crashed write
+                    break
+                self.hashes.update(entry.get('hashes', {}))
+                for msg_id in entry.get('deleted', []):
+                    self.hashes.pop(msg_id, None)
+        logger.info(f"Recovered progress of an interrupted sync from {self.journal_path}")
+
+    def _journal(self, entry: Dict) -> None:
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def record(self, hashes: Dict[str, str]) -> None:
+        """Remember the content hashes of stored emails, durably."""
+        self.hashes.update(hashes)
+        self._journal({'hashes': hashes})
+
+    def forget(self, msg_id: str) -> None:
+        """Remember that an email was deleted from the store, durably."""
+        self.hashes.pop(msg_id, None)
+        self._journal({'deleted': [msg_id]})
+
+    def save(self) -> None:
+        """Atomically write the state file, then drop the journal it now includes."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'query': self.query, 'history_id': self.history_id, 'hashes': self.hashes,
+                       'pending': self.pending}, f)
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        logger.debug(f"Saved sync state to {self.path}")
+
+
+def sync_emails(mail_client, vector_store, query: str = 'category:primary',
+                state_path: str = "sync_state.json", full: bool = False) -> Dict[str, int]:
+    """
+    Bring the vector store in line with the mailbox, touching only what changed.
+
+    With a usable historyId the changes are read from users.history.list; otherwise
+    (first run, expired historyId, a query that is not a single label, or full=True)
+    the current message IDs are listed and diffed against the stored hashes. Either way
+    only new messages are fetched, emails whose content hash is unchanged are not
+    re-embedded, and vectors of messages that left the mailbox are deleted. Emails are
+    streamed from Gmail into the store, so memory stays bounded by the pipeline window.
+
+    Progress is saved after every upserted batch and every deletion, so a sync that is
+    interrupted resumes where it stopped. The historyId only advances once everything
+    made it; a failed deletion is logged and retried by the next run. Messages Gmail
+    did not return (the fetch skips them rather than fail the sync) are remembered as
+    pending and fetched again by the next run.
+
+    Args:
+        mail_client (MailClient): Gmail client
+        vector_store (VectorStore): Vector store holding the email embeddings
+        query (str, optional): Gmail query defining the synced set. Defaults to 'category:primary'.
+        state_path (str, optional): Location of the state file. Defaults to "sync_state.json".
+        full (bool, optional): Ignore the stored state and re-embed everything. Defaults to False.
+
+    Returns:
+        dict: Counts of 'fetched', 'upserted', 'unchanged' and 'deleted' emails
+    """
+    state = SyncState(state_path)
+    # A full or differently scoped sync re-embeds every listed email. The hashes are
+    # kept: they are what the store holds, needed to delete what is no longer listed.
+    resync = full or state.query != query
+    if resync:
+        state.history_id = None
+    state.query = query
+    state.save()
+    # Taken before listing, so anything arriving mid-sync is picked up by the next run
+    new_history_id = mail_client.get_history_id()
+
+    to_fetch, to_delete = None, set()
+    label_id = QUERY_LABELS.get(query.strip().lower())
+    if state.history_id and label_id:
+        try:
+            added, deleted, _ = mail_client.get_history(state.history_id, label_id=label_id)
+            to_fetch = sorted((added | set(state.pending)) - deleted)
+            to_delete = deleted & set(state.hashes)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.warning("Stored historyId has expired, falling back to a listing diff")
+
+    # IDs handed to the fetch, checked against what came back
+    requested, arrived = [], set()
+
+    def track(msg_ids):
+        for msg_id in msg_ids:
+            requested.append(msg_id)
+            yield msg_id
+
+    # Nothing stored yet means there are no earlier versions of the emails to clean up
+    replace = True
+    if to_fetch is None and not state.hashes:
+        # Nothing stored yet: stream the mailbox straight into the store
+        logger.info("No stored emails, streaming the whole mailbox")
+        emails = mail_client.iter_fetch_emails(
+            track(msg_id for page in mail_client.iter_message_id_pages(query) for msg_id in page))
+        replace = False
+    else:
+        if to_fetch is None:
+            # Pending messages still listed are not in the hashes, so they are fetched again
+            current_ids = mail_client.list_message_ids(query)
+            to_fetch = current_ids if resync else [msg_id for msg_id in current_ids if msg_id not in state.hashes]
+            to_delete = set(state.hashes) - set(current_ids)
+        logger.info(f"Sync plan: {len(to_fetch)} messages to fetch, {len(to_delete)} to delete")
+        emails = mail_client.iter_fetch_emails(track(to_fetch))
+
+    counts = {'fetched': 0, 'upserted': 0, 'unchanged': 0, 'deleted': 0}
+
+    def changed_emails():
+        for email in emails:
+            arrived.add(email['id'])
+            counts['fetched'] += 1
+            previous = state.hashes.get(email['id'])
+            if not resync and previous == my_hash(email['text']):
+                counts['unchanged'] += 1
+                continue
+            # A changed email's leftover chunks are deleted by the upsert
+            yield email
+
+    def record(batch):
+        state.record({email['id']: my_hash(email['text']) for email in batch})
+
+    counts['upserted'] = vector_store.upsert_emails(changed_emails(), on_upserted=record, replace=replace)
+    changed = counts['fetched'] - counts['unchanged']
+    state.pending = [msg_id for msg_id in requested if msg_id not in arrived]
+    if state.pending:
+        logger.warning(f"{len(state.pending)} messages could not be fetched, retrying them on the next sync")
+
+    failed_deletes = 0
+    for msg_id in sorted(to_delete):
+        try:
+            vector_store.delete_email(msg_id)
+        except Exception as e:
+            # Its hash stays, so the next listing diff deletes it again
+            logger.error(f"Error deleting email {msg_id}: {str(e)}")
+            failed_deletes += 1
+            continue
+        state.forget(msg_id)
+        counts['deleted'] += 1
+    if to_delete:
+        vector_store.flush()
+
+    # Only advance the cursor when every change made it into the store,
+    # otherwise the next run has to see the same changes again
+    if counts['upserted'] == changed and not failed_deletes:
+        state.history_id = new_history_id
+    else:
+        logger.warning(f"{changed - counts['upserted']} emails failed to upsert and {failed_deletes} to delete, "
+                       f"keeping the previous historyId")
+    state.save()
+
+    logger.info(f"Sync complete: {counts}")
+    return counts
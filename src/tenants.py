@@ -0,0 +1,48 @@
+import os
+import re
+from typing import Optional
+
+# Tenant names become Pinecone namespaces and directory names: keep them to characters
+# that are safe in both (mailbox addresses such as alice@example.com are fine)
+TENANT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@+-]{0,62}$")
+
+
+def validate_tenant(tenant: str) -> str:
+    """
+    Check a tenant (user or mailbox) name.
+
+    Args:
+        tenant (str): Tenant name
+
+    Returns:
+        str: The name
+
+    Raises:
+        ValueError: If the name is empty, too long or not safe as a namespace and directory name
+    """
+    if not TENANT_NAME.match(tenant or "") or ".." in tenant:
+        raise ValueError(f"Invalid tenant name: {tenant!r}")
+    return tenant
+
+
+def tenant_path(path: str, tenant: Optional[str] = None) -> str:
+    """
+    Location of a tenant's own copy of a local file or directory.
+
+    Per-mailbox state (sync cursor, Gmail token, lexical index, document store, answer
+    cache, local vector index) lives under "tenants/<tenant>/" next to where the
+    single-tenant file would be, e.g. "lexical_index.sqlite" becomes "tenants/alice/lexical_index.sqlite".
+    The directory is created if needed.
+
+    Args:
+        path (str): Single-tenant path
+        tenant (str, optional): Tenant name. Defaults to None, which returns path unchanged.
+
+    Returns:
+        str: The tenant's path
+    """
+    if tenant is None:
+        return path
+    directory = os.path.join(os.path.dirname(path), "tenants", validate_tenant(tenant))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(os.path.normpath(path)))
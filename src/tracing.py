@@ -0,0 +1,284 @@
+import io
+import os
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import contextlib
+import contextvars
+import numpy as np
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Span that new spans are nested under; per thread and per asyncio task
+_current: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed stage of a request, with attributes such as token counts and payload sizes."""
+
+    def __init__(self, tracer: 'Tracer', name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.children: List['Span'] = []
+        self.detached = False
+        self.start = time.perf_counter()
+        self.end_time: Optional[float] = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end, or until now if the span is still open."""
+        return (self.end_time or time.perf_counter()) - self.start
+
+    def set(self, **attributes) -> None:
+        """Add or update attributes."""
+        self.attributes.update(attributes)
+
+    def detach(self) -> None:
+        """Keep the span open past the `with` block; whoever holds it must call end()."""
+        self.detached = True
+
+    def end(self) -> None:
+        """Close the span and record it. Further calls do nothing."""
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+            self.tracer._record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'ms': round(self.duration * 1000, 3),
+            **({'attributes': self.attributes} if self.attributes else {}),
+            **({'children': [child.to_dict() for child in self.children]} if self.children else {}),
+        }
+
+
+class StageStats:
+    """Latency histogram of one stage, over its most recent `window` spans."""
+
+    def __init__(self, window: int = 10000):
+        self.durations = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.attribute_totals: Dict[str, float] = {}
+
+    def add(self, span: Span) -> None:
+        seconds = span.duration
+        self.durations.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for key, value in span.attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.attribute_totals[key] = self.attribute_totals.get(key, 0) + value
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.durations:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.quantile(np.fromiter(self.durations, dtype=np.float64), QUANTILES)
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class Tracer:
+    """
+    Records timing spans around the stages of the RAG pipeline.
+
+    Spans nest: a span opened while another is current becomes its child, across
+    asyncio tasks and asyncio.to_thread calls (spans in other threads start new roots).
+    Every finished span feeds its stage's histogram, and every finished root span is
+    logged as one JSON line with its whole tree. Histograms export as JSON or as
+    Prometheus text.
+    """
+
+    def __init__(self, window: int = 10000, log_traces: bool = True):
+        """
+        Args:
+            window (int, optional): Spans per stage kept for the quantiles. Defaults to 10000.
+            log_traces (bool, optional): Log each finished root span. Defaults to True.
+        """
+        self.window = window
+        self.log_traces = log_traces
+        self._stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Span = None, **attributes) -> Span:
+        """
+        Open a span without making it current; close it with end().
+
+        Args:
+            name (str): Stage name
+            parent (Span, optional): Parent span. Defaults to the current span.
+            **attributes: Initial attributes
+
+        Returns:
+            Span: The open span
+        """
+        return Span(self, name, parent if parent is not None else _current.get(), attributes)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time a block as a span nested under the current one.
+
+        Args:
+            name (str): Stage name
+            **attributes: Initial attributes; more can be added with span.set()
+
+        Yields:
+            Span: The span, current for the duration of the block
+        """
+        span = self.start_span(name, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            span.detached = False
+            raise
+        finally:
+            _current.reset(token)
+            if not span.detached:
+                span.end()
+
+    def _record(self, span: Span) -> None:
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = StageStats(self.window)
+            stage.add(span)
+        if span.parent is None and self.log_traces:
+            logger.info(f"trace {json.dumps(span.to_dict(), default=str)}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-stage latency summary.
+
+        Returns:
+            dict: Stage name -> count, total/max/p50/p95/p99 in milliseconds and the totals
+                of numeric attributes (e.g. 'tokens', 'bytes')
+        """
+        with self._lock:
+            stages = list(self._stages.items())
+            summary = {}
+            for name, stage in sorted(stages):
+                quantiles = stage.quantiles()
+                summary[name] = {
+                    'count': stage.count,
+                    'total_ms': round(stage.total * 1000, 3),
+                    'max_ms': round(stage.max * 1000, 3),
+                    **{f"p{int(q * 100)}_ms": round(value * 1000, 3) for q, value in quantiles.items()},
+                    **({'attributes': dict(stage.attribute_totals)} if stage.attribute_totals else {}),
+                }
+        return summary
+
+    def export_json(self) -> str:
+        """Per-stage summary as JSON (see stats)."""
+        return json.dumps(self.stats(), indent=2)
+
+    def export_prometheus(self, prefix: str = "rag") -> str:
+        """
+        Per-stage summary in the Prometheus text exposition format.
+
+        Durations are a summary metric `<prefix>_stage_duration_seconds` with a `stage`
+        label; numeric attribute totals are a counter `<prefix>_stage_attribute_total`
+        with `stage` and `attribute` labels.
+        """
+        duration = f"{prefix}_stage_duration_seconds"
+        attribute = f"{prefix}_stage_attribute_total"
+        lines = [f"# HELP {duration} Duration of RAG pipeline stages.", f"# TYPE {duration} summary"]
+        attribute_lines = []
+        with self._lock:
+            for name, stage in sorted(self._stages.items()):
+                label = f'stage="{_escape(name)}"'
+                for q, value in stage.quantiles().items():
+                    lines.append(f'{duration}{{{label},quantile="{q}"}} {value:.6f}')
+                lines.append(f"{duration}_sum{{{label}}} {stage.total:.6f}")
+                lines.append(f"{duration}_count{{{label}}} {stage.count}")
+                for key, value in sorted(stage.attribute_totals.items()):
+                    attribute_lines.append(f'{attribute}{{{label},attribute="{_escape(key)}"}} {value}')
+        if attribute_lines:
+            lines += [f"# HELP {attribute} Sum of numeric span attributes (tokens, bytes...) per stage.",
+                      f"# TYPE {attribute} counter"] + attribute_lines
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path: str) -> None:
+        """Write the stage summary to a file: Prometheus text for .prom/.txt, JSON otherwise."""
+        text = self.export_prometheus() if path.endswith(('.prom', '.txt')) else self.export_json()
+        with open(path, 'w') as f:
+            f.write(text)
+        logger.info(f"Wrote stage metrics to {path}")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Return the process-wide tracer.
+
+    Finished requests are logged as JSON trace lines unless TRACE_LOG is set to "0".
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(log_traces=os.getenv("TRACE_LOG", "1") != "0")
+        return _tracer
+
+
+def span(name: str, **attributes):
+    """Time a block with the process-wide tracer (see Tracer.span)."""
+    return get_tracer().span(name, **attributes)
+
+
+@contextlib.contextmanager
+def profiled(enabled: bool = True, path: str = None, limit: int = 25) -> Iterator[Optional[cProfile.Profile]]:
+    """
+    Run a block under cProfile and report where the time went.
+
+    The stats are dumped to `path` (default logs/profile-<timestamp>.prof, readable with
+    pstats or snakeviz) and the top `limit` functions by cumulative time are logged.
+    Profiling covers the calling thread only.
+
+    Args:
+        enabled (bool, optional): Profile the block; when False this does nothing. Defaults to True.
+        path (str, optional): Where to dump the stats
+        limit (int, optional): Functions listed in the log. Defaults to 25.
+
+    Yields:
+        cProfile.Profile: The profiler, or None when disabled
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        path = path or os.path.join('logs', f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(limit)
+        logger.info(f"Profile saved to {path}\n{report.getvalue()}")
+
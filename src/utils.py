@@ -1,29 +1,164 @@
 import os
+import time
+import asyncio
 import hashlib
-from openai import OpenAI
+import functools
+from clients import get_openai_client, get_async_openai_client
+from embedding_cache import EmbeddingCache, get_embedding_cache
+from tracing import span
+from ratelimit import get_rate_limiter
 from dotenv import load_dotenv
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY2")
-client = OpenAI(api_key=OPENAI_API_KEY)
 ENGINE = 'text-embedding-3-small'
+CHAT_MODEL = 'gpt-4o'
+
+# OpenAI limits for the embeddings endpoint
+EMBEDDING_MAX_INPUT_TOKENS = 8191      # per input text
+EMBEDDING_MAX_BATCH_TOKENS = 300000    # per request, summed over all inputs
+EMBEDDING_MAX_BATCH_SIZE = 2048        # inputs per request
+
+# Function to look up texts in the embedding cache, keeping duplicates to a single lookup;
+# returns the cache keys of the texts, the embeddings found and the missing texts by key
+def _lookup_embeddings(stage, texts, engine):
+    cache = get_embedding_cache()
+    keys = [EmbeddingCache.make_key(text, engine) for text in texts]
+    found = cache.get_many(list(dict.fromkeys(keys))) if cache else {}
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    stage.set(cache_hits=len(keys) - len(missing))
+    return keys, found, missing
+
+# Function to add the embeddings of an OpenAI response to the found ones and the cache
+def _store_embeddings(stage, found, missing, response):
+    record_usage(stage, response)
+    fresh = dict(zip(missing, (d.embedding for d in response.data)))
+    cache = get_embedding_cache()
+    if cache:
+        cache.put_many(fresh)
+    found.update(fresh)
 
 # Function to get embeddings for a list of texts using the OpenAI API
 def get_embeddings(texts, engine=ENGINE):
-    # Create embeddings for the input texts using the specified engine
-    response = client.embeddings.create(
-        input=texts,
-        model=engine
-    )
+    with span("embed", texts=len(texts), bytes=sum(len(text) for text in texts)) as stage:
+        # Serve what we can from the embedding cache
+        keys, found, missing = _lookup_embeddings(stage, texts, engine)
+        if missing:
+            # Create embeddings for the cache misses using the specified engine
+            wait = reserve_openai(stage, list(missing.values()))
+            if wait:
+                time.sleep(wait)
+            response = get_openai_client().embeddings.create(
+                input=list(missing.values()),
+                model=engine
+            )
+            _store_embeddings(stage, found, missing, response)
 
-    # Extract and return the list of embeddings from the response
-    return [d.embedding for d in list(response.data)]
+        # Return the list of embeddings in the order of the input texts
+        return [found[key] for key in keys]
 
 # Function to get embedding for a single text using the OpenAI API
 def get_embedding(text, engine=ENGINE):
     # Use the get_embeddings function to get the embedding for a single text
     return get_embeddings([text], engine)[0]
 
+# Async variant of get_embeddings, for use from an event loop
+async def aget_embeddings(texts, engine=ENGINE):
+    with span("embed", texts=len(texts), bytes=sum(len(text) for text in texts)) as stage:
+        # The SQLite cache is read and written in a worker thread, off the event loop
+        keys, found, missing = await asyncio.to_thread(_lookup_embeddings, stage, texts, engine)
+        if missing:
+            wait = reserve_openai(stage, list(missing.values()))
+            if wait:
+                await asyncio.sleep(wait)
+            response = await get_async_openai_client().embeddings.create(
+                input=list(missing.values()),
+                model=engine
+            )
+            await asyncio.to_thread(_store_embeddings, stage, found, missing, response)
+        return [found[key] for key in keys]
+
+# Async variant of get_embedding
+async def aget_embedding(text, engine=ENGINE):
+    return (await aget_embeddings([text], engine))[0]
+
+# Function to reserve the shared OpenAI request and token budgets for embedding texts;
+# returns the seconds to wait before sending the request, also recorded on the span
+def reserve_openai(stage, texts):
+    requests, tokens = get_rate_limiter('openai_requests'), get_rate_limiter('openai_tokens')
+    wait = requests.reserve() if requests else 0.0
+    if tokens:
+        wait = max(wait, tokens.reserve(sum(min(count_tokens(text), EMBEDDING_MAX_INPUT_TOKENS) for text in texts)))
+    if wait:
+        stage.set(throttled_ms=wait * 1000)
+    return wait
+
+# Function to copy the token counts an OpenAI response reports onto a tracing span
+def record_usage(stage, response):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    for field in ('prompt_tokens', 'completion_tokens'):
+        value = getattr(usage, field, None)
+        if isinstance(value, int):
+            stage.set(**{field: value})
+
+# Tokenizer installed with set_encoding, used for every model instead of tiktoken's
+_encoding_override = None
+
+# Function to replace the tiktoken tokenizers, e.g. with a stub in offline benchmarks (None restores them)
+def set_encoding(encoding):
+    global _encoding_override
+    _encoding_override = encoding
+
+# Function to load the tokenizer used by the text-embedding-3 models (downloaded on first use)
+def get_encoding():
+    return _encoding_override or _load_encoding("cl100k_base")
+
+@functools.lru_cache(maxsize=None)
+def _load_encoding(name):
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+# Function to count the tokens in a text the way the embedding model does
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+# Function to load the tokenizer of a chat model (o200k_base for gpt-4o)
+def get_chat_encoding(model=CHAT_MODEL):
+    return _encoding_override or _load_chat_encoding(model)
+
+@functools.lru_cache(maxsize=None)
+def _load_chat_encoding(model):
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+# Function to count the tokens in a text the way the chat model does
+def count_chat_tokens(text, model=CHAT_MODEL):
+    return len(get_chat_encoding(model).encode(text, disallowed_special=()))
+
+# Function to cut a text down to at most max_tokens tokens
+def truncate_tokens(text, max_tokens=EMBEDDING_MAX_INPUT_TOKENS):
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+# Function to group items into batches bounded by both item count and total tokens
+def batch_by_tokens(items, key=lambda item: item, batch_size=100, max_tokens=EMBEDDING_MAX_BATCH_TOKENS):
+    batch, batch_tokens = [], 0
+    for item in items:
+        # A single input never costs more than the per-input limit, since it gets truncated
+        tokens = min(count_tokens(key(item)), EMBEDDING_MAX_INPUT_TOKENS)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
 def my_hash(s):
     # Return the MD5 hash of the input string as a hexadecimal string
     return hashlib.md5(s.encode()).hexdigest()
@@ -2,12 +2,23 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from pinecone import Pinecone, ServerlessSpec
+import time
+import asyncio
+import queue
+import threading
 from tqdm import tqdm
 import logging
-from typing import List, Dict, Any
-from utils import get_embedding, get_embeddings, my_hash
-from mail import MailClient
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Iterable, Callable, Optional, Tuple
+from utils import get_embedding, aget_embedding, get_embeddings, batch_by_tokens, truncate_tokens
+from chunker import chunk_email, collapse_matches, message_id_of, CHUNK_SEPARATOR
+from answer_cache import get_answer_cache
+from lexical_index import LexicalIndex, get_lexical_index, reciprocal_rank_fusion
+from doc_store import DocumentStore, get_document_store
+from tracing import span
+from clients import get_pinecone
+from ratelimit import get_rate_limiter
+from tenants import tenant_path, validate_tenant
 
 # Configure logging
 logging.basicConfig(
@@ -16,17 +27,522 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class PineconeClient:
-    def __init__(self, api_key: str = None, index_name: str = "email-qa", namespace: str = ""):
+class VectorStore(ABC):
+    """
+    Interface shared by the vector store backends.
+
+    The ingest pipeline and the query entry points live here; backends only implement
+    the storage primitives (_upsert_vectors, _query_vectors, _chunk_ids, _delete_vectors,
+    delete_email, delete_all_emails and get_email_count).
+    """
+
+    # Chunks retrieved per requested email, so that several chunks of one email can
+    # collapse together and still leave top_k distinct emails
+    CHUNK_FANOUT = 4
+
+    def __init__(self, batch_size: int = 100, max_batch_tokens: int = 250000, concurrency: int = 4,
+                 chunk_tokens: int = 400, chunk_overlap: int = 50, lexical_index: LexicalIndex = None,
+                 document_store: DocumentStore = None):
+        """
+        Args:
+            batch_size (int, optional): Maximum chunks per embedding/upsert batch. Defaults to 100.
+            max_batch_tokens (int, optional): Maximum tokens per embedding request. Defaults to 250000.
+            concurrency (int, optional): Number of batches embedded and upserted in parallel. Defaults to 4.
+            chunk_tokens (int, optional): Token budget of an email chunk. Defaults to 400.
+            chunk_overlap (int, optional): Tokens shared by consecutive chunks. Defaults to 50.
+            lexical_index (LexicalIndex, optional): BM25 index kept in step with the stored
+                chunks and fused into query results. Defaults to None (vector search only).
+            document_store (DocumentStore, optional): Compressed store holding the chunk
+                texts, which are then left out of the vector and lexical index metadata and
+                fetched only for the final matches. Defaults to None (texts kept in metadata).
+        """
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.lexical_index = lexical_index
+        self.document_store = document_store
+        self._change_listeners: List[Callable[[Optional[List[str]]], None]] = []
+
+    @abstractmethod
+    def _upsert_vectors(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        """Write (id, embedding, metadata) tuples, replacing existing IDs."""
+
+    @abstractmethod
+    def _query_vectors(self, vector: List[float], top_k: int,
+                       filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Return the top_k matches for an embedding as dicts with 'id', 'score' and 'metadata',
+        among the chunks whose metadata satisfies the Pinecone-style filter (see filters.py).
+        """
+
+    async def _aquery_vectors(self, vector: List[float], top_k: int,
+                              filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Async _query_vectors. Runs the sync version in a worker thread unless overridden."""
+        return await asyncio.to_thread(self._query_vectors, vector, top_k, filter=filter)
+
+    @abstractmethod
+    def _chunk_ids(self, email_id: str) -> List[str]:
+        """Return the stored vector IDs of an email: its chunk IDs, and its own ID if stored unchunked."""
+
+    @abstractmethod
+    def _delete_vectors(self, ids: List[str]) -> None:
+        """Delete vectors by ID."""
+
+    @abstractmethod
+    def get_email_count(self) -> int:
+        """Get the total count of email vectors in the database."""
+
+    @abstractmethod
+    def delete_email(self, email_id: str) -> None:
+        """Delete a specific email (all of its chunks) from the database by its ID."""
+
+    @abstractmethod
+    def delete_all_emails(self) -> None:
+        """Delete all emails from the database."""
+
+    def flush(self) -> None:
+        """Persist any state the backend buffers in memory. Called after each upsert run."""
+        if self.lexical_index is not None:
+            self.lexical_index.flush()
+        if self.document_store is not None:
+            self.document_store.flush()
+
+    def add_change_listener(self, listener: Callable[[Optional[List[str]]], None]) -> None:
+        """
+        Register a callback run whenever stored emails change.
+
+        Args:
+            listener (callable): Called with the IDs of upserted or deleted emails, or with
+                None when every email was deleted
+        """
+        self._change_listeners.append(listener)
+
+    def _on_deleted(self, email_ids: Optional[List[str]]) -> None:
+        """Called by backends after deleting emails (None: all of them)."""
+        if self.lexical_index is not None:
+            self.lexical_index.delete(email_ids, separator=CHUNK_SEPARATOR)
+        if self.document_store is not None:
+            self.document_store.delete(email_ids, separator=CHUNK_SEPARATOR)
+        self._notify_changed(email_ids)
+
+    def _delete_stale_chunks(self, chunk_counts: Dict[str, int]) -> None:
+        """
+        Delete the chunks an email had beyond its current chunk count, left over from a
+        longer earlier version of it, along with their texts and lexical index entries.
+
+        Args:
+            chunk_counts (dict): Email ID -> number of chunks just stored for it
+        """
+        stale = []
+        for email_id, count in chunk_counts.items():
+            for vector_id in self._chunk_ids(email_id):
+                n = vector_id[len(email_id) + 1:]
+                if vector_id == email_id or not n.isdigit() or int(n) >= count:
+                    stale.append(vector_id)
+        if not stale:
+            return
+        logger.info(f"Deleting {len(stale)} stale chunks")
+        self._delete_vectors(stale)
+        if self.lexical_index is not None:
+            self.lexical_index.delete_documents(stale)
+        if self.document_store is not None:
+            self.document_store.delete_documents(stale)
+
+    def _notify_changed(self, email_ids: Optional[List[str]]) -> None:
+        for listener in self._change_listeners:
+            try:
+                listener(email_ids)
+            except Exception as e:
+                logger.error(f"Error in change listener: {str(e)}")
+
+    async def aclose(self) -> None:
+        """Release resources held by the async query path."""
+
+    def upsert_emails(self, emails: Iterable[Dict[str, Any]], batch_size: int = None,
+                      max_batch_tokens: int = None, concurrency: int = None,
+                      on_upserted: Callable[[List[Dict[str, Any]]], None] = None, replace: bool = True) -> int:
+        """
+        Upsert email documents to the vector store.
+
+        Each email is split into chunks (see chunker.chunk_email) stored under
+        "<message id>#<n>". Chunks are grouped into batches bounded by count and token
+        budget. Each batch is embedded with a single OpenAI request and written with a
+        single bulk upsert. Embedding and upserting run as a bounded producer/consumer
+        pipeline, so the next batches are being embedded while earlier ones are still
+        being written. With a document store, chunk texts are written there (before
+        their vectors, so a match always finds its text) and left out of the metadata.
+        Once all chunks of an email are written, chunks left over from a longer earlier
+        version of it are deleted.
+
+        Args:
+            emails (iterable): Dictionaries containing email data with 'id', 'subject', 'sender' and 'body' keys
+            batch_size (int, optional): Maximum chunks per batch. Defaults to the store setting.
+            max_batch_tokens (int, optional): Maximum tokens per batch. Defaults to the store setting.
+            concurrency (int, optional): Batches processed in parallel per stage. Defaults to the store setting.
+            on_upserted (callable, optional): Called with emails once all of their chunks are
+                stored. Calls are serialized, so the callback does not need its own locking.
+            replace (bool, optional): Look for and delete leftover chunks of earlier
+                versions of the emails. Pass False when the store holds none of them, e.g.
+                on a first ingest, to save a lookup per email. Defaults to True.
+
+        Returns:
+            int: Number of emails successfully upserted
+        """
+        batch_size = batch_size or self.batch_size
+        max_batch_tokens = max_batch_tokens or self.max_batch_tokens
+        concurrency = concurrency or self.concurrency
+        logger.info(f"Starting upsert operation (batch_size={batch_size}, "
+                    f"max_batch_tokens={max_batch_tokens}, concurrency={concurrency})")
+
+        # Embedded batches waiting to be written. The semaphore caps the number of batches
+        # anywhere in the pipeline so memory stays bounded however many emails come in.
+        embedded = queue.Queue(maxsize=concurrency)
+        in_flight = threading.BoundedSemaphore(concurrency * 2)
+        progress = tqdm(total=len(emails) if hasattr(emails, '__len__') else None, unit="email")
+        lock = threading.Lock()
+        upserted = 0
+        # Emails whose chunks are not all stored yet: message ID -> [email, chunks left, chunk count]
+        pending = {}
+
+        def chunks():
+            for email in emails:
+                email_chunks = chunk_email(email, self.chunk_tokens, self.chunk_overlap)
+                with lock:
+                    pending[email['id']] = [email, len(email_chunks), len(email_chunks)]
+                yield from email_chunks
+
+        def embed_worker(batch_queue):
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    break
+                batch_no, batch = item
+                try:
+                    started = time.perf_counter()
+                    embeddings = get_embeddings([truncate_tokens(chunk['text']) for chunk in batch])
+                    embedded.put((batch_no, batch, embeddings, time.perf_counter() - started))
+                except Exception as e:
+                    logger.error(f"Error embedding batch {batch_no}: {str(e)}")
+                    in_flight.release()
+
+        def upsert_worker():
+            nonlocal upserted
+            while True:
+                item = embedded.get()
+                if item is None:
+                    break
+                batch_no, batch, embeddings, embed_seconds = item
+                try:
+                    started = time.perf_counter()
+                    metadata = [chunk['metadata'] for chunk in batch]
+                    if self.document_store is not None:
+                        with span("doc_store_put", docs=len(batch)):
+                            self.document_store.put([(chunk['id'], chunk['metadata']['text']) for chunk in batch])
+                        metadata = [{key: value for key, value in meta.items() if key != 'text'} for meta in metadata]
+                    with span("upsert", vectors=len(batch),
+                              bytes=sum(len(meta.get('text', '')) + 4 * len(embedding)
+                                        for meta, embedding in zip(metadata, embeddings))):
+                        self._upsert_vectors([
+                            (chunk['id'], embedding, meta)
+                            for chunk, embedding, meta in zip(batch, embeddings, metadata)
+                        ])
+                    if self.lexical_index is not None:
+                        with span("lexical_add", docs=len(batch)):
+                            self.lexical_index.add([(chunk['id'], chunk['text'], meta)
+                                                    for chunk, meta in zip(batch, metadata)])
+                    upsert_seconds = time.perf_counter() - started
+                    total_seconds = embed_seconds + upsert_seconds
+                    logger.info(f"Batch {batch_no}: {len(batch)} chunks, embed {embed_seconds:.2f}s, "
+                                f"upsert {upsert_seconds:.2f}s ({len(batch) / total_seconds:.1f} chunks/s)")
+                    with lock:
+                        completed = {}
+                        for chunk in batch:
+                            entry = pending[chunk['metadata']['message_id']]
+                            entry[1] -= 1
+                            if entry[1] == 0:
+                                email, _, count = pending.pop(chunk['metadata']['message_id'])
+                                completed[email['id']] = (email, count)
+                    if replace and completed:
+                        with span("delete_stale", emails=len(completed)):
+                            self._delete_stale_chunks({email_id: count for email_id, (_, count) in completed.items()})
+                    completed = [email for email, _ in completed.values()]
+                    with lock:
+                        upserted += len(completed)
+                        progress.update(len(completed))
+                        if completed:
+                            self._notify_changed([email['id'] for email in completed])
+                        if on_upserted and completed:
+                            on_upserted(completed)
+                except Exception as e:
+                    logger.error(f"Error during upsert of batch {batch_no}: {str(e)}")
+                finally:
+                    in_flight.release()
+
+        batch_queue = queue.Queue()
+        embedders = [threading.Thread(target=embed_worker, args=(batch_queue,), daemon=True)
+                     for _ in range(concurrency)]
+        upserters = [threading.Thread(target=upsert_worker, daemon=True) for _ in range(concurrency)]
+        for thread in embedders + upserters:
+            thread.start()
+
+        started = time.perf_counter()
+        try:
+            for batch_no, batch in enumerate(batch_by_tokens(chunks(), key=lambda chunk: chunk['text'],
+                                                             batch_size=batch_size,
+                                                             max_tokens=max_batch_tokens)):
+                in_flight.acquire()
+                batch_queue.put((batch_no, batch))
+        finally:
+            for _ in embedders:
+                batch_queue.put(None)
+            for thread in embedders:
+                thread.join()
+            for _ in upserters:
+                embedded.put(None)
+            for thread in upserters:
+                thread.join()
+            progress.close()
+            self.flush()
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Successfully completed email upsert operation: {upserted} emails in {elapsed:.2f}s "
+                    f"({upserted / elapsed if elapsed else 0:.1f} emails/s)")
+        return upserted
+
+    def query_matches(self, query_text: str, top_k: int = 5, query_vector: List[float] = None,
+                      filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Query similar emails based on the input text, returning the raw matches.
+
+        With a lexical index, vector and BM25 chunk rankings are merged by reciprocal rank
+        fusion and 'score' is the fused score. A filter is applied by the backend before
+        scoring, so only matching chunks are ranked.
+
+        Args:
+            query_text (str): The text to search for similar emails
+            top_k (int): Number of similar emails to return (default: 5)
+            query_vector (list, optional): Precomputed embedding of query_text. When given,
+                the text is not embedded again.
+            filter (dict, optional): Pinecone-style metadata filter, e.g.
+                {"sender_org": "amazon", "date": {"$gte": 1717200000}} (see filters.py)
+
+        Returns:
+            list: One match per email, best first, as dicts with 'id' (message ID), 'score',
+                'chunks' (matched chunk IDs) and 'metadata' whose 'text' is the email header
+                plus only the matched spans
+        """
+        try:
+            logger.info(f"Querying emails with text: '{query_text[:50]}...' (top_k={top_k}, filter={filter})")
+            with span("retrieve", top_k=top_k, filtered=bool(filter)) as stage:
+                q_embedding = query_vector if query_vector is not None else get_embedding(query_text)
+                with span("vector_query", top_k=top_k * self.CHUNK_FANOUT) as query_stage:
+                    chunk_matches = self._query_vectors(q_embedding, top_k * self.CHUNK_FANOUT, filter=filter)
+                    query_stage.set(matches=len(chunk_matches))
+                chunk_matches = self._fuse(chunk_matches,
+                                           self._lexical_search(query_text, top_k * self.CHUNK_FANOUT, filter))
+                chunk_matches = self._attach_texts(chunk_matches, top_k)
+                matches = collapse_matches(chunk_matches, top_k)
+                stage.set(chunks=len(chunk_matches), matches=len(matches))
+            logger.info(f"Found {len(matches)} matching emails from {len(chunk_matches)} chunks")
+            return matches
+        except Exception as e:
+            logger.error(f"Error querying emails: {str(e)}")
+            raise
+
+    def alexical_search(self, query_text: str, top_k: int = 5, filter: Dict[str, Any] = None) -> asyncio.Task:
+        """
+        Start the BM25 half of aquery_matches in a worker thread. It needs no embedding, so
+        callers can start it before embedding the question and pass it on as lexical_matches.
+
+        Args:
+            query_text (str): The text to search for
+            top_k (int): Number of emails the query asks for (default: 5)
+            filter (dict, optional): Metadata filter of the query
+
+        Returns:
+            asyncio.Task: Resolves to the lexical chunk matches
+        """
+        return asyncio.create_task(asyncio.to_thread(self._lexical_search, query_text,
+                                                     top_k * self.CHUNK_FANOUT, filter))
+
+    async def aquery_matches(self, query_text: str, top_k: int = 5, query_vector: List[float] = None,
+                             filter: Dict[str, Any] = None, lexical_matches: asyncio.Task = None) -> List[Dict[str, Any]]:
+        """
+        Async query_matches: embeds (unless query_vector is given) and searches without
+        blocking the event loop.
+
+        Args:
+            lexical_matches (asyncio.Task, optional): BM25 search for the same query already
+                started with alexical_search. Defaults to None (started here).
+        """
+        try:
+            logger.info(f"Querying emails with text: '{query_text[:50]}...' (top_k={top_k}, filter={filter})")
+            with span("retrieve", top_k=top_k, filtered=bool(filter)) as stage:
+                # BM25 search runs in a worker thread while the question is embedded and the
+                # vector query is in flight
+                lexical = lexical_matches or self.alexical_search(query_text, top_k, filter)
+                try:
+                    q_embedding = query_vector if query_vector is not None else await aget_embedding(query_text)
+                    with span("vector_query", top_k=top_k * self.CHUNK_FANOUT) as query_stage:
+                        chunk_matches = await self._aquery_vectors(q_embedding, top_k * self.CHUNK_FANOUT,
+                                                                   filter=filter)
+                        query_stage.set(matches=len(chunk_matches))
+                except BaseException:
+                    lexical.cancel()
+                    raise
+                chunk_matches = self._fuse(chunk_matches, await lexical)
+                if self.document_store is not None:
+                    chunk_matches = await asyncio.to_thread(self._attach_texts, chunk_matches, top_k)
+                matches = collapse_matches(chunk_matches, top_k)
+                stage.set(chunks=len(chunk_matches), matches=len(matches))
+            logger.info(f"Found {len(matches)} matching emails from {len(chunk_matches)} chunks")
+            return matches
+        except Exception as e:
+            logger.error(f"Error querying emails: {str(e)}")
+            raise
+
+    def _field_values(self, field: str, prefix: str) -> Optional[List[Any]]:
+        """
+        Stored values of a filterable field that start with prefix, or None when the store
+        cannot list them. Backends without their own field index answer from the lexical index.
+        """
+        if self.lexical_index is None:
+            return None
+        return self.lexical_index.field_values(field, prefix)
+
+    def resolve_filter(self, filter: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Match the sender names in a filter from filters.parse_query_filters against the
+        organizations actually stored.
+
+        A sender name becomes the stored organizations it is a prefix of ("hdfc" matches
+        "hdfcbank"), and is dropped when it matches none, since such a filter could only
+        come back empty. Filters are returned unchanged when the store cannot list its
+        organizations.
+
+        Args:
+            filter (dict): Filter parsed from a question, or None
+
+        Returns:
+            dict: The resolved filter, or None if nothing is left of it
+        """
+        if not filter:
+            return filter
+        conditions = filter['$and'] if list(filter) == ['$and'] else [filter]
+        resolved = []
+        for condition in conditions:
+            value = condition.get('sender_org') if list(condition) == ['sender_org'] else None
+            name = value.get('$eq') if isinstance(value, dict) and list(value) == ['$eq'] else None
+            if not isinstance(name, str):
+                resolved.append(condition)
+                continue
+            orgs = self._field_values('sender_org', name)
+            if orgs is None or orgs == [name]:
+                resolved.append(condition)
+            elif name in orgs:
+                resolved.append({'sender_org': {'$eq': name}})
+            elif orgs:
+                resolved.append({'sender_org': {'$in': orgs}})
+            else:
+                logger.info(f"No stored sender matches {name!r}, dropping it from the filter")
+        if not resolved:
+            return None
+        return resolved[0] if len(resolved) == 1 else {'$and': resolved}
+
+    def _lexical_search(self, query_text: str, top_k: int, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        if self.lexical_index is None:
+            return []
+        with span("lexical_search", top_k=top_k) as stage:
+            matches = self.lexical_index.search(query_text, top_k, filter=filter)
+            stage.set(matches=len(matches))
+        return matches
+
+    def _attach_texts(self, chunk_matches: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """
+        Keep the chunks of the top_k best emails and fetch their texts from the document store.
+
+        Chunks stored before the document store was enabled still carry their text in the
+        metadata and are left as they are.
+        """
+        if self.document_store is None:
+            return chunk_matches
+        kept, messages = [], set()
+        for match in chunk_matches:
+            message_id = match['metadata'].get('message_id', message_id_of(match['id']))
+            if message_id not in messages:
+                if len(messages) == top_k:
+                    continue
+                messages.add(message_id)
+            kept.append(match)
+        missing = [match['id'] for match in kept if 'text' not in match['metadata']]
+        if not missing:
+            return kept
+        with span("doc_fetch", docs=len(missing)) as stage:
+            texts = self.document_store.get(missing)
+            stage.set(bytes=sum(len(text) for text in texts.values()))
+        return [match if 'text' in match['metadata'] else
+                {**match, 'metadata': {**match['metadata'], 'text': texts.get(match['id'], '')}}
+                for match in kept]
+
+    @staticmethod
+    def _fuse(vector_matches: List[Dict[str, Any]], lexical_matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not lexical_matches:
+            return vector_matches
+        return reciprocal_rank_fusion([vector_matches, lexical_matches])
+
+    def query_emails(self, query_text: str, top_k: int = 5, query_vector: List[float] = None,
+                     filter: Dict[str, Any] = None) -> List[str]:
+        """
+        Query similar emails based on the input text.
+        
+        Args:
+            query_text (str): The text to search for similar emails
+            top_k (int): Number of similar emails to return (default: 5)
+            query_vector (list, optional): Precomputed embedding of query_text. When given,
+                the text is not embedded again.
+            filter (dict, optional): Pinecone-style metadata filter (see query_matches)
+        
+        Returns:
+            list: List of similar email texts
+        """
+        return [match['metadata']['text']
+                for match in self.query_matches(query_text, top_k, query_vector, filter=filter)]
+
+
+# Pinecone indexes known to exist, as (api key, index name), so that each process
+# checks (and creates) an index at most once however many clients it constructs
+_existing_indexes = set()
+_existing_indexes_lock = threading.Lock()
+
+# Index clients by (api key, index name), shared by every PineconeClient of the index
+# (one per tenant namespace) so that all tenants go through one HTTP connection pool;
+# asyncio clients are kept as [event loop their session belongs to, client, number of
+# stores using it], and closed when the last of those stores is closed
+_index_clients: Dict[Tuple[str, str], Any] = {}
+_async_index_clients: Dict[Tuple[str, str], List[Any]] = {}
+
+
+class PineconeClient(VectorStore):
+    def __init__(self, api_key: str = None, index_name: str = "email-qa", namespace: str = "", pc=None, **kwargs):
         """
         Initialize PineconeClient with API credentials and index name.
+
+        Nothing is sent to Pinecone here: the index is checked, created if needed and
+        connected to on first use.
         
         Args:
             api_key (str, optional): Pinecone API key. Defaults to environment variable.
-            environment (str, optional): Pinecone environment. Defaults to environment variable.
             index_name (str, optional): Name of the Pinecone index. Defaults to "email-qa".
-            namespace (str, optional): Namespace to use. Defaults to empty string.
+            namespace (str, optional): Namespace holding this store's emails, e.g. one per
+                tenant; every read and write is scoped to it. Defaults to empty string.
+            pc (pinecone.Pinecone, optional): Pinecone client. Defaults to the process-wide
+                one for api_key (see clients.get_pinecone).
+            **kwargs: Pipeline settings passed to VectorStore (batch_size, max_batch_tokens,
+                concurrency, chunk_tokens, chunk_overlap)
         """
+        super().__init__(**kwargs)
         self.api_key = api_key or os.getenv("PINECONE_APT_KEY")
         self.index_name = index_name
         self.namespace = namespace
@@ -34,61 +550,169 @@ class PineconeClient:
         if not self.api_key:
             raise ValueError("Pinecone API key must be provided or set as environment variables")
         
-        self.pc = Pinecone(api_key=self.api_key)
-        self.create_index(self.index_name)
-        self.index = self.pc.Index(self.index_name)
+        self._pc = pc
+        self._index = None
+        self._async_index = None
+
+    @property
+    def pc(self):
+        """Pinecone client."""
+        if self._pc is None:
+            self._pc = get_pinecone(self.api_key)
+        return self._pc
+
+    @property
+    def index(self):
+        """Client of the index, connected (and the index created if missing) on first use."""
+        if self._index is None:
+            key = (self.api_key, self.index_name)
+            with _existing_indexes_lock:
+                index = _index_clients.get(key)
+            if index is None:
+                self.create_index(self.index_name)
+                with _existing_indexes_lock:
+                    index = _index_clients.setdefault(key, self.pc.Index(self.index_name))
+            self._index = index
+        return self._index
 
     def create_index(self, index_name: str = "email-qa") -> None:
         """
-        Create a new Pinecone index.
+        Create a new Pinecone index, unless it is already known to exist.
         
         Args:
             index_name (str, optional): Name of the Pinecone index. Defaults to "email-qa".
         """
-        try:
-            logger.info(f"Creating new Pinecone index: {index_name}")
-            if index_name in self.pc.list_indexes().names():
-                logger.info(f"Index {index_name} already exists")
-            else:
-                self.pc.create_index(index_name, 
-                                    dimension=1536,
-                                    metric='cosine',
-                                    spec = ServerlessSpec(
-                                        cloud='aws',
-                                        region='us-east-1'))
-                logger.info(f"Successfully created index: {index_name}")
-        except Exception as e:
-            logger.error(f"Error creating index: {str(e)}")
-            raise
+        key = (self.api_key, index_name)
+        if key in _existing_indexes:
+            return
+        with _existing_indexes_lock:
+            if key in _existing_indexes:
+                return
+            try:
+                if index_name in self.pc.list_indexes().names():
+                    logger.info(f"Index {index_name} already exists")
+                else:
+                    from pinecone import ServerlessSpec
+                    logger.info(f"Creating new Pinecone index: {index_name}")
+                    self.pc.create_index(index_name, 
+                                        dimension=1536,
+                                        metric='cosine',
+                                        spec = ServerlessSpec(
+                                            cloud='aws',
+                                            region='us-east-1'))
+                    logger.info(f"Successfully created index: {index_name}")
+                _existing_indexes.add(key)
+            except Exception as e:
+                logger.error(f"Error creating index: {str(e)}")
+                raise
+
+    def _throttle(self) -> None:
+        """Wait for the shared Pinecone request budget, if one is configured."""
+        limiter = get_rate_limiter('pinecone_requests')
+        if limiter:
+            limiter.acquire()
+
+    def _upsert_vectors(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        self._throttle()
+        self.index.upsert(vectors=vectors, namespace=self.namespace)
+
+    def _query_vectors(self, vector: List[float], top_k: int,
+                       filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        results = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=self.namespace,
+            filter=filter
+        )
+        return [{'id': match['id'], 'score': match['score'], 'metadata': match['metadata']}
+                for match in results['matches']]
 
-    def upsert_emails(self, emails: List[Dict[str, Any]]) -> None:
+    def _chunk_ids(self, email_id: str) -> List[str]:
+        ids = []
+        # Listing by the bare ID also finds a vector stored before chunking
+        for page in self.index.list(prefix=email_id, namespace=self.namespace):
+            ids.extend(vector_id for vector_id in page
+                       if vector_id == email_id or vector_id.startswith(f"{email_id}{CHUNK_SEPARATOR}"))
+        return ids
+
+    def _delete_vectors(self, ids: List[str]) -> None:
+        # Pinecone accepts at most 1000 IDs per delete
+        for start in range(0, len(ids), 1000):
+            self._throttle()
+            self.index.delete(ids=ids[start:start + 1000], namespace=self.namespace)
+
+    async def _aquery_vectors(self, vector: List[float], top_k: int,
+                              filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        index = await self._get_async_index()
+        results = await index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=self.namespace,
+            filter=filter
+        )
+        return [{'id': match['id'], 'score': match['score'], 'metadata': match['metadata']}
+                for match in results['matches']]
+
+    async def _get_async_index(self):
         """
-        Upsert email documents to Pinecone vector database.
-        
-        Args:
-            emails (list): List of dictionaries containing email data with 'id' and 'text' keys
+        Return an asyncio index client bound to the running event loop.
+
+        Its HTTP session is reused across queries, and across the stores of every
+        namespace of the index, so concurrent requests share one connection pool instead
+        of opening a connection each.
         """
-        logger.info(f"Starting upsert operation for {len(emails)} emails")
-        for email in tqdm(emails):
-            try:
-                embedding = get_embedding(email['text'])
-                self.index.upsert([(email['id'], embedding, {"text": email['text']})])
-            except Exception as e:
-                logger.error(f"Error during email upsert: {str(e)}")
-                continue
-        logger.info("Successfully completed email upsert operation")
+        loop = asyncio.get_running_loop()
+        entry = self._async_index
+        if entry is None or entry[0] is not loop:
+            key = (self.api_key, self.index_name)
+            shared = _async_index_clients.get(key)
+            if shared is None or shared[0] is not loop:
+                # Control plane calls are blocking HTTP requests, kept off the event loop
+                await asyncio.to_thread(self.create_index, self.index_name)
+                description = await asyncio.to_thread(self.pc.describe_index, self.index_name)
+                shared = _async_index_clients.get(key)
+                if shared is None or shared[0] is not loop:
+                    shared = _async_index_clients[key] = [loop, self.pc.IndexAsyncio(host=description.host), 0]
+            if entry is not None:
+                # The client of an earlier loop cannot be closed from this one
+                entry[2] -= 1
+            shared[2] += 1
+            entry = self._async_index = shared
+        return entry[1]
+
+    async def aclose(self) -> None:
+        """
+        Release this store's use of the asyncio index client; the next query reopens it.
+
+        The client is shared by the stores of every namespace of the index, so it is only
+        closed once none of them uses it any more.
+        """
+        entry, self._async_index = self._async_index, None
+        if entry is None:
+            return
+        entry[2] -= 1
+        if entry[2] > 0:
+            return
+        key = (self.api_key, self.index_name)
+        if _async_index_clients.get(key) is entry:
+            del _async_index_clients[key]
+        if entry[0] is asyncio.get_running_loop():
+            await entry[1].close()
 
     def get_email_count(self) -> int:
         """
         Get the total count of email vectors in the database.
         
         Returns:
-            int: Total number of vectors in the index
+            int: Number of vectors in this store's namespace
         """
         try:
             stats = self.index.describe_index_stats()
-            count = stats['total_vector_count']
-            logger.info(f"Current email count in database: {count}")
+            namespace = stats['namespaces'].get(self.namespace)
+            count = namespace['vector_count'] if namespace else 0
+            logger.info(f"Current email count in namespace {self.namespace!r}: {count}")
             return count
         except Exception as e:
             logger.error(f"Error fetching email count: {str(e)}")
@@ -103,7 +727,8 @@ class PineconeClient:
         """
         try:
             logger.info(f"Deleting email with ID: {email_id}")
-            self.index.delete(ids=[email_id])
+            self._delete_vectors(self._chunk_ids(email_id))
+            self._on_deleted([email_id])
             logger.info(f"Successfully deleted email {email_id}")
         except Exception as e:
             logger.error(f"Error deleting email {email_id}: {str(e)}")
@@ -111,42 +736,60 @@ class PineconeClient:
 
     def delete_all_emails(self) -> None:
         """
-        Delete all emails from the database.
+        Delete all emails of this store's namespace from the database.
         Warning: This is a destructive operation that cannot be undone.
         """
         try:
-            logger.warning("Initiating deletion of ALL emails from the database")
-            self.index.delete(delete_all=True)
+            logger.warning(f"Initiating deletion of ALL emails in namespace {self.namespace!r}")
+            self._throttle()
+            self.index.delete(delete_all=True, namespace=self.namespace)
+            self._on_deleted(None)
             logger.info("Successfully deleted all emails from the database")
         except Exception as e:
             logger.error(f"Error deleting all emails: {str(e)}")
             raise
 
-    def query_emails(self, query_text: str, top_k: int = 5) -> List[str]:
-        """
-        Query similar emails based on the input text.
-        
-        Args:
-            query_text (str): The text to search for similar emails
-            top_k (int): Number of similar emails to return (default: 5)
-        
-        Returns:
-            list: List of similar email texts
-        """
-        try:
-            logger.info(f"Querying emails with text: '{query_text[:50]}...' (top_k={top_k})")
-            q_embedding = get_embedding(query_text)
-            results = self.index.query(
-                vector=q_embedding,
-                top_k=top_k,
-                include_metadata=True,
-                namespace=self.namespace
-            )
-            logger.info(f"Found {len(results['matches'])} matching emails")
-            return [result['metadata']['text'] for result in results['matches']]
-        except Exception as e:
-            logger.error(f"Error querying emails: {str(e)}")
-            raise
+def get_vector_store(backend: str = None, tenant: str = None, **kwargs) -> VectorStore:
+    """
+    Create the configured vector store backend.
+
+    Args:
+        backend (str, optional): "pinecone" or "local". Defaults to the VECTOR_BACKEND
+            environment variable, or "pinecone" if unset.
+        tenant (str, optional): User or mailbox whose emails the store holds. With
+            Pinecone the tenant gets its own namespace of the shared index, with the
+            local backend its own index directory; either way searches only scan that
+            tenant's emails. Its lexical index and answer cache are kept apart too.
+            Defaults to None (single-tenant).
+        **kwargs: Passed to the backend constructor. Unless given, lexical_index is
+            opened from LEXICAL_INDEX / LEXICAL_INDEX_PATH (see lexical_index.get_lexical_index)
+            and document_store from DOC_STORE / DOC_STORE_PATH (see doc_store.get_document_store).
+
+    Returns:
+        VectorStore: The vector store. Changes made through it invalidate the answer cache.
+    """
+    backend = (backend or os.getenv("VECTOR_BACKEND", "pinecone")).lower()
+    if "lexical_index" not in kwargs:
+        kwargs["lexical_index"] = get_lexical_index(tenant)
+    if "document_store" not in kwargs:
+        kwargs["document_store"] = get_document_store(tenant)
+    if backend == "pinecone":
+        if tenant is not None:
+            kwargs.setdefault("namespace", validate_tenant(tenant))
+        store = PineconeClient(**kwargs)
+    elif backend == "local":
+        from local_store import LocalVectorStore
+        kwargs.setdefault("path", tenant_path(os.getenv("LOCAL_INDEX_PATH", "local_index"), tenant))
+        kwargs.setdefault("index_type", os.getenv("LOCAL_INDEX_TYPE", "flat"))
+        kwargs.setdefault("nprobe", int(os.getenv("LOCAL_INDEX_NPROBE", "16")))
+        kwargs.setdefault("quantization", os.getenv("LOCAL_INDEX_QUANTIZATION") or None)
+        store = LocalVectorStore(**kwargs)
+    else:
+        raise ValueError(f"Unknown vector store backend: {backend}")
+    answer_cache = get_answer_cache(tenant)
+    if answer_cache:
+        store.add_change_listener(answer_cache.invalidate)
+    return store
 
 # if __name__ == "__main__":
 #     pc = PineconeClient()
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The modules in src/ import each other by bare name, as when run from that directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Importing the modules opens log files, and API clients read their keys; give them what they need offline
+os.environ.setdefault('OPENAI_API_KEY2', 'test')
+os.environ.setdefault('EMBEDDING_CACHE', '0')
+os.environ.setdefault('ANSWER_CACHE', '0')
+os.makedirs('logs', exist_ok=True)
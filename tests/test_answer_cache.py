@@ -0,0 +1,61 @@
+import numpy as np
+from answer_cache import AnswerCache
+
+
+def unit(seed, dimension=32):
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_hit_on_similar_question_and_miss_on_different(tmp_path):
+    cache = AnswerCache(path=str(tmp_path / "answers.sqlite"), threshold=0.9)
+    question = unit(0)
+    cache.store("latest rapido invoice amount", question, "Rs 120", ["m1", "m2"])
+
+    near = question + 0.05 * unit(1)
+    hit = cache.lookup(near)
+    assert hit['answer'] == "Rs 120"
+    assert hit['email_ids'] == ["m1", "m2"]
+    assert cache.lookup(unit(2)) is None
+
+
+def test_invalidated_by_changed_email_across_instances(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    chat = AnswerCache(path=path)
+    chat.store("q1", unit(0), "a1", ["m1"])
+    chat.store("q2", unit(1), "a2", ["m2"])
+
+    # An ingest process sees the same file and drops answers built from m1
+    ingest = AnswerCache(path=path)
+    assert ingest.invalidate(["m1", "m3"]) == 1
+    assert chat.lookup(unit(0)) is None
+    assert chat.lookup(unit(1))['answer'] == "a2"
+
+    ingest.invalidate(None)
+    assert chat.lookup(unit(1)) is None
+
+
+def test_ttl_and_lru_eviction(tmp_path):
+    cache = AnswerCache(path=str(tmp_path / "answers.sqlite"), max_entries=2)
+    for n in range(2):
+        cache.store(f"q{n}", unit(n), f"a{n}", [f"m{n}"])
+    assert cache.lookup(unit(0))['answer'] == "a0"
+    cache.store("q2", unit(2), "a2", ["m2"])
+    # q1 was least recently used
+    assert cache.lookup(unit(1)) is None
+    assert cache.lookup(unit(0))['answer'] == "a0"
+
+    cache.ttl = -1
+    assert cache.lookup(unit(2)) is None
+
+
+def test_hit_requires_the_same_filter(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    cache = AnswerCache(path=path)
+    last_week = {'date': {'$gte': 1719792000, '$lt': 1720396800}}
+    last_month = {'date': {'$gte': 1717200000, '$lt': 1719792000}}
+    cache.store("rapido rides last week", unit(0), "3 rides", ["m1"], filter=last_week)
+    assert cache.lookup(unit(0), filter=last_month) is None
+    assert cache.lookup(unit(0)) is None
+    assert cache.lookup(unit(0), filter={'date': {'$lt': 1720396800, '$gte': 1719792000}})['answer'] == "3 rides"
+    assert AnswerCache(path=path).lookup(unit(0), filter=last_week)['answer'] == "3 rides"
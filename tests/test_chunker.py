@@ -0,0 +1,80 @@
+import pytest
+from chunker import chunk_email, collapse_matches
+from lexical_index import LexicalIndex
+from doc_store import DocumentStore
+from local_store import LocalVectorStore
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # Count words instead of tiktoken tokens, which need the encoding downloaded
+    monkeypatch.setattr("chunker.count_tokens", lambda text: len(text.split()))
+
+
+def paragraphs(count, words=4):
+    return "\n\n".join(" ".join(f"p{n}w{w}" for w in range(words)) for n in range(count))
+
+
+def as_matches(chunks, order=None):
+    return [{'id': chunk['id'], 'score': 1.0 - n / 10, 'metadata': chunk['metadata']}
+            for n, chunk in enumerate(chunks[i] for i in (order or range(len(chunks))))]
+
+
+def test_chunks_split_sections_and_overlap():
+    email = {'id': "m1", 'sender': "Rapido <noreply@rapido.bike>", 'subject': "Ride", 'sender_org': "rapido",
+             'body': paragraphs(5) + "\n--\nRapido team\n\nOn Mon Bob wrote:\n> Where is it?"}
+    chunks = chunk_email(email, max_tokens=8, overlap_tokens=4)
+    assert [chunk['id'] for chunk in chunks] == ["m1#0", "m1#1", "m1#2", "m1#3", "m1#4"]
+    assert [chunk['metadata']['section'] for chunk in chunks] == ["body"] * 4 + ["quote"]
+    assert chunks[0]['text'].startswith("From: Rapido <noreply@rapido.bike>\nSubject: Ride\np0w0")
+    # Each body chunk after the first starts with the previous chunk's last paragraph
+    assert chunks[1]['metadata']['text'].startswith("p1w0 p1w1 p1w2 p1w3\n\np2w0")
+    assert chunks[1]['metadata']['overlap'] == len("p1w0 p1w1 p1w2 p1w3\n\n")
+    assert chunks[4]['metadata']['overlap'] == 0
+    assert "Rapido team" not in " ".join(chunk['text'] for chunk in chunks)
+    assert chunks[0]['metadata']['sender_org'] == "rapido"
+
+
+def test_collapse_keeps_overlapping_text_once():
+    email = {'id': "m1", 'sender': "Bob", 'subject': "Notes", 'body': paragraphs(6)}
+    chunks = chunk_email(email, max_tokens=8, overlap_tokens=4)
+    assert len(chunks) == 5
+
+    # Adjacent chunks are stitched back into the original text, in order, whatever their rank
+    text = collapse_matches(as_matches(chunks, [2, 0, 1]), top_k=1)[0]['metadata']['text']
+    assert text == "From: Bob\nSubject: Notes\nBody: " + paragraphs(4)
+
+    # A gap between matched chunks is marked
+    match = collapse_matches(as_matches(chunks, [4, 0]), top_k=1)[0]
+    assert match['chunks'] == ["m1#4", "m1#0"]
+    assert match['metadata']['text'].endswith("p1w3\n...\np4w0 p4w1 p4w2 p4w3\n\np5w0 p5w1 p5w2 p5w3")
+    assert 'overlap' not in match['metadata'] and 'chunk' not in match['metadata']
+
+
+def test_collapse_groups_by_message_and_keeps_top_k():
+    chunks = [chunk for n in range(3)
+              for chunk in chunk_email({'id': f"m{n}", 'sender': "Bob", 'subject': f"S{n}", 'body': paragraphs(3)},
+                                       max_tokens=8, overlap_tokens=0)]
+    matches = collapse_matches(as_matches(chunks, [2, 0, 3, 4, 1]), top_k=2)
+    assert [(match['id'], match['chunks']) for match in matches] == [("m1", ["m1#0", "m1#1"]), ("m0", ["m0#0", "m0#1"])]
+    assert matches[0]['score'] == 1.0
+
+
+def test_reupsert_with_fewer_chunks_deletes_leftovers(tmp_path, monkeypatch):
+    monkeypatch.setattr("vector_db.batch_by_tokens", lambda chunks, **kwargs: [list(chunks)])
+    monkeypatch.setattr("vector_db.truncate_tokens", lambda text: text)
+    monkeypatch.setattr("vector_db.get_embeddings", lambda texts: [[1.0, float(len(text))] for text in texts])
+    lexical = LexicalIndex(path=str(tmp_path / "lexical.sqlite"))
+    documents = DocumentStore(path=str(tmp_path / "docs.sqlite"))
+    store = LocalVectorStore(path=str(tmp_path / "store"), dimension=2, chunk_tokens=8, chunk_overlap=0,
+                             lexical_index=lexical, document_store=documents)
+
+    email = {'id': "m1", 'sender': "Bob", 'subject': "Notes", 'body': paragraphs(6)}
+    assert store.upsert_emails([email, {'id': "m2", 'sender': "Ann", 'subject': "Hi", 'body': "hello"}]) == 2
+    assert store.get_email_count() == 4
+
+    assert store.upsert_emails([{**email, 'body': paragraphs(2)}]) == 1
+    assert sorted(store._rows) == ["m1#0", "m2#0"]
+    assert sorted(documents.get(["m1#0", "m1#1", "m1#2", "m2#0"])) == ["m1#0", "m2#0"]
+    assert [match['id'] for match in lexical.search("p4w0", top_k=5)] == []
+    assert [match['id'] for match in lexical.search("p0w0", top_k=5)] == ["m1#0"]
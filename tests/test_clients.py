@@ -0,0 +1,108 @@
+import os
+import sys
+import asyncio
+import subprocess
+import clients
+from clients import get_openai_client, reset_clients, set_client
+from vector_db import PineconeClient
+
+
+class FakeAsyncIndex:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class CountingPinecone:
+    def __init__(self):
+        self.list_calls = 0
+        self.created = []
+
+    def list_indexes(self):
+        self.list_calls += 1
+        names = list(self.created)
+        return type('Indexes', (), {'names': lambda self: names})()
+
+    def create_index(self, name, **kwargs):
+        self.created.append(name)
+
+    def Index(self, name):
+        return name
+
+    def describe_index(self, name):
+        return type('Description', (), {'host': name})()
+
+    def IndexAsyncio(self, host):
+        return FakeAsyncIndex()
+
+
+def test_shared_client_built_once_and_replaceable():
+    reset_clients()
+    try:
+        built = []
+        assert clients._shared("fake", lambda: built.append(1) or object()) is clients._shared("fake", object)
+        assert built == [1]
+        fake = object()
+        set_client("openai", fake)
+        assert get_openai_client() is fake
+    finally:
+        reset_clients()
+
+
+def test_async_clients_built_per_event_loop():
+    reset_clients()
+    try:
+        built = []
+
+        async def get_twice():
+            factory = lambda: built.append(1) or object()
+            return clients._shared_async("fake_async", factory), clients._shared_async("fake_async", factory)
+
+        first, again = asyncio.run(get_twice())
+        assert first is again and built == [1]
+        # A new event loop gets its own client
+        assert asyncio.run(get_twice())[0] is not first and built == [1, 1]
+        fake = object()
+        set_client("fake_async", fake)
+        assert asyncio.run(get_twice()) == (fake, fake)
+    finally:
+        reset_clients()
+
+
+def test_async_index_closed_after_its_last_store():
+    pc = CountingPinecone()
+    stores = [PineconeClient(api_key="test-async", index_name="shared", namespace=name, pc=pc)
+              for name in ("alice", "bob")]
+
+    async def run():
+        index, same = [await store._get_async_index() for store in stores]
+        assert index is same
+        await stores[0].aclose()
+        assert not index.closed and await stores[1]._get_async_index() is index
+        await stores[1].aclose()
+        assert index.closed
+        # The next query opens a new client
+        assert await stores[0]._get_async_index() is not index
+        await stores[0].aclose()
+
+    asyncio.run(run())
+
+
+def test_pinecone_index_checked_lazily_and_once():
+    pc = CountingPinecone()
+    first = PineconeClient(api_key="test-lazy", index_name="lazy", pc=pc)
+    second = PineconeClient(api_key="test-lazy", index_name="lazy", pc=pc)
+    assert pc.list_calls == 0
+    assert first.index == "lazy" and second.index == "lazy"
+    assert pc.list_calls == 1 and pc.created == ["lazy"]
+
+
+def test_chat_imports_skip_heavy_sdks():
+    code = ("import sys; import generator; "
+            "print([m for m in ('openai', 'pinecone', 'cohere', 'googleapiclient.discovery') if m in sys.modules])")
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONPATH': src}).stdout
+    assert output.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,38 @@
+from context import ContextBuilder
+
+
+def words(text):
+    return len(text.split())
+
+
+def email(sender, subject, body):
+    return f"From: {sender}\nSubject: {subject}\nBody: {body}"
+
+
+def test_short_emails_are_kept_whole():
+    texts = [email("a@x.com", "Hi", "Lunch at noon."), email("b@y.com", "Re: plan", "Sounds good.")]
+    packed, stats = ContextBuilder(max_tokens=1000, count_tokens=words).build("lunch", texts)
+    assert packed == texts
+    assert stats['packed_emails'] == 2 and stats['duplicates'] == 0
+
+
+def test_near_duplicates_and_quoted_chains_are_dropped():
+    original = email("a@x.com", "Invoice", "Your invoice for March is 245 INR. Pay by Friday.")
+    resent = email("a@x.com", "Invoice", "Your invoice for March is 245 INR. Pay by Friday!")
+    reply = email("b@y.com", "Re: Invoice", "Paid it today.\n\nOn Mon, A <a@x.com> wrote:\n"
+                  "> Your invoice for March is 245 INR. Pay by Friday.")
+    packed, stats = ContextBuilder(max_tokens=1000, count_tokens=words).build("invoice", [original, resent, reply])
+    assert stats['duplicates'] == 1
+    assert packed[0] == original
+    assert packed[1].endswith("Body: Paid it today.")
+
+
+def test_long_email_is_trimmed_to_relevant_sentences():
+    filler = " ".join(f"Newsletter item number {n} about gardening." for n in range(50))
+    text = email("news@shop.com", "Weekly news", f"{filler} Your refund of 120 USD was issued. {filler}")
+    short = email("a@x.com", "Hi", "See you soon.")
+    packed, stats = ContextBuilder(max_tokens=60, count_tokens=words).build("refund amount", [text, short])
+    assert stats['tokens'] <= 60
+    assert packed[1] == short
+    assert "Your refund of 120 USD was issued." in packed[0]
+    assert "..." in packed[0]
@@ -0,0 +1,48 @@
+from doc_store import DocumentStore
+from local_store import LocalVectorStore
+
+
+def test_put_get_delete_and_compact(tmp_path):
+    store = DocumentStore(path=str(tmp_path / "docs.sqlite"), block_bytes=200)
+    store.put([(f"m{n}#0", f"Ride {n} fare ₹{n}45, paid by UPI") for n in range(10)])
+    store.put([("m3#1", "")])
+    assert store.get(["m2#0", "m3#1", "missing"]) == {"m2#0": "Ride 2 fare ₹245, paid by UPI", "m3#1": ""}
+
+    # Replacing and deleting leaves dead bytes that compaction rewrites away
+    store.put([(f"m{n}#0", f"Updated {n}") for n in range(1, 9)])
+    store.delete(["m3", "m9"])
+    assert store.compact() > 0
+    reopened = DocumentStore(path=str(tmp_path / "docs.sqlite"))
+    assert reopened.get([f"m{n}#0" for n in range(10)]) == {
+        "m0#0": "Ride 0 fare ₹045, paid by UPI", **{f"m{n}#0": f"Updated {n}" for n in (1, 2, 4, 5, 6, 7, 8)}}
+    stats = reopened.stats()
+    assert stats['documents'] == 8 and stats['text_bytes'] == len("Ride 0 fare ₹045, paid by UPI".encode()) + 7 * 9
+
+
+def test_texts_fetched_only_for_final_matches(tmp_path, monkeypatch):
+    documents = DocumentStore(path=str(tmp_path / "docs.sqlite"))
+    store = LocalVectorStore(path=str(tmp_path / "store"), dimension=8, document_store=documents)
+    # One chunk per email and one batch, so no tokenizer is needed
+    monkeypatch.setattr("vector_db.chunk_email", lambda email, *args: [{
+        'id': f"{email['id']}#0", 'text': email['body'],
+        'metadata': {'text': email['body'], 'message_id': email['id'], 'chunk': 0, 'section': 'body',
+                     'sender': email['sender'], 'subject': email['subject']}}])
+    monkeypatch.setattr("vector_db.batch_by_tokens", lambda chunks, **kwargs: [list(chunks)])
+    monkeypatch.setattr("vector_db.truncate_tokens", lambda text: text)
+    monkeypatch.setattr("vector_db.get_embeddings", lambda texts: [[float(len(text) % 7), 1.0] + [0.0] * 6
+                                                                   for text in texts])
+    emails = [{'id': f"m{n}", 'sender': "Rapido <noreply@rapido.bike>", 'subject': f"Ride {n}",
+               'body': f"Your ride {n} cost {'9' * n}"} for n in range(6)]
+    assert store.upsert_emails(emails) == 6
+    assert 'text' not in store._fetch_metadata(["m1#0"])["m1#0"]
+
+    fetched = []
+    get = documents.get
+    monkeypatch.setattr(documents, "get", lambda ids: fetched.extend(ids) or get(ids))
+    matches = store.query_matches("ride", top_k=2, query_vector=[2.0, 1.0] + [0.0] * 6)
+    assert len(fetched) == 2 and sorted(fetched) == sorted(chunk for match in matches for chunk in match['chunks'])
+    assert matches[0]['metadata']['text'].endswith(f"Body: Your ride {matches[0]['id'][1:]} cost "
+                                                   f"{'9' * int(matches[0]['id'][1:])}")
+
+    store.delete_email("m1")
+    assert documents.get(["m1#0"]) == {}
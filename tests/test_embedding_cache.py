@@ -0,0 +1,46 @@
+from embedding_cache import EmbeddingCache
+
+
+def test_replaced_keys_are_counted_once(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(path=path, max_bytes=3 * 16, memory_entries=2)
+    cache.put_many({"a": [0.1] * 4, "b": [0.2] * 4})
+    cache.put_many({"a": [0.3] * 4})
+    cache.put_many({"a": [0.4] * 4, "b": [0.5] * 4})
+    assert cache.stats()['disk_bytes'] == 2 * 16
+    assert EmbeddingCache(path=path).stats()['disk_bytes'] == 2 * 16
+
+
+
+def test_memory_hits_before_disk_hits(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    EmbeddingCache(path=path).put_many({"a": [0.5] * 4, "b": [0.25] * 4})
+    cache = EmbeddingCache(path=path)
+    assert cache.get_many(["a", "b", "c"]) == {"a": [0.5] * 4, "b": [0.25] * 4}
+    assert cache.get_many(["a", "b"]) == {"a": [0.5] * 4, "b": [0.25] * 4}
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (2, 2, 1)
+
+
+def test_memory_keeps_the_most_recently_used(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"), memory_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.get_many(["a"])
+    cache.put_many({"c": [3.0]})
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0], "b": [2.0], "c": [3.0]}
+    assert (cache.memory_hits, cache.disk_hits) == (3, 1)
+
+
+def test_disk_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("embedding_cache.time.time", lambda: next(clock))
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite"), max_bytes=4 * 16, memory_entries=1)
+    for key in "abcd":
+        cache.put_many({key: [0.0] * 4})
+    # Read from disk, so it becomes the most recently used row
+    cache.get_many(["a"])
+    cache.put_many({"e": [0.0] * 4})
+    # Back under 90% of max_bytes by dropping only the two oldest rows
+    keys = [row[0] for row in cache._conn.execute("SELECT key FROM embeddings ORDER BY key")]
+    assert keys == ["a", "d", "e"] and cache.stats()['disk_bytes'] == 3 * 16
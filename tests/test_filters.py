@@ -0,0 +1,40 @@
+from datetime import datetime
+from filters import matches_filter, parse_query_filters, sender_fields
+
+NOW = datetime(2024, 7, 15, 10, 30)
+
+
+def ts(*args):
+    return int(datetime(*args).timestamp())
+
+
+def test_sender_fields():
+    assert sender_fields("Amazon <auto-confirm@amazon.in>") == {'sender_domain': "amazon.in", 'sender_org': "amazon"}
+    assert sender_fields("orders@amazon.co.uk")['sender_org'] == "amazon"
+    assert sender_fields("Unknown Sender") == {}
+
+
+def test_parse_sender_and_date():
+    assert parse_query_filters("Orders from Amazon last month", now=NOW) == {'$and': [
+        {'sender_org': {'$eq': "amazon"}},
+        {'date': {'$gte': ts(2024, 6, 1), '$lt': ts(2024, 7, 1)}},
+    ]}
+    assert parse_query_filters("mails from noreply@rapido.bike", now=NOW) == {'sender_domain': {'$eq': "rapido.bike"}}
+    assert parse_query_filters("anything from github.com in March", now=NOW) == {'$and': [
+        {'sender_domain': {'$eq': "github.com"}},
+        {'date': {'$gte': ts(2024, 3, 1), '$lt': ts(2024, 4, 1)}},
+    ]}
+    assert parse_query_filters("receipts from the past 2 weeks", now=NOW) == {'date': {'$gte': ts(2024, 7, 1, 10, 30)}}
+    assert parse_query_filters("unread mails from yesterday", now=NOW) == {'$and': [
+        {'date': {'$gte': ts(2024, 7, 14), '$lt': ts(2024, 7, 15)}},
+        {'labels': {'$in': ["UNREAD"]}},
+    ]}
+    assert parse_query_filters("latest rapido invoice amount", now=NOW) is None
+
+
+def test_matches_filter():
+    metadata = {'sender_org': "amazon", 'date': ts(2024, 6, 10), 'labels': ["INBOX", "UNREAD"]}
+    assert matches_filter(metadata, parse_query_filters("unread Amazon mails from amazon last month", now=NOW))
+    assert not matches_filter(metadata, parse_query_filters("from swiggy", now=NOW))
+    assert matches_filter(metadata, {'$or': [{'sender_org': "swiggy"}, {'labels': {'$nin': ["SPAM"]}}]})
+    assert not matches_filter(metadata, {'date': {'$gt': ts(2024, 7, 1)}})
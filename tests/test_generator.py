@@ -0,0 +1,95 @@
+import os
+import sys
+import asyncio
+import pytest
+from clients import reset_clients, set_client
+from utils import set_encoding
+from generator import Generator
+from reranker import CohereReranker
+from context import get_context_builder
+from lexical_index import LexicalIndex
+from doc_store import DocumentStore
+from local_store import LocalVectorStore
+
+# The offline fakes live with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from fakes import FakeOpenAI, FakeAsyncOpenAI, FakeCohere, FakeAsyncCohere, FakeEncoding
+
+EMAILS = [
+    {'id': "m1", 'sender': "Rapido <noreply@rapido.bike>", 'sender_org': "rapido", 'subject': "Your ride",
+     'body': "Your ride from MG Road to the airport cost 420 rupees."},
+    {'id': "m2", 'sender': "HDFC Bank <alerts@hdfcbank.net>", 'sender_org': "hdfcbank", 'subject': "Debit alert",
+     'body': "Rs 420 was debited from your account ending 1234."},
+    {'id': "m3", 'sender': "Ann <ann@example.com>", 'sender_org': "example", 'subject': "Dinner",
+     'body': "Dinner on Friday at eight? The table is booked."},
+]
+
+
+@pytest.fixture
+def generator(tmp_path):
+    # No network: tiktoken, OpenAI and Cohere are all replaced by the benchmark fakes
+    set_encoding(FakeEncoding())
+    set_client("openai", FakeOpenAI(latency=0, dimension=32))
+    set_client("async_openai", FakeAsyncOpenAI(latency=0, dimension=32))
+    try:
+        store = LocalVectorStore(path=str(tmp_path / "store"), dimension=32,
+                                 lexical_index=LexicalIndex(path=str(tmp_path / "lexical.sqlite")),
+                                 document_store=DocumentStore(path=str(tmp_path / "docs.sqlite")))
+        store.upsert_emails(EMAILS)
+        generator = Generator.__new__(Generator)
+        generator.client = FakeOpenAI(completion_latency=0, first_token_latency=0)
+        generator.async_client = FakeAsyncOpenAI(completion_latency=0, first_token_latency=0)
+        generator.reranker = CohereReranker(client=FakeCohere(latency=0), async_client=FakeAsyncCohere(latency=0))
+        generator.context_builder = get_context_builder()
+        generator.top_k = 2
+        generator.pc = store
+        generator.answer_cache = None
+        yield generator
+    finally:
+        set_encoding(None)
+        reset_clients()
+
+
+def test_filter_resolved_once_per_question(generator, monkeypatch):
+    resolved = []
+    resolve_filter = generator.pc.resolve_filter
+    monkeypatch.setattr(generator.pc, "resolve_filter", lambda filter: resolved.append(filter) or resolve_filter(filter))
+
+    generator.generate_answer("How much was my ride from rapido?")
+    assert len(resolved) == 1
+    asyncio.run(generator.agenerate_answer("How much was my ride from rapido?"))
+    assert len(resolved) == 2
+
+
+def run_both(generator, question, stream):
+    """Answer a question on the sync and the async path; returns (answer, email IDs) of each."""
+    # The IDs of the retrieved emails are handed to the answer cache once the answer is complete
+    sources = []
+    generator._cache_answer = lambda question, embedding, filter, answer, email_ids: sources.append(email_ids)
+
+    answer = generator.generate_answer(question, stream=stream)
+    if stream:
+        answer = "".join(answer)
+
+    async def answer_async():
+        answer = await generator.agenerate_answer(question, stream=stream)
+        if stream:
+            answer = "".join([token async for token in answer])
+        return answer
+
+    return (answer, sources[0]), (asyncio.run(answer_async()), sources[1])
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_async_path_matches_sync_path(generator, stream):
+    sync_result, async_result = run_both(generator, "How much did the ride to the airport cost?", stream)
+    assert async_result == sync_result
+    answer, email_ids = sync_result
+    assert answer.startswith("Answer based on") and email_ids
+    assert set(email_ids) <= {"m1", "m2", "m3"}
+
+
+def test_async_path_matches_sync_path_with_a_filter(generator):
+    sync_result, async_result = run_both(generator, "What did I get from hdfc?", stream=False)
+    assert async_result == sync_result
+    assert sync_result[1] == ["m2"]
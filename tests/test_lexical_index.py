@@ -0,0 +1,89 @@
+import numpy as np
+from lexical_index import LexicalIndex, encode_postings, decode_postings, reciprocal_rank_fusion, tokenize
+from local_store import LocalVectorStore
+
+
+def chunk(message_id, n, text):
+    return (f"{message_id}#{n}", text, {'text': text, 'message_id': message_id, 'chunk': n,
+                                        'section': 'body', 'sender': 'Rapido <noreply@rapido.bike>',
+                                        'subject': 'Your ride'})
+
+
+def test_postings_roundtrip():
+    postings = [(1, 3), (2, 1), (130, 200), (100000, 1)]
+    docnos, tfs = decode_postings(encode_postings(postings))
+    assert list(zip(docnos.tolist(), tfs.tolist())) == postings
+    assert "403-1234567-7654321" in tokenize("Order #403-1234567-7654321 shipped")
+
+
+def test_exact_match_delete_and_compact(tmp_path):
+    index = LexicalIndex(path=str(tmp_path / "lexical.sqlite"))
+    index.add([chunk("m1", 0, "Your invoice INV-2024-0042 for the ride"),
+               chunk("m2", 0, "Weekly newsletter about rides and invoices")])
+    index.add([chunk("m3", 0, "Order 403-1234567-7654321 has shipped"),
+               chunk("m3", 1, "Invoice INV-2024-0099 attached")])
+
+    assert index.search("inv-2024-0042", top_k=2)[0]['id'] == "m1#0"
+    assert index.search("403-1234567-7654321", top_k=1)[0]['metadata']['message_id'] == "m3"
+
+    # Re-indexing a chunk replaces it, deleting a message drops all of its chunks
+    index.add([chunk("m1", 0, "Payment received")])
+    assert [m['id'] for m in index.search("inv-2024-0042", top_k=2)] == ["m3#1"]
+    index.delete(["m3"])
+    assert index.search("invoice shipped", top_k=5) == []
+
+    assert index.compact() > 0
+    reopened = LexicalIndex(path=str(tmp_path / "lexical.sqlite"))
+    assert [m['id'] for m in reopened.search("payment", top_k=5)] == ["m1#0"]
+    assert [m['id'] for m in reopened.search("newsletter", top_k=5)] == ["m2#0"]
+
+
+def test_reciprocal_rank_fusion():
+    vector = [{'id': "a", 'score': 0.9, 'metadata': {}}, {'id': "b", 'score': 0.8, 'metadata': {}}]
+    lexical = [{'id': "b", 'score': 12.0, 'metadata': {}}, {'id': "c", 'score': 3.0, 'metadata': {}}]
+    assert [m['id'] for m in reciprocal_rank_fusion([vector, lexical])] == ["b", "a", "c"]
+
+
+def test_hybrid_query_finds_exact_identifier(tmp_path):
+    index = LexicalIndex(path=str(tmp_path / "lexical.sqlite"))
+    store = LocalVectorStore(path=str(tmp_path / "store"), dimension=8, lexical_index=index)
+    rng = np.random.default_rng(0)
+    chunks = [chunk(f"m{n}", 0, f"Ride receipt number RR-{n:04d}") for n in range(20)]
+    vectors = rng.standard_normal((20, 8)).astype(np.float32)
+    store._upsert_vectors([(chunk_id, vectors[n], metadata) for n, (chunk_id, _, metadata) in enumerate(chunks)])
+    index.add(chunks)
+
+    # The query vector is unrelated to m17, but the receipt number names it
+    def rank_of_m17(matches):
+        return [m['id'] for m in matches].index("m17")
+
+    vector_only = store._query_vectors(vectors[0], top_k=20)
+    hybrid = store.query_matches("receipt RR-0017", top_k=20, query_vector=vectors[0])
+    assert rank_of_m17(hybrid) < rank_of_m17([{'id': m['id'].split("#")[0]} for m in vector_only])
+
+    store.delete_email("m17")
+    assert "m17#0" not in [m['id'] for m in index.search("rr-0017", top_k=20)]
+
+
+def test_filter_applied_before_ranking(tmp_path):
+    path = str(tmp_path / "lexical.sqlite")
+    index = LexicalIndex(path=path)
+    # Every tenth chunk is from HDFC, and none of them ranks in the unfiltered top 5
+    index.add([(f"m{n}#0", "invoice " * (1 if n % 10 == 0 else 3) + "total",
+                {'sender_org': "hdfcbank" if n % 10 == 0 else "amazon", 'date': 1700000000 + n})
+               for n in range(200)])
+    assert all(m['metadata']['sender_org'] == "amazon" for m in index.search("invoice", top_k=5))
+    matches = index.search("invoice", top_k=5, filter={'sender_org': {'$eq': "hdfcbank"}})
+    assert len(matches) == 5 and all(m['metadata']['sender_org'] == "hdfcbank" for m in matches)
+    matches = index.search("invoice", top_k=10, filter={'$and': [{'sender_org': "hdfcbank"},
+                                                                {'date': {'$gte': 1700000150}}]})
+    assert {m['id'] for m in matches} == {"m150#0", "m160#0", "m170#0", "m180#0", "m190#0"}
+    assert index.field_values('sender_org', "hdfc") == ["hdfcbank"]
+
+    # Indexes written before doc_fields existed are backfilled on open
+    index.delete(["m10"])
+    index._conn.execute("DROP TABLE doc_fields")
+    index._conn.commit()
+    reopened = LexicalIndex(path=path)
+    assert {m['id'] for m in reopened.search("total", top_k=50, filter={'sender_org': "hdfcbank"})} == \
+        {f"m{n}#0" for n in range(0, 200, 10)} - {"m10#0"}
@@ -0,0 +1,118 @@
+import numpy as np
+from local_store import LocalVectorStore
+
+
+def clustered_vectors(count, dimension=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, dimension), dtype=np.float32)
+    vectors = centers[rng.integers(0, 20, count)] + 0.3 * rng.standard_normal((count, dimension), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill(store, vectors):
+    store._upsert_vectors([(f"id{i}", vectors[i], {"text": f"email {i}"}) for i in range(len(vectors))])
+
+
+def test_exact_search_delete_and_reopen(tmp_path):
+    vectors = clustered_vectors(200)
+    store = LocalVectorStore(path=str(tmp_path), dimension=32)
+    fill(store, vectors)
+
+    matches = store._query_vectors(vectors[7], top_k=3)
+    assert matches[0]['id'] == "id7"
+    assert matches[0]['metadata'] == {"text": "email 7"}
+    assert abs(matches[0]['score'] - 1.0) < 1e-5
+
+    store.delete_email("id7")
+    assert store.get_email_count() == 199
+    assert "id7" not in [m['id'] for m in store._query_vectors(vectors[7], top_k=3)]
+
+    # The freed row is reused and everything survives a reopen
+    store._upsert_vectors([("new", vectors[7], {"text": "new"})])
+    reopened = LocalVectorStore(path=str(tmp_path), dimension=32)
+    assert reopened.get_email_count() == 200
+    assert reopened._query_vectors(vectors[7], top_k=1)[0]['id'] == "new"
+
+
+def test_ivf_matches_exact_search(tmp_path):
+    vectors = clustered_vectors(2000)
+    exact = LocalVectorStore(path=str(tmp_path / "flat"), dimension=32)
+    fill(exact, vectors)
+    for quantization in (None, "int8", "pq"):
+        store = LocalVectorStore(path=str(tmp_path / str(quantization)), dimension=32, index_type="ivf",
+                                 nlist=16, quantization=quantization, pq_m=8, ivf_min_size=1000)
+        fill(store, vectors)
+        assert store._ivf.trained
+
+        hits = 0
+        for i in range(0, 2000, 100):
+            expected = [m['id'] for m in exact._query_vectors(vectors[i], top_k=5)]
+            found = [m['id'] for m in store._query_vectors(vectors[i], top_k=5, nprobe=16)]
+            hits += len(set(expected) & set(found))
+        assert hits / (20 * 5) >= 0.9
+
+        store.delete_email("id0")
+        assert "id0" not in [m['id'] for m in store._query_vectors(vectors[0], top_k=5, nprobe=16)]
+
+    # The trained index is saved on flush and picked up again on open
+    store.flush()
+    reopened = LocalVectorStore(path=str(tmp_path / "pq"), dimension=32, index_type="ivf",
+                                nlist=16, quantization="pq", pq_m=8, ivf_min_size=1000)
+    assert reopened._ivf.trained
+    assert reopened._query_vectors(vectors[100], top_k=1, nprobe=16)[0]['id'] == "id100"
+
+
+def test_filtered_search(tmp_path):
+    vectors = clustered_vectors(300)
+    store = LocalVectorStore(path=str(tmp_path), dimension=32)
+    store._upsert_vectors([(f"id{i}", vectors[i], {"text": f"email {i}", "sender_org": ["amazon", "swiggy"][i % 2],
+                                                   "date": 1700000000 + i, "labels": ["INBOX"] + ["UNREAD"] * (i % 3 == 0)})
+                           for i in range(len(vectors))])
+
+    matches = store._query_vectors(vectors[7], top_k=5, filter={"sender_org": "swiggy", "date": {"$lt": 1700000100}})
+    assert matches[0]['id'] == "id7"
+    assert all(m['metadata']['sender_org'] == "swiggy" and m['metadata']['date'] < 1700000100 for m in matches)
+
+    # The best match is excluded when it fails the filter
+    matches = store._query_vectors(vectors[7], top_k=5, filter={"$or": [{"labels": "UNREAD"}, {"sender_org": "amazon"}]})
+    assert "id7" not in [m['id'] for m in matches]
+    assert all(int(m['id'][2:]) % 2 == 0 or int(m['id'][2:]) % 3 == 0 for m in matches)
+
+    assert store._query_vectors(vectors[7], top_k=5, filter={"sender_org": "zomato"}) == []
+    store.delete_email("id7")
+    assert "id7" not in [m['id'] for m in store._query_vectors(vectors[7], top_k=5, filter={"sender_org": "swiggy"})]
+
+
+def test_sender_names_resolve_to_stored_orgs(tmp_path):
+    store = LocalVectorStore(path=str(tmp_path), dimension=4)
+    store._upsert_vectors([(f"id{i}", [1.0, i, 0.0, 0.0], {"sender_org": org})
+                           for i, org in enumerate(["hdfcbank", "amazon", "amazonpay", "swiggy"])])
+    date = {'date': {'$gte': 1700000000}}
+    assert store.resolve_filter({'sender_org': {'$eq': "hdfc"}}) == {'sender_org': {'$in': ["hdfcbank"]}}
+    assert store.resolve_filter({'$and': [{'sender_org': {'$eq': "amazon"}}, date]}) == \
+        {'$and': [{'sender_org': {'$eq': "amazon"}}, date]}
+    assert store.resolve_filter({'sender_org': {'$eq': "amaz"}}) == {'sender_org': {'$in': ["amazon", "amazonpay"]}}
+    # A sender nothing was received from is dropped rather than filtering everything out
+    assert store.resolve_filter({'$and': [{'sender_org': {'$eq': "zomato"}}, date]}) == date
+    assert store.resolve_filter({'sender_org': {'$eq': "zomato"}}) is None
+
+
+def test_int8_flat_search_rescores_exactly(tmp_path):
+    vectors = clustered_vectors(500)
+    exact = LocalVectorStore(path=str(tmp_path / "exact"), dimension=32)
+    fill(exact, vectors)
+    store = LocalVectorStore(path=str(tmp_path / "int8"), dimension=32, quantization="int8")
+    fill(store, vectors)
+    for i in range(0, 500, 50):
+        expected = exact._query_vectors(vectors[i], top_k=5)
+        found = store._query_vectors(vectors[i], top_k=5)
+        assert [m['id'] for m in found] == [m['id'] for m in expected]
+        assert np.allclose([m['score'] for m in found], [m['score'] for m in expected], atol=1e-6)
+    # Filtered searches pass candidate rows
+    rows = np.arange(0, 500, 2)
+    query = vectors[3] / np.linalg.norm(vectors[3])
+    assert store._exact_search(query, 3, rows)[0].tolist() == exact._exact_search(query, 3, rows)[0].tolist()
+
+    # Turning quantization on for an existing store encodes its vectors
+    reopened = LocalVectorStore(path=str(tmp_path / "exact"), dimension=32, quantization="int8")
+    assert reopened._query_vectors(vectors[42], top_k=1)[0]['id'] == "id42"
@@ -0,0 +1,77 @@
+import os
+import sys
+import socket
+import base64
+from types import SimpleNamespace
+from googleapiclient.errors import HttpError
+from mail import MailClient
+
+
+def message(msg_id):
+    data = base64.urlsafe_b64encode(f"Body of {msg_id}".encode()).decode()
+    return {"id": msg_id, "threadId": msg_id, "labelIds": ["INBOX"], "internalDate": "1700000000000",
+            "payload": {"mimeType": "text/plain", "headers": [{"name": "Subject", "value": "Hi"}],
+                        "body": {"data": data}}}
+
+
+class FlakyGmail:
+    """Gmail service whose batch requests raise the queued errors before succeeding."""
+
+    def __init__(self, errors):
+        self.errors = errors
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id):
+        return SimpleNamespace(execute=lambda: message(id), msg_id=id)
+
+    def new_batch_http_request(self, callback):
+        requests = []
+        service = self
+
+        class Batch:
+            def add(self, request, request_id):
+                requests.append(request_id)
+
+            def execute(self):
+                if service.errors:
+                    raise service.errors.pop(0)
+                for request_id in requests:
+                    callback(request_id, message(request_id), None)
+
+        return Batch()
+
+
+def client(errors):
+    mail = MailClient(service=FlakyGmail(errors), parallelism=2, batch_size=2, max_retries=2, parse_processes=0)
+    mail.BACKOFF_BASE = 0
+    return mail
+
+
+def test_transient_batch_errors_are_retried():
+    mail = client([socket.timeout("timed out"), ConnectionResetError("reset")])
+    assert [email["id"] for email in mail.fetch_emails(["a", "b"])] == ["a", "b"]
+
+
+def test_failed_batches_are_skipped_not_raised():
+    forbidden = HttpError(SimpleNamespace(status=403, reason="Forbidden"), b"denied")
+    mail = client([forbidden])
+    emails = mail.fetch_emails(["a", "b", "c", "d"])
+    # One batch of two is lost, the other still comes through
+    assert len(emails) == 2
+    mail = client([socket.timeout("timed out")] * 3)
+    assert mail.fetch_emails(["a", "b"]) == []
+
+
+def test_iter_emails_streams_every_listed_message():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+    from fakes import FakeGmailService
+    mail = MailClient(service=FakeGmailService(num_messages=1203, latency=0), parallelism=4, batch_size=50,
+                      parse_processes=0)
+    ids = [email["id"] for email in mail.iter_emails()]
+    # Three listing pages of at most 500, fetched in batches that finish in any order
+    assert sorted(ids) == [f"{n:016x}" for n in range(1203)]
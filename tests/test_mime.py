@@ -0,0 +1,51 @@
+import base64
+from mail import MailClient
+from mime import extract_body, html_to_text, parse_messages
+
+
+def part(mime_type, text, charset="utf-8", **extra):
+    data = base64.urlsafe_b64encode(text.encode(charset)).decode("ascii").rstrip("=")
+    headers = [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}]
+    return {"mimeType": mime_type, "headers": headers, "body": {"data": data}, **extra}
+
+
+def message(msg_id, payload):
+    payload = {**payload, "headers": payload.get("headers", []) + [
+        {"name": "From", "value": "Rapido <noreply@rapido.bike>"}, {"name": "Subject", "value": "Your ride"}]}
+    return {"id": msg_id, "threadId": "t1", "labelIds": ["INBOX"], "internalDate": "1700000000000",
+            "payload": payload}
+
+
+def test_html_to_text_keeps_visible_text_and_structure():
+    html = ("<html><head><title>x</title><style>p {color: red}</style></head><body>"
+            "<p>Fare: &#8377;245 &amp; tip</p><ul><li>Pickup</li><li>Drop</li></ul>"
+            "<script>track()</script><blockquote>On Mon, Asha wrote:<br>earlier</blockquote></body></html>")
+    assert html_to_text(html).split("\n") == [
+        "Fare: ₹245 & tip", "", "- Pickup", "- Drop", "", "> On Mon, Asha wrote:", "> earlier", ""]
+
+
+def test_extract_body_walks_nested_multiparts():
+    alternative = {"mimeType": "multipart/alternative",
+                   "parts": [part("text/plain", ""), part("text/html", "<div>Only&nbsp;in HTML</div>")]}
+    attachment = {"mimeType": "application/pdf", "filename": "invoice.pdf", "body": {"attachmentId": "a1"}}
+    note = part("text/plain", "Café receipt\r\n\r\n\r\n\r\nThanks\u00ad  ", charset="iso-8859-1")
+    payload = {"mimeType": "multipart/mixed", "parts": [alternative, attachment, note]}
+    assert extract_body(payload) == "Only in HTML\n\nCafé receipt\n\nThanks"
+
+
+def test_parse_messages_reports_skipped():
+    parsed, skipped = parse_messages([message("m1", part("text/plain", "Paid 245")),
+                                      message("m2", {"mimeType": "multipart/mixed", "parts": []})])
+    assert [fields[0] for fields in parsed] == ["m1"]
+    assert skipped == [("m2", "no body content")]
+
+
+def test_mail_client_parses_in_worker_processes():
+    bodies = {f"m{n}": part("text/html", f"<p>Ride {n} fare</p>") for n in range(7)}
+    client = MailClient(service=object(), parallelism=2, batch_size=3, parse_processes=2)
+    client._traced_fetch_batch = lambda msg_ids: {msg_id: message(msg_id, bodies[msg_id]) for msg_id in msg_ids}
+    emails = client.fetch_emails(list(bodies))
+    assert [email["id"] for email in emails] == list(bodies)
+    assert emails[3]["body"] == "Ride 3 fare"
+    assert emails[3]["text"] == "From: Rapido <noreply@rapido.bike>\nSubject: Your ride\nBody: Ride 3 fare"
+    assert emails[3]["date"] == 1700000000
@@ -0,0 +1,46 @@
+import pytest
+from reranker import LocalReranker, NoReranker, Reranker, get_reranker
+
+
+class CountingReranker(Reranker):
+    calls = 0
+
+    def _rerank(self, query, documents, scores):
+        self.calls += 1
+        return list(reversed(range(len(documents))))[:self.top_n]
+
+
+def test_rerank_skipped_at_or_below_top_n():
+    reranker = CountingReranker(top_n=3)
+    assert reranker.rerank("question", ["a", "b", "c"]) == [0, 1, 2]
+    assert reranker.calls == 0
+    assert reranker.rerank("question", ["a", "b", "c", "d"]) == [3, 2, 1]
+    assert reranker.calls == 1
+
+
+def test_local_reranker_promotes_lexical_match():
+    documents = [
+        "Your weekly newsletter with product updates",
+        "Team lunch is moved to Friday",
+        "Rapido invoice: ride fare 245 INR paid",
+        "Security alert for your account",
+    ]
+    # Retrieval ranked the invoice third; the question names it
+    order = LocalReranker(top_n=2).rerank("latest rapido invoice amount", documents, [0.9, 0.85, 0.8, 0.7])
+    assert order[0] == 2
+    assert len(order) == 2
+
+
+def test_local_reranker_keeps_retrieval_order_without_query_terms():
+    documents = ["first", "second", "third"]
+    assert LocalReranker(top_n=2).rerank("zzz", documents) == [0, 1]
+    assert NoReranker(top_n=2).rerank("zzz", documents) == [0, 1]
+
+
+def test_get_reranker(monkeypatch):
+    monkeypatch.setenv("RERANKER", "none")
+    monkeypatch.setenv("RERANK_TOP_N", "4")
+    reranker = get_reranker()
+    assert isinstance(reranker, NoReranker) and reranker.top_n == 4
+    with pytest.raises(ValueError):
+        get_reranker("unknown")
@@ -0,0 +1,170 @@
+import pytest
+from types import SimpleNamespace
+from googleapiclient.errors import HttpError
+from sync import SyncState, sync_emails
+
+
+class FakeMailbox:
+    """Mail client over an in-memory mailbox with a change history."""
+
+    def __init__(self, texts):
+        self.texts = dict(texts)
+        self.history = []        # (history id, added ids, deleted ids)
+        self.expired_before = 0
+        self.fetched = []
+        self.unavailable = set()
+
+    def change(self, added=(), deleted=(), **texts):
+        self.texts.update(texts)
+        for msg_id in deleted:
+            self.texts.pop(msg_id)
+        self.history.append((len(self.history) + 1, set(added) | set(texts), set(deleted)))
+
+    def get_history_id(self):
+        return str(len(self.history))
+
+    def get_history(self, start_history_id, label_id=None):
+        if int(start_history_id) < self.expired_before:
+            raise HttpError(SimpleNamespace(status=404, reason="Not Found"), b"expired")
+        added, deleted = set(), set()
+        for history_id, record_added, record_deleted in self.history:
+            if history_id > int(start_history_id):
+                added = (added | record_added) - record_deleted
+                deleted = (deleted | record_deleted) - record_added
+        return added, deleted, self.get_history_id()
+
+    def list_message_ids(self, query):
+        return sorted(self.texts)
+
+    def iter_message_id_pages(self, query):
+        ids = self.list_message_ids(query)
+        for i in range(0, len(ids), 2):
+            yield ids[i:i + 2]
+
+    def iter_fetch_emails(self, msg_ids):
+        for msg_id in msg_ids:
+            self.fetched.append(msg_id)
+            # Like MailClient, a message that fails to fetch is left out
+            if msg_id not in self.unavailable:
+                yield {'id': msg_id, 'text': self.texts[msg_id]}
+
+
+class FakeStore:
+    """Vector store that upserts in batches of two and records what it was asked to do."""
+
+    def __init__(self):
+        self.emails = {}
+        self.deleted = []
+        self.fail_after = None
+        self.fail_delete = set()
+        self.replace = []
+
+    def upsert_emails(self, emails, on_upserted=None, replace=True):
+        self.replace.append(replace)
+        batch, count = [], 0
+        for email in emails:
+            batch.append(email)
+            if len(batch) == 2:
+                count += self._write(batch, on_upserted)
+                batch = []
+        return count + (self._write(batch, on_upserted) if batch else 0)
+
+    def _write(self, batch, on_upserted):
+        if self.fail_after is not None and len(self.emails) >= self.fail_after:
+            raise RuntimeError("crashed")
+        self.emails.update((email['id'], email['text']) for email in batch)
+        on_upserted(batch)
+        return len(batch)
+
+    def delete_email(self, msg_id):
+        if msg_id in self.fail_delete:
+            raise RuntimeError("delete failed")
+        self.deleted.append(msg_id)
+        self.emails.pop(msg_id, None)
+
+    def flush(self):
+        pass
+
+
+def test_incremental_add_change_delete(tmp_path):
+    path = str(tmp_path / "state.json")
+    mailbox, store = FakeMailbox({"a": "one", "b": "two", "c": "three"}), FakeStore()
+    assert sync_emails(mailbox, store, state_path=path)['upserted'] == 3
+
+    mailbox.change(added=["d"], deleted=["c"], d="four", b="two, edited")
+    mailbox.fetched = []
+    counts = sync_emails(mailbox, store, state_path=path)
+    assert counts == {'fetched': 2, 'upserted': 2, 'unchanged': 0, 'deleted': 1}
+    assert sorted(mailbox.fetched) == ["b", "d"]
+    # The edited email is replaced by the upsert, only the removed one is deleted
+    assert store.replace == [False, True]
+    assert store.deleted == ["c"] and store.emails == {"a": "one", "b": "two, edited", "d": "four"}
+    state = SyncState(path)
+    assert state.history_id == "1" and sorted(state.hashes) == ["a", "b", "d"]
+
+    # Nothing changed: nothing fetched
+    mailbox.fetched = []
+    assert sync_emails(mailbox, store, state_path=path)['fetched'] == 0
+
+
+def test_expired_history_falls_back_to_listing(tmp_path):
+    path = str(tmp_path / "state.json")
+    mailbox, store = FakeMailbox({"a": "one", "b": "two"}), FakeStore()
+    sync_emails(mailbox, store, state_path=path)
+    mailbox.change(added=["c"], deleted=["a"], c="three")
+    mailbox.expired_before = 5
+    mailbox.fetched = []
+    counts = sync_emails(mailbox, store, state_path=path)
+    assert mailbox.fetched == ["c"] and counts['deleted'] == 1
+    assert sorted(store.emails) == ["b", "c"]
+
+
+def test_interrupted_sync_keeps_its_progress(tmp_path):
+    path = str(tmp_path / "state.json")
+    mailbox, store = FakeMailbox({f"m{n}": f"text {n}" for n in range(5)}), FakeStore()
+    store.fail_after = 2
+    with pytest.raises(RuntimeError):
+        sync_emails(mailbox, store, state_path=path)
+    assert sorted(SyncState(path).hashes) == ["m0", "m1"]
+
+    # The next run only embeds what the crashed one did not get to
+    store.fail_after = None
+    mailbox.fetched = []
+    counts = sync_emails(mailbox, store, state_path=path)
+    assert counts['upserted'] == 3 and sorted(store.emails) == [f"m{n}" for n in range(5)]
+
+
+def test_failed_delete_is_retried(tmp_path):
+    path = str(tmp_path / "state.json")
+    mailbox, store = FakeMailbox({"a": "one", "b": "two"}), FakeStore()
+    sync_emails(mailbox, store, state_path=path)
+    mailbox.change(deleted=["a"])
+    store.fail_delete = {"a"}
+    assert sync_emails(mailbox, store, state_path=path)['deleted'] == 0
+    assert SyncState(path).history_id == "0"
+
+    store.fail_delete = set()
+    assert sync_emails(mailbox, store, state_path=path)['deleted'] == 1
+    assert sorted(SyncState(path).hashes) == ["b"]
+
+
+def test_failed_fetch_is_retried(tmp_path):
+    path = str(tmp_path / "state.json")
+    mailbox, store = FakeMailbox({"a": "one", "b": "two"}), FakeStore()
+    mailbox.unavailable = {"b"}
+    sync_emails(mailbox, store, state_path=path)
+    assert sorted(store.emails) == ["a"] and SyncState(path).pending == ["b"]
+
+    mailbox.change(added=["c", "d"], c="three", d="four")
+    mailbox.unavailable = {"d"}
+    counts = sync_emails(mailbox, store, state_path=path)
+    assert counts == {'fetched': 2, 'upserted': 2, 'unchanged': 0, 'deleted': 0}
+    assert SyncState(path).pending == ["d"]
+
+    # The next incremental sync asks for it again even though history has nothing new
+    mailbox.unavailable = set()
+    mailbox.fetched = []
+    assert sync_emails(mailbox, store, state_path=path)['upserted'] == 1
+    assert mailbox.fetched == ["d"] and sorted(store.emails) == ["a", "b", "c", "d"]
+    state = SyncState(path)
+    assert state.pending == [] and state.history_id == "1"
@@ -0,0 +1,61 @@
+import os
+import time
+import pytest
+from ratelimit import RateLimiter
+from tenants import tenant_path, validate_tenant
+from vector_db import PineconeClient
+
+
+class RecordingIndex:
+    def __init__(self):
+        self.calls = []
+
+    def upsert(self, vectors, namespace=""):
+        self.calls.append(("upsert", namespace, [vector_id for vector_id, _, _ in vectors]))
+
+    def delete(self, ids=None, delete_all=False, namespace=""):
+        self.calls.append(("delete", namespace, delete_all))
+
+    def describe_index_stats(self):
+        return {'namespaces': {'alice': {'vector_count': 3}}}
+
+
+class RecordingPinecone:
+    def __init__(self):
+        self.index = RecordingIndex()
+
+    def list_indexes(self):
+        return type('Indexes', (), {'names': lambda self: ["shared"]})()
+
+    def Index(self, name):
+        return self.index
+
+
+def test_rate_limiter_allows_burst_then_waits():
+    limiter = RateLimiter(rate=100, capacity=10)
+    assert limiter.acquire(10) == 0
+    started = time.monotonic()
+    waited = limiter.acquire(5)
+    assert 0.04 < waited <= 0.05
+    assert time.monotonic() - started >= 0.04
+
+
+def test_tenant_path_and_names(tmp_path):
+    path = tenant_path(str(tmp_path / "lexical_index.sqlite"), "alice@example.com")
+    assert path == str(tmp_path / "tenants" / "alice@example.com" / "lexical_index.sqlite")
+    assert os.path.isdir(os.path.dirname(path))
+    assert tenant_path("sync_state.json") == "sync_state.json"
+    for name in ("", "../bob", "a/b", "-x"):
+        with pytest.raises(ValueError):
+            validate_tenant(name)
+
+
+def test_pinecone_client_stays_in_its_namespace():
+    pc = RecordingPinecone()
+    alice = PineconeClient(api_key="test-tenants", index_name="shared", namespace="alice", pc=pc)
+    bob = PineconeClient(api_key="test-tenants", index_name="shared", namespace="bob", pc=pc)
+    assert alice.index is bob.index
+    alice._upsert_vectors([("m1#0", [0.1], {})])
+    bob.delete_all_emails()
+    assert pc.index.calls == [("upsert", "alice", ["m1#0"]), ("delete", "bob", True)]
+    assert alice.get_email_count() == 3 and bob.get_email_count() == 0
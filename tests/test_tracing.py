@@ -0,0 +1,74 @@
+import asyncio
+import json
+import pytest
+from tracing import Tracer, profiled
+
+
+def test_spans_nest_and_feed_histograms():
+    tracer = Tracer(log_traces=False)
+    for n in range(10):
+        with tracer.span("answer") as root:
+            with tracer.span("embed", texts=1, bytes=100) as child:
+                pass
+    assert child.parent is root and root.children == [child]
+    stats = tracer.stats()
+    assert stats['answer']['count'] == 10
+    assert stats['embed']['attributes'] == {'texts': 10, 'bytes': 1000}
+    assert stats['embed']['p50_ms'] <= stats['embed']['p99_ms'] <= stats['embed']['max_ms']
+    assert json.loads(tracer.export_json()) == stats
+
+
+def test_spans_follow_asyncio_tasks():
+    tracer = Tracer(log_traces=False)
+
+    def lexical_search():
+        with tracer.span("lexical_search"):
+            pass
+
+    async def request(name):
+        with tracer.span("answer", question=name) as root:
+            await asyncio.sleep(0)
+            with tracer.span("retrieve"):
+                await asyncio.sleep(0)
+            await asyncio.to_thread(lexical_search)
+        return root
+
+    async def main():
+        return await asyncio.gather(request("a"), request("b"))
+
+    for root in asyncio.run(main()):
+        assert [child.name for child in root.children] == ["retrieve", "lexical_search"]
+
+
+def test_error_and_detached_spans():
+    tracer = Tracer(log_traces=False)
+    with pytest.raises(ValueError):
+        with tracer.span("completion"):
+            raise ValueError()
+    with tracer.span("answer") as span:
+        span.detach()
+    assert 'answer' not in tracer.stats()
+    span.end()
+    span.end()
+    assert tracer.stats()['answer']['count'] == 1
+    assert tracer.stats()['completion']['count'] == 1
+
+
+def test_prometheus_export():
+    tracer = Tracer(log_traces=False)
+    with tracer.span("vector_query", matches=15):
+        pass
+    text = tracer.export_prometheus()
+    assert '# TYPE rag_stage_duration_seconds summary' in text
+    assert 'rag_stage_duration_seconds{stage="vector_query",quantile="0.99"}' in text
+    assert 'rag_stage_duration_seconds_count{stage="vector_query"} 1' in text
+    assert 'rag_stage_attribute_total{stage="vector_query",attribute="matches"} 15' in text
+
+
+def test_profiled(tmp_path):
+    path = tmp_path / "answer.prof"
+    with profiled(path=str(path)):
+        sum(range(1000))
+    assert path.stat().st_size > 0
+    with profiled(False) as profiler:
+        assert profiler is None